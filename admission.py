@@ -0,0 +1,176 @@
+from flask import g, jsonify, request
+from metrics import Counter
+
+import math
+import os
+import threading
+import time
+
+# Per-route concurrency limits as "rule=limit,..." (Flask URL rules); routes not listed get
+# ROUTE_CONCURRENCY_DEFAULT, 0 means unlimited
+ROUTE_LIMITS = os.getenv(
+    "ROUTE_LIMITS",
+    "/api/login=4,/api/register=4,/api/forgot-password=4,/api/activity-data=8,/api/export=2,/api/log-batch=4,"
+    "/api/logs/delete=2"
+)
+ROUTE_CONCURRENCY_DEFAULT = int(os.getenv("ROUTE_CONCURRENCY_DEFAULT", "0"))
+
+# Per-route latency budgets (seconds) as "rule=seconds,..."; a limited route whose recent latency is
+# over budget lowers its own limit until it recovers
+ROUTE_LATENCY_BUDGETS = os.getenv("ROUTE_LATENCY_BUDGETS", "/api/login=1.0,/api/activity-data=0.5")
+
+# How many requests may wait for a slot (per route, as a multiple of its limit) and for how long (seconds)
+ROUTE_QUEUE_FACTOR = float(os.getenv("ROUTE_QUEUE_FACTOR", "1"))
+ROUTE_QUEUE_TIMEOUT = float(os.getenv("ROUTE_QUEUE_TIMEOUT", "0.25"))
+
+# Never limited: monitoring and static files
+EXEMPT_ENDPOINTS = {"static", "carbon.get_metrics"}
+
+
+def _parseRouteMap(value, cast):
+    routes = {}
+    for part in filter(None, (p.strip() for p in value.split(","))):
+        rule, _, setting = part.rpartition("=")
+        if rule:
+            routes[rule.strip()] = cast(setting)
+    return routes
+
+
+class Shed(Exception):
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RouteGate:
+    # Concurrency limit for one route, lowered while latency is over budget and raised again as it recovers
+    def __init__(self, limit, budget=None, queue_factor=ROUTE_QUEUE_FACTOR, queue_timeout=ROUTE_QUEUE_TIMEOUT):
+        self.max_limit = limit
+        self.limit = float(limit)
+        self.budget = budget
+        self.queue_limit = max(int(math.ceil(limit * queue_factor)), 0)
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.latency = 0.0  # moving average of recent requests (seconds)
+        self.admitted = 0
+        self.shed = {"queue_full": 0, "timeout": 0}
+        self._cond = threading.Condition()
+
+    def _free(self):
+        return self.in_flight < max(int(self.limit), 1)
+
+    def _retry_after(self):
+        # Roughly how long the current backlog takes to clear, at least a second
+        per_slot = self.latency or self.queue_timeout
+        return max(int(math.ceil(per_slot * (self.waiting + 1) / max(int(self.limit), 1))), 1)
+
+    def acquire(self):
+        with self._cond:
+            if self._free():
+                self.in_flight += 1
+                self.admitted += 1
+                return
+            if self.waiting >= self.queue_limit:
+                self.shed["queue_full"] += 1
+                raise Shed(429, "queue_full", self._retry_after())
+            self.waiting += 1
+            try:
+                admitted = self._cond.wait_for(self._free, self.queue_timeout)
+            finally:
+                self.waiting -= 1
+            if not admitted:
+                self.shed["timeout"] += 1
+                raise Shed(503, "timeout", self._retry_after())
+            self.in_flight += 1
+            self.admitted += 1
+
+    def release(self, took):
+        with self._cond:
+            self.in_flight -= 1
+            self.latency = took if not self.latency else 0.8 * self.latency + 0.2 * took
+            if self.budget is not None:
+                if self.latency > self.budget:
+                    self.limit = max(self.limit * 0.9, 1.0)
+                else:
+                    self.limit = min(self.limit + 1.0 / self.limit, float(self.max_limit))
+            # Raising the limit can free more than this one slot; every waiter re-checks, and the queue is bounded
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "max_limit": self.max_limit,
+                "budget_seconds": self.budget,
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "latency_seconds": self.latency,
+                "admitted": self.admitted,
+                "shed_queue_full": self.shed["queue_full"],
+                "shed_timeout": self.shed["timeout"]
+            }
+
+
+class AdmissionControl:
+    """Per-route concurrency limits with fast rejection, for every route on the app.
+
+    A request that finds its route at its limit waits up to
+    ROUTE_QUEUE_TIMEOUT for a slot. If too many are already waiting it gets
+    a 429; if the wait runs out it gets a 503. Both carry Retry-After. So a
+    burst of logins or long chart queries is turned away early instead of
+    tying up every worker, and cheap routes keep answering.
+    """
+
+    def __init__(self, limits=None, default_limit=ROUTE_CONCURRENCY_DEFAULT, budgets=None):
+        self.limits = _parseRouteMap(ROUTE_LIMITS, int) if limits is None else limits
+        self.budgets = _parseRouteMap(ROUTE_LATENCY_BUDGETS, float) if budgets is None else budgets
+        self.default_limit = default_limit
+        self._gates = {}
+        self._lock = threading.Lock()
+        self.shed_total = Counter(
+            "http_requests_shed_total", "Requests turned away by admission control.", ("route", "reason"))
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def gate(self, rule):
+        gate = self._gates.get(rule)
+        if gate is None:
+            limit = self.limits.get(rule, self.default_limit)
+            if limit <= 0:
+                return None
+            with self._lock:
+                gate = self._gates.setdefault(rule, RouteGate(limit, self.budgets.get(rule)))
+        return gate
+
+    def _before_request(self):
+        if request.url_rule is None or request.endpoint in EXEMPT_ENDPOINTS:
+            return None
+        gate = self.gate(request.url_rule.rule)
+        if gate is None:
+            return None
+        try:
+            gate.acquire()
+        except Shed as e:
+            self.shed_total.inc((request.url_rule.rule, e.reason))
+            response = jsonify({"success": False, "message": "Server is busy, please try again shortly."})
+            response.status_code = e.status
+            response.headers["Retry-After"] = str(e.retry_after)
+            return response
+        g.admission_gate = gate
+        g.admission_start = time.perf_counter()
+        return None
+
+    def _teardown_request(self, exception=None):
+        gate = g.pop("admission_gate", None)
+        if gate is not None:
+            gate.release(time.perf_counter() - g.pop("admission_start"))
+
+    def stats(self):
+        with self._lock:
+            gates = dict(self._gates)
+        return {rule: gate.stats() for rule, gate in sorted(gates.items())}
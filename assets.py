@@ -0,0 +1,69 @@
+from flask import request
+
+import hashlib
+import os
+import threading
+
+# Lifetime of a fingerprinted static URL; the fingerprint changes whenever the file does
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", str(365 * 24 * 3600)))
+
+
+class StaticAssets:
+    """Content-hashed URLs and cache headers for files under static/.
+
+    url_for('static', filename=...) gets a ?v=<digest of the file> argument,
+    so a response for that exact URL can be cached for STATIC_MAX_AGE and
+    marked immutable. Requests without the current digest are served with
+    no-cache and revalidate through Flask's own ETag/Last-Modified.
+    """
+
+    def __init__(self):
+        self._digests = {}  # filename -> (mtime, size, digest)
+        self._lock = threading.Lock()
+        self.static_folder = None
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        app.url_defaults(self._add_version)
+        app.after_request(self._cache_headers)
+
+    ## digests -------------------------------------------------------------------
+    def digest(self, filename):
+        # Short content hash, recomputed only when the file's mtime or size changes; None if missing
+        path = os.path.join(self.static_folder, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._digests.get(filename)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        with open(path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:12]
+        with self._lock:
+            self._digests[filename] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    ## hooks ---------------------------------------------------------------------
+    def _add_version(self, endpoint, values):
+        if endpoint == "static" and "filename" in values and "v" not in values:
+            digest = self.digest(values["filename"])
+            if digest:
+                values["v"] = digest
+
+    def _cache_headers(self, response):
+        if request.endpoint != "static" or response.status_code not in (200, 304):
+            return response
+        filename = (request.view_args or {}).get("filename")
+        version = request.args.get("v")
+        if version and filename and version == self.digest(filename):
+            response.cache_control.public = True
+            response.cache_control.max_age = STATIC_MAX_AGE
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        else:
+            response.cache_control.public = True
+            response.cache_control.no_cache = True
+            response.cache_control.max_age = None
+        return response
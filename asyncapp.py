@@ -0,0 +1,270 @@
+"""Async serving mode for the hot API endpoints.
+
+/api/items, /api/log-appliance, /api/log-transport, /api/log-food and
+/api/activity-data run as coroutines on an async SQLAlchemy engine, so a
+single event loop serves many concurrent requests. Everything else is
+handed to the normal Flask app, which keeps working on its own too.
+
+    pip install -r requirements-async.txt
+    uvicorn asyncapp:app
+
+The async URL is derived from DATABASE_URL (mssql+pyodbc -> mssql+aioodbc,
+sqlite -> sqlite+aiosqlite) unless ASYNC_DATABASE_URL is set, so it can be
+tried locally with DATABASE_URL=sqlite:///local.db.
+
+The async routes share the Flask app's per-route admission limits (the
+same RouteGate objects, so a route's limit covers both modes) and its
+request latency and status counts at /metrics. A successful log write sets
+the same read-your-writes session flag as a Flask write, so the user's
+reads through the Flask app stay on the primary for REPLICA_STICKY_SECONDS.
+Not covered: per-request SQL counts and times, and the sampling profiler.
+The async routes always use the primary database.
+"""
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route, Mount
+from werkzeug.http import http_date, parse_date, parse_etags
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from itsdangerous import BadSignature
+from a2wsgi import WSGIMiddleware
+from contextlib import asynccontextmanager
+from admission import Shed
+from replica import STICKY_KEY
+
+import carbon
+import asyncio
+import os
+import time
+
+
+def asyncDatabaseUrl(url):
+    for sync_driver, async_driver in (("mssql+pyodbc", "mssql+aioodbc"),
+                                      ("sqlite+pysqlite", "sqlite+aiosqlite"),
+                                      ("sqlite", "sqlite+aiosqlite")):
+        if url.startswith(sync_driver + "://"):
+            return async_driver + url[len(sync_driver):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or asyncDatabaseUrl(carbon.DATABASE_URL)
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **carbon.engineOptions(ASYNC_DATABASE_URL))
+carbon.metrics.instrument_engine(async_engine.sync_engine)
+AsyncSessionFactory = async_sessionmaker(async_engine, expire_on_commit=False)
+
+LOGGED_MESSAGES = {
+    "appliance": "Appliance logged successfully.",
+    "transport": "Transport logged successfully!",
+    "food": "Food logged successfully!",
+}
+
+
+## functions ---------------------------------------------------------------------------------------------
+# Read the Flask session cookie so both modes share one login
+def sessionData(request):
+    flask_app = carbon.app
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    cookie = request.cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    if serializer is None or not cookie:
+        return {}
+    try:
+        return serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+# Same rule as carbon.login_required, returns the session or None
+def loggedInSession(request):
+    data = sessionData(request)
+    if "user_id" not in data or "username" not in data:
+        return None
+    return data
+
+def failure(message, status):
+    return JSONResponse({"success": False, "message": message}, status_code=status)
+
+def authRequired():
+    return failure("Authentication required", 401)
+
+# Same as the Flask app's replica router after a successful write: the user's reads stay on the primary for
+# a while. The flag lives in the Flask session cookie, so it is signed and set by Flask's session interface
+def stickToPrimary(response, session):
+    flask_app = carbon.app
+    router = flask_app.extensions["carbon"].replica_router
+    if not router.enabled:
+        return response
+    interface = flask_app.session_interface
+    updated = interface.session_class(session)
+    updated[STICKY_KEY] = time.time() + router.sticky_seconds
+    cookie = flask_app.response_class()
+    interface.save_session(flask_app, updated, cookie)
+    for value in cookie.headers.getlist("Set-Cookie"):
+        response.headers.append("set-cookie", value)
+    return response
+
+# Wrap an async endpoint in the Flask app's admission gate for rule (a Flask URL rule) and record it in the
+# request metrics under the same labels. The gate may wait for a slot, so it's taken on a worker thread
+def served(rule, endpoint):
+    async def serve(request):
+        gate = carbon.admission.gate(rule)
+        if gate is not None:
+            try:
+                await asyncio.to_thread(gate.acquire)
+            except Shed as e:
+                carbon.admission.shed_total.inc((rule, e.reason))
+                response = failure("Server is busy, please try again shortly.", e.status)
+                response.headers["Retry-After"] = str(e.retry_after)
+                return response
+        start = time.perf_counter()
+        status = 500
+        try:
+            response = await endpoint(request)
+            status = response.status_code
+            return response
+        finally:
+            took = time.perf_counter() - start
+            if gate is not None:
+                gate.release(took)
+            labels = (rule, request.method)
+            carbon.metrics.request_latency.observe(labels, took)
+            carbon.metrics.requests.inc(labels + (str(status),))
+
+    serve.__name__ = endpoint.__name__
+    return serve
+
+# Reload stale reference data on a worker thread rather than blocking the event loop
+async def freshCatalog():
+    if carbon.catalog.stale():
+        await asyncio.to_thread(carbon.catalog.refresh)
+    return carbon.catalog
+
+
+# Same conditional request rules as carbon.catalogNotModified
+def catalogNotModified(request, etag, last_modified):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(etag)
+    since = parse_date(request.headers.get("if-modified-since"))
+    return since is not None and last_modified <= since
+
+def catalogHeaders(response, etag, last_modified):
+    response.headers["ETag"] = f'"{etag}"'
+    response.headers["Last-Modified"] = http_date(last_modified)
+    response.headers["Cache-Control"] = f"private, max-age={carbon.CATALOG_MAX_AGE}"
+    return response
+
+
+## API endpoints ---------------------------------------------------------------------------------------
+async def get_items(request):
+    if loggedInSession(request) is None:
+        return authRequired()
+
+    catalog = await freshCatalog()
+    etag, last_modified = catalog.validators()
+    activity = request.path_params["activity"]
+    items = catalog.items(activity, request.path_params["category"])
+
+    # Same order as carbon.get_items: an unknown activity or category is an error whatever ETag the client holds
+    if items is None:
+        if activity == "transport":
+            return JSONResponse({"error": "Invalid transport category"}, status_code=400)
+        return JSONResponse({"error": "Invalid activity type"}, status_code=400)
+
+    if catalogNotModified(request, etag, last_modified):
+        return catalogHeaders(Response(status_code=304), etag, last_modified)
+
+    return catalogHeaders(JSONResponse(items), etag, last_modified)
+
+
+def logEndpoint(activity):
+    async def log_entry(request):
+        session = loggedInSession(request)
+        if session is None:
+            return authRequired()
+        # Same ownership rule as the Flask endpoints: the session's user, a body userID has to match it
+        user_id = session["user_id"]
+
+        try:
+            data = await request.json()
+
+            if not carbon.bodyOwnerMatches(data, user_id):
+                return failure("userID does not match the logged in user.", 403)
+
+            # A catalog miss can reload from the database, keep that off the loop
+            await freshCatalog()
+            entry = await asyncio.to_thread(carbon.prepareLogEntry, activity, data)
+
+            if carbon.ingest_queue is not None:
+                # Write-behind mode: queue it like the Flask endpoints do
+                key = carbon.ingestKey(user_id, request.headers.get("idempotency-key"))
+                key = await asyncio.to_thread(carbon.ingest_queue.enqueue, user_id, entry, key)
+                return stickToPrimary(JSONResponse({"success": True, "message": LOGGED_MESSAGES[activity],
+                                                    "queued": True, "idempotencyKey": key}, status_code=202), session)
+
+            async with AsyncSessionFactory() as db_session:
+                await db_session.run_sync(carbon.insertActivityLog, user_id, entry)
+                await db_session.commit()
+
+            return stickToPrimary(JSONResponse({"success": True, "message": LOGGED_MESSAGES[activity]}), session)
+
+        except ValueError as e:
+            return failure(str(e), 400)
+        except LookupError as e:
+            return failure(str(e), 404)
+        except Exception as e:
+            return failure(str(e), 500)
+
+    log_entry.__name__ = f"log_{activity}"
+    return log_entry
+
+
+async def get_activity_data(request):
+    session = loggedInSession(request)
+    if session is None:
+        return authRequired()
+
+    try:
+        start_date = request.query_params.get("start")
+        end_date = request.query_params.get("end")
+
+        if not start_date or not end_date:
+            return failure("Start and end dates are required.", 400)
+
+        async with AsyncSessionFactory() as db_session:
+            response = await db_session.run_sync(
+                carbon.fetchActivityData, session["user_id"], start_date, end_date,
+                request.query_params.get("granularity")
+            )
+
+        return JSONResponse(response)
+
+    except ValueError as e:
+        return failure(str(e), 400)
+    except Exception as e:
+        return failure(str(e), 500)
+
+
+# The server is starting: warm the Flask app up (pool, catalog, templates) before the first request
+@asynccontextmanager
+async def lifespan(app):
+    await asyncio.to_thread(carbon.create_app)
+    yield
+    await async_engine.dispose()
+
+
+# Async routes first, anything else falls through to Flask
+# Flask compresses its own responses; the middleware skips anything already carrying Content-Encoding
+app = Starlette(
+    routes=[
+        Route("/api/items/{activity}/{category}", served("/api/items/<activity>/<category>", get_items),
+              methods=["GET"]),
+        Route("/api/log-appliance", served("/api/log-appliance", logEndpoint("appliance")), methods=["POST"]),
+        Route("/api/log-transport", served("/api/log-transport", logEndpoint("transport")), methods=["POST"]),
+        Route("/api/log-food", served("/api/log-food", logEndpoint("food")), methods=["POST"]),
+        Route("/api/activity-data", served("/api/activity-data", get_activity_data), methods=["GET"]),
+        Mount("/", app=WSGIMiddleware(carbon.app)),
+    ],
+    middleware=[Middleware(GZipMiddleware, minimum_size=carbon.compressor.min_bytes,
+                           compresslevel=carbon.compressor.level)],
+    lifespan=lifespan
+)
@@ -0,0 +1,146 @@
+"""Build a local SQLite database full of synthetic users and activity logs.
+
+    python -m bench.generate --db bench.db --users 5000 --logs 2000000
+
+Applies the migrations in migrations/sqlite, adds --users accounts that all
+share the password "benchpass" (hashed once at BCRYPT_LOG_ROUNDS) and
+store their email as a digest like /api/register does, so EMAIL_PEPPER
+(from the environment or .env) must match the app's; spreads
+--logs ActivityLog rows over the last --days days and rebuilds the
+daily rollup, so the app can be pointed at it with DATABASE_URL.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+import bcrypt
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv()
+sys.path.insert(0, ROOT)
+import migrate  # noqa: E402
+from hashing import emailDigest  # noqa: E402
+
+BENCH_PASSWORD = "benchpass"
+
+
+def benchUsername(user_id):
+    return f"bench{user_id:06d}"
+
+
+def benchEmail(user_id):
+    return f"{benchUsername(user_id)}@example.invalid"
+
+
+def createSchema(path):
+    engine = create_engine(f"sqlite:///{os.path.abspath(path)}")
+    try:
+        return migrate.migrate(engine)
+    finally:
+        engine.dispose()
+
+
+def addUsers(connection, count):
+    rounds = int(os.getenv("BCRYPT_LOG_ROUNDS", "12"))
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+    start = connection.execute("SELECT COALESCE(MAX(UserID), 0) FROM UserDetails").fetchone()[0] + 1
+    # Like /api/register: the digest goes in both email columns, the address itself isn't kept
+    rows = []
+    for i in range(start, start + count):
+        digest = emailDigest(benchEmail(i))
+        rows.append((i, benchUsername(i), digest, digest, password_hash))
+    connection.executemany(
+        "INSERT INTO UserDetails (UserID, username, email, EmailDigest, password) VALUES (?, ?, ?, ?, ?)", rows
+    )
+    return list(range(start, start + count))
+
+
+def referenceItems(connection):
+    # (ActivityTypeID, item id, quantity per unit, Co2e per quantity) for every item; an appliance
+    # unit is an hour of use, its quantity in kWh priced at the seeded grid intensity
+    items = [(1, item_id, kwh, 0.207074) for item_id, kwh in
+             connection.execute("SELECT ApplianceID, AverageKWH FROM Appliance")]
+    items += [(2, item_id, 1.0, co2e) for item_id, co2e in
+              connection.execute("SELECT TransportID, Co2e FROM Transport")]
+    items += [(4, item_id, 1.0, co2e) for item_id, co2e in
+              connection.execute("SELECT FoodID, Co2e FROM Food")]
+    return items
+
+
+def addLogs(connection, user_ids, count, days, batch, rng):
+    items = referenceItems(connection)
+    now = datetime.now().replace(microsecond=0)
+    span = days * 24 * 3600
+    next_id = connection.execute("SELECT COALESCE(MAX(ActivityLogID), 0) FROM ActivityLog").fetchone()[0] + 1
+
+    # Skew activity so a few users have very deep histories, like real heavy users
+    weights = [1.0 / (rank + 1) ** 0.8 for rank in range(len(user_ids))]
+    written = 0
+    started = time.perf_counter()
+    while written < count:
+        size = min(batch, count - written)
+        users = rng.choices(user_ids, weights=weights, k=size)
+        logs = []
+        for user_id in users:
+            type_id, item_id, per_unit, factor = rng.choice(items)
+            log_time = now - timedelta(seconds=rng.randrange(span))
+            quantity = round(per_unit * rng.uniform(0.1, 5.0), 4)
+            logs.append((next_id, user_id, item_id, type_id, quantity * factor, quantity, log_time))
+            next_id += 1
+        connection.executemany(
+            "INSERT INTO ActivityLog (ActivityLogID, UserID, ActivityItemID, ActivityTypeID, Co2e, Quantity, LogTime)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            logs
+        )
+        connection.commit()
+        written += size
+        rate = written / (time.perf_counter() - started)
+        print(f"\r  {written:,}/{count:,} logs ({rate:,.0f} rows/s)", end="", file=sys.stderr)
+    print(file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="bench.db", help="SQLite file to create or extend")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--logs", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=730, help="spread logs over this many past days")
+    parser.add_argument("--batch", type=int, default=50000, help="rows per insert transaction")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    print(f"Migrating schema in {args.db}", file=sys.stderr)
+    createSchema(args.db)
+
+    connection = sqlite3.connect(args.db)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = OFF")
+
+    print(f"Adding {args.users:,} users", file=sys.stderr)
+    user_ids = addUsers(connection, args.users)
+    connection.commit()
+
+    print(f"Adding {args.logs:,} logs over {args.days} days", file=sys.stderr)
+    addLogs(connection, user_ids, args.logs, args.days, args.batch, rng)
+    connection.execute("PRAGMA synchronous = NORMAL")
+    connection.close()
+
+    # Let the app rebuild its own rollup so the numbers match what it maintains
+    print("Rebuilding DailyCo2eRollup", file=sys.stderr)
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.abspath(args.db)}"
+    import carbon
+    with carbon.engine.begin() as db:
+        rows = carbon.rebuildRollup(db)
+    print(f"Done: {rows:,} rollup rows", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
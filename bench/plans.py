@@ -0,0 +1,199 @@
+"""Check the query plans of the hot paths for full scans of the big tables.
+
+    python -m bench.generate --db bench.db
+    DATABASE_URL=sqlite:///bench.db python -m bench.plans
+
+Drives the hot routes once through Flask's test client as a bench user,
+records every SQL statement they issue, then asks the database for each
+statement's plan (EXPLAIN QUERY PLAN on SQLite, SHOWPLAN_XML on MSSQL).
+Exits non-zero if any plan scans a whole ActivityLog, DailyCo2eRollup or
+UserDetails table, so a dropped or unusable index
+fails CI instead of showing up as a slow page.
+
+The write routes log a small batch and delete it again, and this week's
+/api/compare summary is recomputed, so point this at a bench or throwaway
+database, not production.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import xml.etree.ElementTree as ElementTree
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+from bench.generate import BENCH_PASSWORD, benchEmail, benchUsername  # noqa: E402
+
+# Tables that grow with users and logs; the reference tables are small enough to scan
+BIG_TABLES = {"activitylog", "dailyco2erollup", "userdetails"}
+
+_DML = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH|MERGE)\b", re.IGNORECASE)
+_TABLE_REF = re.compile(r"\b(?:FROM|JOIN|INTO|UPDATE|MERGE)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_NOT_ALIAS = {"on", "where", "join", "inner", "left", "right", "outer", "cross", "group", "order", "with",
+              "using", "set", "values", "select", "as", "output", "returning", "union", "limit", "top"}
+_SQLITE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)", re.IGNORECASE)
+_SHOWPLAN_NS = "{http://schemas.microsoft.com/sqlserver/2004/07/showplan}"
+_MSSQL_SCANS = {"Table Scan", "Clustered Index Scan", "Index Scan"}
+
+
+## exercising the app ------------------------------------------------------------------------------------
+def exercise(client, user_id):
+    # One pass over the hot routes; returns nothing, the engine listener records the SQL
+    client.post("/api/login", json={"username": benchUsername(user_id), "password": BENCH_PASSWORD})
+    client.post("/api/login", json={"username": benchUsername(user_id), "password": "wrong password"})
+    client.post("/api/login", json={"username": benchUsername(user_id), "password": BENCH_PASSWORD})
+    client.post("/api/register", json={"username": benchUsername(user_id), "email": "dup@example.invalid",
+                                       "password": "x" * 12, "confirm_password": "x" * 12})
+    client.post("/api/forgot-password", json={"username": benchUsername(user_id), "email": benchEmail(user_id)})
+
+    client.get("/userlog/1")
+    response = client.get("/api/logs")
+    cursor = response.get_json().get("next") if response.status_code == 200 else None
+    if cursor:
+        client.get(f"/api/logs?after={cursor}")
+        client.get(f"/userlog/1?before={cursor}")
+
+    today = date.today()
+    client.get(f"/api/activity-data?start={today - timedelta(days=30)}&end={today}")
+    client.get(f"/api/activity-data?start={today - timedelta(days=365)}&end={today}")
+    client.get(f"/api/activity-data?start={today - timedelta(days=5 * 365)}&end={today}&granularity=month")
+    import carbon
+    carbon.distributions.refresh("week", today)
+    client.get("/api/compare?period=week")
+    client.get("/api/export?format=ndjson").get_data()
+    client.get(f"/api/export?format=csv&start={today - timedelta(days=7)}&end={today}").get_data()
+
+    log_time = datetime.now().replace(microsecond=0).isoformat()
+    entries = []
+    for activity, category in (("appliance", None), ("food", None), ("transport", "personal")):
+        names = []
+        if category:
+            names = carbon.catalog.items(activity, category) or []
+        else:
+            types = carbon.getApplianceTypes() if activity == "appliance" else carbon.getFoodTypes()
+            for item_type in types:
+                names = carbon.catalog.items(activity, item_type)
+                if names:
+                    break
+        if not names:
+            continue
+        entry = {"type": activity, "logTime": log_time}
+        name = names[0]["name"]
+        if activity == "appliance":
+            entries.append(dict(entry, applianceName=name, usageTime=1, wattage=1))
+        elif activity == "food":
+            entries.append(dict(entry, foodName=name, quantity=1))
+        else:
+            entries.append(dict(entry, transportName=name, distance=1))
+
+    if entries:
+        response = client.post("/api/log-batch", json={"entries": entries})
+        logged = [r["activityLogId"] for r in (response.get_json() or {}).get("results", []) if r.get("success")]
+        if logged:
+            client.post(f"/delete_log/{logged[0]}")
+            client.post("/api/logs/delete", json={"ids": logged[1:]})
+    # A range with nothing in it, to check the plan without deleting bench data
+    client.post("/api/logs/delete", json={"start": "1990-01-01", "end": "1990-01-31"})
+
+
+## plans -------------------------------------------------------------------------------------------------
+def tableAliases(statement):
+    # alias (or bare table name) -> table name, both lower-cased
+    aliases = {}
+    for table, alias in _TABLE_REF.findall(statement):
+        aliases[table.lower()] = table.lower()
+        if alias and alias.lower() not in _NOT_ALIAS:
+            aliases[alias.lower()] = table.lower()
+    return aliases
+
+def sqlitePlan(connection, statement, parameters):
+    rows = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+    lines = [row[-1] for row in rows]
+    aliases = tableAliases(statement)
+    scans = []
+    for line in lines:
+        match = _SQLITE_SCAN.match(line)
+        if match and aliases.get(match.group(1).lower(), match.group(1).lower()) in BIG_TABLES:
+            scans.append(line)
+    return lines, scans
+
+def mssqlPlan(connection, statement, parameters):
+    connection.exec_driver_sql("SET SHOWPLAN_XML ON")
+    try:
+        plan = connection.exec_driver_sql(statement, parameters).scalar()
+    finally:
+        connection.exec_driver_sql("SET SHOWPLAN_XML OFF")
+    scans = []
+    for op in ElementTree.fromstring(plan).iter(_SHOWPLAN_NS + "RelOp"):
+        if op.get("PhysicalOp") not in _MSSQL_SCANS:
+            continue
+        for obj in op.iter(_SHOWPLAN_NS + "Object"):
+            table = obj.get("Table", "").strip("[]")
+            if table.lower() in BIG_TABLES:
+                scans.append(f"{op.get('PhysicalOp')} {table} {obj.get('Index', '')}".strip())
+    return [plan], scans
+
+def explainAll(engine, statements):
+    explain = mssqlPlan if engine.dialect.name == "mssql" else sqlitePlan
+    report = []
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            try:
+                plan, scans = explain(connection, statement, parameters)
+            except Exception as e:
+                plan, scans = [f"could not explain: {e}"], []
+            report.append({"statement": statement, "plan": plan, "scans": scans})
+        connection.rollback()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", type=int, default=1, help="bench user to drive the routes as (1 has the most logs)")
+    parser.add_argument("--json", help="write every statement and its plan to this file")
+    parser.add_argument("--verbose", action="store_true", help="print every plan, not just the failures")
+    args = parser.parse_args(argv)
+
+    import carbon
+    from metrics import normaliseStatement
+
+    # Statement text -> first parameters seen with it; executemany batches are explained with their first row
+    recorded = {}
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if _DML.match(statement) and statement not in recorded:
+            recorded[statement] = parameters[0] if executemany and parameters else parameters
+
+    engine = carbon.appState().engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        exercise(carbon.app.test_client(), args.user)
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    report = explainAll(engine, list(recorded.items()))
+    failed = [entry for entry in report if entry["scans"]]
+
+    for entry in report:
+        if entry["scans"] or args.verbose:
+            print(("FULL SCAN  " if entry["scans"] else "ok         ") + normaliseStatement(entry["statement"])[:200])
+            for line in (entry["scans"] if not args.verbose else entry["plan"]):
+                print("    " + line)
+    print(f"{len(report)} statements checked, {len(failed)} with full scans of "
+          + ", ".join(sorted(BIG_TABLES)), file=sys.stderr)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""Load test the app and report throughput and p50/p95/p99 latency per endpoint.
+
+    python -m bench.generate --db bench.db
+    DATABASE_URL=sqlite:///bench.db python -m bench.run --requests 500 --concurrency 8
+
+By default the app is driven in-process through Flask's test client. Pass
+--url http://host:port to drive a running server instead (the sync app or
+uvicorn asyncapp:app). Users are the bench accounts made by bench.generate.
+
+--json saves the results; --baseline compares p95s against an earlier run
+and exits non-zero if any scenario got slower than --max-regression allows.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+from bench.generate import BENCH_PASSWORD, benchUsername  # noqa: E402
+
+
+## clients -----------------------------------------------------------------------------------------------
+class InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            NoRedirect()
+        )
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method)
+        if data is not None:
+            req.add_header("Content-Type", "application/json")
+        try:
+            with self.opener.open(req) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Measure the redirect itself, like the test client does
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+## scenarios ---------------------------------------------------------------------------------------------
+# Each scenario gets (send, rng, state); send(method, path, body) issues one timed request
+def loginScenario(send, rng, state):
+    user_id = rng.randint(1, state["users"])
+    send("POST", "/api/login", {"username": benchUsername(user_id), "password": BENCH_PASSWORD})
+
+def userlogScenario(send, rng, state):
+    send("GET", "/userlog/1", None)
+
+def logsWalkScenario(send, rng, state):
+    # Page five deep through the JSON API, each page is one timed request
+    cursor = None
+    for _ in range(5):
+        status, body = send("GET", "/api/logs" + (f"?after={cursor}" if cursor else ""), None)
+        cursor = json.loads(body).get("next") if status == 200 else None
+        if not cursor:
+            break
+
+def activityDataScenario(days):
+    def scenario(send, rng, state):
+        end = date.today() - timedelta(days=rng.randrange(0, 365))
+        start = end - timedelta(days=days)
+        send("GET", f"/api/activity-data?start={start}&end={end}", None)
+    return scenario
+
+def itemsScenario(send, rng, state):
+    activity, category = rng.choice(state["categories"])
+    send("GET", f"/api/items/{activity}/{category}", None)
+
+def logScenario(activity):
+    def scenario(send, rng, state):
+        name = rng.choice(state["names"][activity])
+        body = {"userID": state["user_id"], "logTime": time.strftime("%Y-%m-%d %H:%M:%S")}
+        if activity == "appliance":
+            body.update(applianceName=name, usageTime=rng.uniform(0.1, 3), wattage=rng.uniform(0.1, 3))
+            send("POST", "/api/log-appliance", body)
+        elif activity == "transport":
+            body.update(transportName=name, distance=rng.uniform(1, 50))
+            send("POST", "/api/log-transport", body)
+        else:
+            body.update(foodName=name, quantity=rng.uniform(0.1, 2))
+            send("POST", "/api/log-food", body)
+    return scenario
+
+SCENARIOS = {
+    "login": loginScenario,
+    "userlog": userlogScenario,
+    "logs-walk": logsWalkScenario,
+    "activity-data-30d": activityDataScenario(30),
+    "activity-data-365d": activityDataScenario(365),
+    "activity-data-5y": activityDataScenario(5 * 365),
+    "items": itemsScenario,
+    "log-appliance": logScenario("appliance"),
+    "log-transport": logScenario("transport"),
+    "log-food": logScenario("food"),
+}
+
+
+## running -----------------------------------------------------------------------------------------------
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+def runScenario(name, make_client, state, requests, concurrency, seed):
+    scenario = SCENARIOS[name]
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        client = make_client()
+        user_id = rng.randint(1, state["users"])
+        client.request("POST", "/api/login", {"username": benchUsername(user_id), "password": BENCH_PASSWORD})
+        worker_state = dict(state, user_id=user_id)
+
+        def send(method, path, body):
+            started = time.perf_counter()
+            status, response_body = client.request(method, path, body)
+            took = time.perf_counter() - started
+            with lock:
+                latencies.append(took)
+                if status >= 400:
+                    errors[0] += 1
+            return status, response_body
+
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            scenario(send, rng, worker_state)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+# Reference data the scenarios pick from, read through the app itself
+def loadState(make_client, users):
+    client = make_client()
+    client.request("POST", "/api/login", {"username": benchUsername(1), "password": BENCH_PASSWORD})
+    categories = [("transport", "personal"), ("transport", "public")]
+    names = {"appliance": [], "transport": [], "food": []}
+    import carbon
+    for category in carbon.getApplianceTypes():
+        categories.append(("appliance", category))
+    for category in carbon.getFoodTypes():
+        categories.append(("food", category))
+    for activity, category in categories:
+        status, body = client.request("GET", f"/api/items/{activity}/{category}")
+        if status == 200:
+            names[activity].extend(item["name"] for item in json.loads(body))
+    return {"users": users, "categories": categories, "names": names}
+
+def printHeader():
+    print(f"{'scenario':<20} {'reqs':>7} {'errs':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+
+def printResult(r):
+    print(f"{r['scenario']:<20} {r['requests']:>7} {r['errors']:>5} {r['throughput']:>9.1f} "
+          f"{r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f}", flush=True)
+
+# Scenarios whose p95 grew by more than max_regression (a fraction) against the baseline file
+def regressions(results, baseline_path, max_regression):
+    with open(baseline_path) as f:
+        baseline = {r["scenario"]: r for r in json.load(f)}
+    slower = []
+    for r in results:
+        before = baseline.get(r["scenario"])
+        if before and before["p95_ms"] > 0 and r["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+            slower.append((r["scenario"], before["p95_ms"], r["p95_ms"]))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--users", type=int, default=2000, help="number of bench users in the database")
+    parser.add_argument("--requests", type=int, default=300, help="timed requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="run only these scenarios (repeatable)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare against results saved with --json")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="allowed p95 growth over the baseline, as a fraction")
+    args = parser.parse_args(argv)
+
+    import carbon
+    if args.url:
+        make_client = lambda: HttpClient(args.url)  # noqa: E731
+    else:
+        make_client = lambda: InProcessClient(carbon.create_app())  # noqa: E731
+
+    state = loadState(make_client, args.users)
+    printHeader()
+    results = []
+    for name in args.scenario or list(SCENARIOS):
+        results.append(runScenario(name, make_client, state, args.requests, args.concurrency, args.seed))
+        printResult(results[-1])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        slower = regressions(results, args.baseline, args.max_regression)
+        for name, before, after in slower:
+            print(f"REGRESSION {name}: p95 {before:.2f} ms -> {after:.2f} ms", file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
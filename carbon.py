@@ -1,26 +1,74 @@
-from flask import Flask, jsonify, request, session, render_template, g, redirect, url_for, flash
-from sqlalchemy import create_engine, text
+# Startup is timed from the first line of the import, see create_app()
+import time
+STARTUP_BEGAN = time.perf_counter()
+
+from flask import Blueprint, Flask, Response, current_app, has_app_context, jsonify, request, session, render_template, g, redirect, url_for, flash, stream_with_context
+from sqlalchemy import bindparam, create_engine, text
+from sqlalchemy.exc import IntegrityError, InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker
-from flask_bcrypt import Bcrypt
+from sqlalchemy.pool import QueuePool
+from werkzeug.local import LocalProxy
 from dotenv import load_dotenv
 from functools import wraps
-from datetime import datetime
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+
+# Load environment variables before the local modules read their settings from it
+load_dotenv()
 
+from catalog import CatalogCache
+from distribution import DistributionStore, PERIODS, periodBounds
+from hashing import PasswordHasher, HashPoolBusy, emailDigest
+from metrics import Metrics
+from assets import StaticAssets
+from compression import Compressor
+from admission import AdmissionControl
+from profiling import RequestProfiler
+from replica import ReplicaRouter, DATABASE_REPLICA_URL
+from ingest import WriteBehindQueue, INGEST_QUEUE_PATH
+from search import SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT
+
+import atexit
+import base64
+import click
+import csv
+import hmac
+import io
+import json
+import logging
 import os
+import sqlite3
+import threading
+import weakref
 
-# Load environment variables
-load_dotenv()
+# Routes and CLI commands, registered on each app create_app() builds; the module's `app` is built at the end
+web = Blueprint("carbon", __name__, cli_group=None)
 
-# Initialize Flask app
-app = Flask(__name__)
-bcrypt = Bcrypt(app)
+log = logging.getLogger(__name__)
 
-# CO2 emission factor for UK in kg CO2 per kWh
-CO2_PER_KWH = 0.207074
+# Request and SQL instrumentation, served at /metrics
+metrics = Metrics()
+
+# Per-route concurrency limits; over-limit requests get a quick 429/503 with Retry-After
+admission = AdmissionControl()
+metrics.add_metric(admission.shed_total)
+
+# Opt-in sampling profiler (PROFILE_SAMPLE_RATE or the X-Profile header), writes collapsed stacks per route
+profiler = RequestProfiler()
+
+# bcrypt runs on its own bounded worker pool, see hashing.py
+hasher = PasswordHasher()
 
+# Content-hashed static URLs with long cache lifetimes, and gzip for JSON and text assets
+static_assets = StaticAssets()
+compressor = Compressor()
+
+# How long browsers may reuse an item list before revalidating it with its ETag
+CATALOG_MAX_AGE = int(os.getenv("CATALOG_MAX_AGE", "60"))
+
+# CO2 emission factor for UK in kg CO2 per kWh, used when EmissionFactor has no grid intensity for a log's time
+CO2_PER_KWH = 0.207074
 
-# Get the secret key from env
-app.secret_key = os.getenv("FLASK_SECRET_KEY")
 
 # Database configuration
 server = os.getenv("DB_SERVER")
@@ -28,25 +76,168 @@ database = os.getenv("DB_DATABASE")
 username = os.getenv("DB_USERNAME")
 password = os.getenv("DB_PASSWORD")
 driver = os.getenv("DB_DRIVER")
-DATABASE_URL = f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver={driver}"
-
-# Create the database engine
-engine = create_engine(DATABASE_URL)
-
-# Session factory
-SessionFactory = sessionmaker(bind=engine)
-
-# Before each request: create session
-@app.before_request
-def before_request():
-    g.db_session = SessionFactory()
-
-# After each request: close session
-@app.teardown_request
+# DATABASE_URL overrides the DB_* settings, e.g. sqlite:///local.db for local runs
+DATABASE_URL = os.getenv("DATABASE_URL") or f"mssql+pyodbc://{username}:{password}@{server}/{database}?driver={driver}"
+
+
+# Connection pool settings, all overridable from the environment
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds, -1 disables
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# create_engine() arguments for a URL, shared by the sync engine and asyncapp's async one
+def engineOptions(url):
+    options = {"pool_recycle": POOL_RECYCLE, "pool_pre_ping": POOL_PRE_PING}
+    if str(url).startswith("sqlite"):
+        # Local files only: convert declared DATE/TIMESTAMP columns and keep SQLite's default pool
+        options["connect_args"] = {"detect_types": sqlite3.PARSE_DECLTYPES}
+    else:
+        options.update(pool_size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT)
+    return options
+
+# What each app create_app() builds talks to its database through
+class AppState:
+    def __init__(self, database_url, replica_url=None):
+        # create_engine() doesn't connect, the warm-up or the first request does
+        self.engine = create_engine(database_url, **engineOptions(database_url))
+        metrics.instrument_engine(self.engine)
+        self.session_factory = sessionmaker(bind=self.engine)
+
+        # Read-only routes and the catalog read from the replica when there is one, see replica.py
+        replica_engine = None
+        if replica_url:
+            replica_engine = create_engine(replica_url, **engineOptions(replica_url))
+            metrics.instrument_engine(replica_engine)
+        self.replica_router = ReplicaRouter()
+        self.replica_router.configure(self.engine, replica_engine)
+
+        # Reference data cache (activity types, item lists, name lookups), loaded by the warm-up or on first use.
+        # Reference data changes rarely, the catalog can lag the primary as much as the replica does
+        self.catalog = CatalogCache(self.replica_router)
+
+        # Everyone's weekly and monthly totals as histograms, refreshed by the refresh-distributions command
+        self.distributions = DistributionStore(self.engine, ACTIVITY_TYPE_IDS.values())
+        self.warm = False
+
+# Every AppState in this process, for the fork handler
+app_states = weakref.WeakSet()
+
+# The current app's state; outside an app context (background threads, bench scripts) the module app's
+def appState():
+    if has_app_context() and "carbon" in current_app.extensions:
+        return current_app.extensions["carbon"]
+    return default_state
+
+# The current app's engine, session factory, replica router and caches, see AppState
+engine = LocalProxy(lambda: appState().engine)
+SessionFactory = LocalProxy(lambda: appState().session_factory)
+replica_router = LocalProxy(lambda: appState().replica_router)
+catalog = LocalProxy(lambda: appState().catalog)
+distributions = LocalProxy(lambda: appState().distributions)
+
+
+# Counts how long requests wait to check a connection out of the pool
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    # Only a QueuePool has a size and overflow to report. SQLite keeps its default pool (a SingletonThreadPool
+    # in memory, a QueuePool for a file) and POOL_MAX_OVERFLOW isn't applied to it; NullPool and StaticPool
+    # have no counts at all
+    def snapshot(self):
+        pool = engine.pool
+        stats = {}
+        if isinstance(pool, QueuePool):
+            stats.update(pool_size=pool.size(), checked_out=pool.checkedout(), checked_in=pool.checkedin(),
+                         overflow=max(pool.overflow(), 0))
+            if engine.dialect.name != "sqlite":
+                stats["max_overflow"] = POOL_MAX_OVERFLOW
+        with self._lock:
+            return dict(stats, **{
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": self.wait_total,
+                "wait_seconds_avg": self.wait_total / self.checkouts if self.checkouts else 0.0,
+                "wait_seconds_max": self.wait_max
+            })
+
+pool_stats = PoolStats()
+
+# Pool, bcrypt and catalog figures for /metrics
+def metricGauges():
+    rows = [(f"db_pool_{key}", f"Database connection pool {key.replace('_', ' ')}.", value)
+            for key, value in pool_stats.snapshot().items()]
+    rows += [(f"bcrypt_pool_{key}", f"bcrypt worker pool {key.replace('_', ' ')}.", value)
+             for key, value in hasher.stats().items()]
+    rows.append(("catalog_version", "Reference data catalog version.", catalog.version))
+    if replica_router.enabled:
+        rows += [(f"db_replica_{key}", f"Read replica {key.replace('_', ' ')}.",
+                  int(value) if isinstance(value, bool) else value)
+                 for key, value in replica_router.stats().items() if key != "last_error"]
+    if profiler.enabled:
+        rows += [("profiler_requests", "Requests profiled.", profiler.profiled),
+                 ("profiler_samples", "Stack samples taken.", profiler.samples)]
+    rows += [(f"startup_{phase}_seconds", f"Time spent on {phase} at startup.", took)
+             for phase, took in startup_stats["phases"].items()]
+    rows += [(f"distribution_cache_{key}", f"Comparison summary cache {key.replace('_', ' ')}.", value)
+             for key, value in distributions.stats().items()]
+    if ingest_queue is not None:
+        rows += [(f"ingest_queue_{key}", f"Write-behind queue {key.replace('_', ' ')}.",
+                  int(value) if isinstance(value, bool) else value)
+                 for key, value in ingest_queue.stats().items() if key != "last_error"]
+    return rows
+
+metrics.add_gauges(metricGauges)
+
+# The request's database session, created the first time something needs it
+# so pages that never touch the database never check out a connection.
+# Routes marked read_only get a replica connection when one is configured and usable
+def getDbSession():
+    db_session = getattr(g, "db_session", None)
+    if db_session is None:
+        start = time.perf_counter()
+        try:
+            connection = replica_router.connect(g.get("read_only", False))
+        except PoolTimeoutError:
+            pool_stats.record_timeout()
+            raise
+        pool_stats.record(time.perf_counter() - start)
+
+        g.db_connection = connection
+        g.db_session = db_session = SessionFactory(bind=connection)
+    return db_session
+
+# Roll back the request's session, if one was ever opened
+def rollbackDbSession():
+    db_session = getattr(g, "db_session", None)
+    if db_session is not None:
+        db_session.rollback()
+
+# After each request: close session and return the connection to the pool
+@web.teardown_app_request
 def teardown_request(exception=None):
-    db_session = getattr(g, 'db_session', None)
+    db_session = g.pop("db_session", None)
     if db_session:
         db_session.close()
+    connection = g.pop("db_connection", None)
+    if connection:
+        connection.close()
 
 ## functions ---------------------------------------------------------------------------------------------
 # function to ensure that you can only get to the app page when logged in
@@ -56,51 +247,821 @@ def login_required(f):
         if "user_id" not in session or "username" not in session:
             if request.path.startswith("/api/"):
                 return jsonify({"success": False, "message": "Authentication required"}), 401
-            return redirect(url_for("login_page"))
+            return redirect(url_for(".login_page"))
         return f(*args, **kwargs)
     return decorated_function
 
-# Function for retrieving Types from the database
+# Only allow admin endpoints when ADMIN_TOKEN is set and sent in the X-Admin-Token header
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        token = os.getenv("ADMIN_TOKEN")
+        if not token or not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token):
+            return jsonify({"success": False, "message": "Forbidden"}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+# Routes that only read: their queries may go to the read replica, unless the user has just written
+def read_only(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.read_only = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+# 503 telling the client when to try again
+def busyResponse(message, retry_after=1):
+    response = jsonify({"success": False, "message": message})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+# Settings no request can do without: create_app() refuses to start without them rather than the first
+# signup or password reset failing with a 500
+def checkConfig():
+    if not os.getenv("EMAIL_PEPPER"):
+        raise RuntimeError("EMAIL_PEPPER is not configured, registration and password resets need it")
+
+# Function for retrieving Types from the catalog cache
 def getActivityTypes():
-    with engine.connect() as connection:
-        result = connection.execute(text("SELECT ActivityTypeName FROM ActivityType ORDER BY ActivityTypeName"))
-        categories = [row[0] for row in result]
-    return categories
+    return catalog.activity_types()
 
 def getApplianceTypes():
-    with engine.connect() as connection:
-        result = connection.execute(text("SELECT Category FROM ApplianceTypes ORDER BY Category"))
-        types = [row[0] for row in result]
-    return types
+    return catalog.appliance_types()
 
 def getFoodTypes():
-    with engine.connect() as connection:
-        result = connection.execute(text("SELECT TypeName FROM FoodType ORDER BY TypeName"))
-        types = [row[0] for row in result]
-    return types
+    return catalog.food_types()
 
 def getTransportTypes():
+    return catalog.transport_types()
+
+
+# The app's SQL is written for MSSQL, with SQLite variants where they differ so it can run locally
+def isMssql(db):
+    bind = db.get_bind() if hasattr(db, "get_bind") else db
+    return bind.dialect.name == "mssql"
+
+def sqlDate(db, column):
+    return f"CAST({column} AS DATE)" if isMssql(db) else f"date({column})"
+
+# ActivityType IDs and the request fields each kind of log entry needs
+ACTIVITY_TYPE_IDS = {"appliance": 1, "transport": 2, "food": 4}
+LOG_ENTRY_FIELDS = {
+    "appliance": ("applianceName", ["usageTime", "wattage"], "Appliance not found."),
+    "transport": ("transportName", ["distance"], "Transport type not found."),  # distance in miles
+    "food": ("foodName", ["quantity"], "Food item not found."),  # quantity in kg
+}
+
+# Most entries accepted by /api/log-batch
+MAX_BATCH_ENTRIES = int(os.getenv("MAX_BATCH_ENTRIES", "1000"))
+
+# Rows per multi-row INSERT. MSSQL allows at most 2100 parameters in a statement; an ActivityLog row binds six
+# (item, type, Co2e, quantity, logTime, ingest key) plus :user_id once per statement: 6 * 340 + 1 = 2041.
+# The ceiling is 349 rows; a seventh column would need 299 or fewer. The rollup upsert binds four per row
+INSERT_CHUNK_ROWS = 340
+
+# Validate a log entry, look up its item and calculate Co2e with the emission factor in force at its logTime
+# Raises ValueError for bad input and LookupError when the item doesn't exist
+def prepareLogEntry(activity, data):
+    if activity not in LOG_ENTRY_FIELDS:
+        raise ValueError("Invalid activity type.")
+
+    name_field, amount_fields, not_found = LOG_ENTRY_FIELDS[activity]
+    name = data.get(name_field)
+    amounts = [data.get(field) for field in amount_fields]
+    log_time = data.get("logTime")
+
+    if not all([name, log_time] + amounts):
+        raise ValueError("Missing required fields.")
+
+    try:
+        amounts = [float(amount) for amount in amounts]
+    except (TypeError, ValueError):
+        raise ValueError("Invalid number in entry.")
+
+    # Accepts "2025-01-31 13:45:00" (what the item page sends) as well as ISO 8601. LogTime is stored
+    # naive in the server's local time, so an offset ("...+02:00", "...Z") is converted to that first
+    try:
+        log_time = datetime.fromisoformat(str(log_time))
+    except ValueError:
+        raise ValueError("Invalid logTime.")
+    if log_time.tzinfo is not None:
+        log_time = log_time.astimezone().replace(tzinfo=None)
+
+    item = catalog.lookup(activity, name)
+    if not item:
+        raise LookupError(not_found)
+
+    # Quantity is what the factor multiplies: kWh for appliances, miles or kg otherwise
+    item_id, item_factor = item
+    type_id = ACTIVITY_TYPE_IDS[activity]
+    if activity == "appliance":
+        usage_time, wattage = amounts
+        quantity = usage_time * wattage
+        default_factor = CO2_PER_KWH
+    else:
+        quantity = amounts[0]
+        default_factor = float(item_factor)
+    factor = catalog.factor_at(type_id, item_id, log_time)
+
+    return {
+        "item_id": item_id,
+        "type_id": type_id,
+        "co2e": quantity * (factor if factor is not None else default_factor),
+        "quantity": quantity,
+        "log_time": log_time
+    }
+
+# Insert one prepared entry into ActivityLog for the user and add it to the daily rollup, returns the new ActivityLogID
+# On MSSQL the insert and the rollup upsert go to the server as one batch, a single round trip
+def insertActivityLog(db_session, user_id, entry):
+    params = dict(entry, user_id=user_id, quantity=entry.get("quantity"))
+    rollup = rollupUpsertSql(db_session, ["(:type_id, :co2e, :log_time, 1)"])
+
+    if isMssql(db_session):
+        # NOCOUNT keeps the insert and merge from sending row counts ahead of the id; turned back
+        # off before the SELECT so later statements on this pooled connection still report them
+        query = f"""
+            SET NOCOUNT ON;
+            DECLARE @ids TABLE (ActivityLogID INT);
+            INSERT INTO ActivityLog (UserID, ActivityItemID, ActivityTypeID, Co2e, Quantity, LogTime)
+            OUTPUT INSERTED.ActivityLogID INTO @ids
+            VALUES (:user_id, :item_id, :type_id, :co2e, :quantity, :log_time);
+            {rollup}
+            SET NOCOUNT OFF;
+            SELECT ActivityLogID FROM @ids;
+        """
+        return db_session.execute(text(query), params).fetchone()[0]
+
+    activity_log_id = db_session.execute(
+        text("""
+            INSERT INTO ActivityLog (UserID, ActivityItemID, ActivityTypeID, Co2e, Quantity, LogTime)
+            VALUES (:user_id, :item_id, :type_id, :co2e, :quantity, :log_time)
+            RETURNING ActivityLogID
+        """),
+        params
+    ).fetchone()[0]
+    db_session.execute(text(rollup), params)
+    return activity_log_id
+
+# Insert many prepared entries with multi-row statements, returns ActivityLogIDs in entry order
+# An entry may carry an ingest_key (see writeQueuedLogs), stored in ActivityLog.IngestKey
+def insertActivityLogs(db_session, user_id, entries):
+    log_ids = []
+    for start in range(0, len(entries), INSERT_CHUNK_ROWS):
+        chunk = entries[start:start + INSERT_CHUNK_ROWS]
+        params = {"user_id": user_id}
+        rows = []
+        for i, entry in enumerate(chunk):
+            # Idx is a literal so the row stays at six parameters, see INSERT_CHUNK_ROWS
+            rows.append(f"({i}, :item_id{i}, :type_id{i}, :co2e{i}, :quantity{i}, :log_time{i}, :ingest_key{i})")
+            params.update({
+                f"item_id{i}": entry["item_id"],
+                f"type_id{i}": entry["type_id"],
+                f"co2e{i}": entry["co2e"],
+                f"quantity{i}": entry.get("quantity"),
+                f"log_time{i}": entry["log_time"],
+                f"ingest_key{i}": entry.get("ingest_key")
+            })
+
+        if isMssql(db_session):
+            # INSERT ... OUTPUT doesn't guarantee row order, MERGE lets us output the source index
+            result = db_session.execute(
+                text(f"""
+                    MERGE INTO ActivityLog
+                    USING (VALUES {", ".join(rows)})
+                        AS src (Idx, ActivityItemID, ActivityTypeID, Co2e, Quantity, LogTime, IngestKey)
+                    ON 1 = 0
+                    WHEN NOT MATCHED THEN
+                        INSERT (UserID, ActivityItemID, ActivityTypeID, Co2e, Quantity, LogTime, IngestKey)
+                        VALUES (:user_id, src.ActivityItemID, src.ActivityTypeID, src.Co2e, src.Quantity, src.LogTime,
+                                src.IngestKey)
+                    OUTPUT src.Idx, INSERTED.ActivityLogID;
+                """),
+                params
+            ).fetchall()
+            chunk_ids = [log_id for _, log_id in sorted(result)]
+        else:
+            # SQLite hands out rowids in VALUES order within one statement
+            result = db_session.execute(
+                text(f"""
+                    WITH src (Idx, ActivityItemID, ActivityTypeID, Co2e, Quantity, LogTime, IngestKey)
+                        AS (VALUES {", ".join(rows)})
+                    INSERT INTO ActivityLog (UserID, ActivityItemID, ActivityTypeID, Co2e, Quantity, LogTime, IngestKey)
+                    SELECT :user_id, ActivityItemID, ActivityTypeID, Co2e, Quantity, LogTime, IngestKey
+                    FROM src ORDER BY Idx
+                    RETURNING ActivityLogID
+                """),
+                params
+            ).fetchall()
+            chunk_ids = sorted(log_id for log_id, in result)
+        log_ids.extend(chunk_ids)
+
+    applyRollupDeltas(db_session, user_id, entries)
+    return log_ids
+
+# Write-behind mode (INGEST_QUEUE_PATH set): the log endpoints queue entries locally and return,
+# a background thread drains them here in batches. Keys already in ActivityLog are skipped so a
+# batch retried after a lost commit acknowledgement isn't written twice
+def writeQueuedLogs(batch):
     with engine.connect() as connection:
-        result = connection.execute(text("SELECT TypeName FROM TransportType ORDER BY TypeName"))
-        types = [row[0] for row in result]
-    return types
+        db_session = SessionFactory(bind=connection)
+        try:
+            existing = {row[0] for row in db_session.execute(
+                text("SELECT IngestKey FROM ActivityLog WHERE IngestKey IN :keys")
+                .bindparams(bindparam("keys", expanding=True)),
+                {"keys": [key for key, _, _ in batch]}
+            )}
+            by_user = {}
+            for key, user_id, entry in batch:
+                if key not in existing:
+                    by_user.setdefault(user_id, []).append(dict(entry, ingest_key=key))
+            for user_id, entries in by_user.items():
+                insertActivityLogs(db_session, user_id, entries)
+            db_session.commit()
+        finally:
+            db_session.close()
+
+ingest_queue = None
+if INGEST_QUEUE_PATH:
+    ingest_queue = WriteBehindQueue(
+        INGEST_QUEUE_PATH, writeQueuedLogs, transient=(OperationalError, InterfaceError, PoolTimeoutError)
+    )
+    atexit.register(ingest_queue.stop)
+
+# Idempotency-Key header -> queue key, namespaced by user so two users can't collide
+def ingestKey(user_id, client_key):
+    if not client_key:
+        return None
+    if len(client_key) > 64 or not client_key.isprintable():
+        raise ValueError("Idempotency-Key must be at most 64 printable characters.")
+    return f"{user_id}:{client_key}"
+
+# Logs always belong to the logged-in user; the body's userID is optional (older clients send it)
+# but when present it has to be that user
+def bodyOwnerMatches(data, user_id):
+    body_user_id = data.get("userID")
+    return body_user_id is None or str(body_user_id) == str(user_id)
+
+# Store one prepared entry for the logged-in user, or queue it when write-behind mode is on; returns the
+# endpoint's response. The owner and the idempotency key namespace come from the session, never the body
+def saveLogEntry(entry, message):
+    user_id = session["user_id"]
+    if ingest_queue is not None:
+        key = ingest_queue.enqueue(user_id, entry, ingestKey(user_id, request.headers.get("Idempotency-Key")))
+        return jsonify({"success": True, "message": message, "queued": True, "idempotencyKey": key}), 202
+
+    insertActivityLog(getDbSession(), user_id, entry)
+    getDbSession().commit()
+    return jsonify({"success": True, "message": message})
+
+# Daily Co2e rollup (DailyCo2eRollup): one row per user, day and activity type, kept in step with ActivityLog
+# Add entries (or take them away with sign=-1) from a user's daily totals; an entry's "count" (default 1)
+# is how many logs it stands for, 0 for a pure Co2e correction
+# Runs in the caller's transaction so the rollup commits or rolls back with the log rows
+def applyRollupDeltas(db_session, user_id, entries, sign=1):
+    for start in range(0, len(entries), INSERT_CHUNK_ROWS):
+        chunk = entries[start:start + INSERT_CHUNK_ROWS]
+        params = {"user_id": user_id}
+        rows = []
+        for i, entry in enumerate(chunk):
+            rows.append(f"(:type_id{i}, :co2e{i}, :log_time{i}, :count{i})")
+            params.update({
+                f"type_id{i}": entry["type_id"],
+                f"co2e{i}": sign * float(entry["co2e"]),
+                f"log_time{i}": entry["log_time"],
+                f"count{i}": sign * entry.get("count", 1)
+            })
+        db_session.execute(text(rollupUpsertSql(db_session, rows)), params)
+
+    if sign < 0:
+        # Days with nothing left logged shouldn't show up on the chart
+        db_session.execute(
+            text("DELETE FROM DailyCo2eRollup WHERE UserID = :user_id AND LogCount <= 0"),
+            {"user_id": user_id}
+        )
 
+# The upsert adding (ActivityTypeID, Co2e, LogTime, LogCount) value rows to :user_id's daily totals
+def rollupUpsertSql(db_session, rows):
+    if not isMssql(db_session):
+        return f"""
+            WITH v (ActivityTypeID, Co2e, LogTime, LogCount) AS (VALUES {", ".join(rows)})
+            INSERT INTO DailyCo2eRollup (UserID, LogDate, ActivityTypeID, TotalCo2e, LogCount)
+            SELECT :user_id, date(LogTime), ActivityTypeID, SUM(Co2e), SUM(LogCount)
+            FROM v
+            GROUP BY date(LogTime), ActivityTypeID
+            ON CONFLICT (UserID, LogDate, ActivityTypeID) DO UPDATE
+            SET TotalCo2e = TotalCo2e + excluded.TotalCo2e, LogCount = LogCount + excluded.LogCount
+        """
+
+    return f"""
+        MERGE INTO DailyCo2eRollup WITH (HOLDLOCK) AS r
+        USING (
+            SELECT CAST(v.LogTime AS DATE) AS LogDate, v.ActivityTypeID,
+                   SUM(v.Co2e) AS Co2e, SUM(v.LogCount) AS LogCount
+            FROM (VALUES {", ".join(rows)}) AS v (ActivityTypeID, Co2e, LogTime, LogCount)
+            GROUP BY CAST(v.LogTime AS DATE), v.ActivityTypeID
+        ) AS src
+        ON r.UserID = :user_id AND r.LogDate = src.LogDate AND r.ActivityTypeID = src.ActivityTypeID
+        WHEN MATCHED THEN
+            UPDATE SET TotalCo2e = r.TotalCo2e + src.Co2e, LogCount = r.LogCount + src.LogCount
+        WHEN NOT MATCHED THEN
+            INSERT (UserID, LogDate, ActivityTypeID, TotalCo2e, LogCount)
+            VALUES (:user_id, src.LogDate, src.ActivityTypeID, src.Co2e, src.LogCount);
+    """
+
+# Rebuild the rollup from ActivityLog, for one user or everyone
+def rebuildRollup(connection, user_id=None):
+    user_filter = "AND al.UserID = :user_id" if user_id is not None else ""
+    log_date = sqlDate(connection, "al.LogTime")
+    connection.execute(
+        text("DELETE FROM DailyCo2eRollup" + (" WHERE UserID = :user_id" if user_id is not None else "")),
+        {"user_id": user_id}
+    )
+    result = connection.execute(
+        text(f"""
+            INSERT INTO DailyCo2eRollup (UserID, LogDate, ActivityTypeID, TotalCo2e, LogCount)
+            SELECT al.UserID, {log_date}, al.ActivityTypeID, SUM(al.Co2e), COUNT(*)
+            FROM ActivityLog al
+            WHERE al.UserID IS NOT NULL {user_filter}
+            GROUP BY al.UserID, {log_date}, al.ActivityTypeID
+        """),
+        {"user_id": user_id}
+    )
+    return result.rowcount
+
+
+# Deleting logs in bounded chunks: no DELETE touches more than DELETE_CHUNK_ROWS rows, well under the
+# ~5000 row locks at which MSSQL escalates to a table lock and under its 2100 parameter limit for id lists
+DELETE_CHUNK_ROWS = int(os.getenv("DELETE_CHUNK_ROWS", "1000"))
+BULK_DELETE_MAX_IDS = int(os.getenv("BULK_DELETE_MAX_IDS", "10000"))
+
+# purge-logs removes logs older than this many days; 0 keeps everything
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "0"))
+
+# Take deleted (UserID, ActivityTypeID, Co2e, LogTime) rows off the daily rollup, one delta per user, day and type
+def removeFromRollup(db_session, rows):
+    by_user = {}
+    for row in rows:
+        if row.UserID is None:
+            continue
+        log_date = row.LogTime.date() if hasattr(row.LogTime, "date") else str(row.LogTime)[:10]
+        totals = by_user.setdefault(row.UserID, {})
+        co2e, count = totals.get((log_date, row.ActivityTypeID), (0.0, 0))
+        totals[(log_date, row.ActivityTypeID)] = (co2e + float(row.Co2e), count + 1)
+    for user_id, totals in by_user.items():
+        entries = [{"type_id": type_id, "co2e": co2e, "log_time": log_date, "count": count}
+                   for (log_date, type_id), (co2e, count) in totals.items()]
+        applyRollupDeltas(db_session, user_id, entries, sign=-1)
+
+# Delete at most `limit` ActivityLog rows matching `where` (unaliased ActivityLog columns) and take them off
+# the rollup, in the caller's transaction; `expanding` names list parameters. Returns the deleted ids
+def deleteLogChunk(db_session, where, params, limit=DELETE_CHUNK_ROWS, expanding=()):
+    columns = ["ActivityLogID", "UserID", "ActivityTypeID", "Co2e", "LogTime"]
+    if isMssql(db_session):
+        query = f"""
+            DELETE TOP ({int(limit)}) FROM ActivityLog
+            OUTPUT {", ".join("DELETED." + column for column in columns)}
+            WHERE {where}
+        """
+    else:
+        query = f"""
+            DELETE FROM ActivityLog
+            WHERE ActivityLogID IN (SELECT ActivityLogID FROM ActivityLog WHERE {where} LIMIT {int(limit)})
+            RETURNING {", ".join(columns)}
+        """
+    statement = text(query).bindparams(*[bindparam(name, expanding=True) for name in expanding])
+    rows = db_session.execute(statement, params).fetchall()
+    removeFromRollup(db_session, rows)
+    return [row.ActivityLogID for row in rows]
+
+# Delete a user's logs, either the given ids or everything logged from start to end (dates, inclusive),
+# committing chunk by chunk. The UserID condition in each DELETE is the ownership check, so ids belonging
+# to someone else are left alone. Returns the ids that were deleted
+def deleteUserLogs(db_session, user_id, log_ids=None, start=None, end=None):
+    deleted = []
+    if log_ids is not None:
+        for i in range(0, len(log_ids), DELETE_CHUNK_ROWS):
+            deleted += deleteLogChunk(
+                db_session, "UserID = :user_id AND ActivityLogID IN :ids",
+                {"user_id": user_id, "ids": log_ids[i:i + DELETE_CHUNK_ROWS]}, expanding=["ids"]
+            )
+            db_session.commit()
+        return deleted
+
+    # end is inclusive, compare against the next midnight so LogTime stays sargable
+    params = {"user_id": user_id, "start": start, "end": end + timedelta(days=1)}
+    while True:
+        chunk = deleteLogChunk(db_session, "UserID = :user_id AND LogTime >= :start AND LogTime < :end", params)
+        db_session.commit()
+        deleted += chunk
+        if len(chunk) < DELETE_CHUNK_ROWS:
+            return deleted
+
+# Recalculating stored Co2e after an EmissionFactor change, see the recalc-co2e command
+# Logs per chunk; each chunk is one transaction, so the job can stop and resume between them
+RECALC_CHUNK_ROWS = int(os.getenv("RECALC_CHUNK_ROWS", "5000"))
+
+# SQL for the Co2e of ActivityLog row al under the factors in force at its LogTime: the item's own
+# EmissionFactor, then the activity type's, then the item's base factor (same order as prepareLogEntry)
+def recalcCo2eSql(db):
+    def factor(item_match):
+        if isMssql(db):
+            return f"""(SELECT TOP 1 ef.Factor FROM EmissionFactor ef
+                        WHERE ef.ActivityTypeID = al.ActivityTypeID AND {item_match} AND ef.ValidFrom <= al.LogTime
+                        ORDER BY ef.ValidFrom DESC)"""
+        return f"""(SELECT ef.Factor FROM EmissionFactor ef
+                    WHERE ef.ActivityTypeID = al.ActivityTypeID AND {item_match} AND ef.ValidFrom <= al.LogTime
+                    ORDER BY ef.ValidFrom DESC LIMIT 1)"""
+
+    # A log whose item no longer exists keeps its Co2e
+    return f"""COALESCE(al.Quantity * COALESCE(
+        {factor("ef.ActivityItemID = al.ActivityItemID")},
+        {factor("ef.ActivityItemID IS NULL")},
+        CASE al.ActivityTypeID
+            WHEN 1 THEN :default_kwh
+            WHEN 2 THEN (SELECT t.Co2e FROM Transport t WHERE t.TransportID = al.ActivityItemID)
+            WHEN 4 THEN (SELECT f.Co2e FROM Food f WHERE f.FoodID = al.ActivityItemID)
+        END), al.Co2e)"""
+
+# WHERE clause for the logs a recalculation job covers, with its parameters
+def recalcFilter(type_id=None, item_id=None, since=None):
+    clauses = ["al.Quantity IS NOT NULL"]
+    if type_id is not None:
+        clauses.append("al.ActivityTypeID = :type_id")
+    if item_id is not None:
+        clauses.append("al.ActivityItemID = :item_id")
+    if since is not None:
+        clauses.append("al.LogTime >= :since")
+    return " AND ".join(clauses), {"type_id": type_id, "item_id": item_id, "since": since,
+                                   "default_kwh": CO2_PER_KWH}
+
+# Recalculate the next chunk of a job's logs after ActivityLogID `after` in one transaction: find the
+# chunk's id range, read the rows whose Co2e changes, update them with one set-based UPDATE, apply the
+# differences to the daily rollup and record the job's progress. Returns (last id, rows scanned, rows
+# changed), last id None when nothing is left
+def recalcChunk(connection, job_id, after, chunk_rows, type_id=None, item_id=None, since=None):
+    where, params = recalcFilter(type_id, item_id, since)
+    params.update({"after": after, "job_id": job_id})
+    mssql = isMssql(connection)
+
+    top = f"TOP {int(chunk_rows)}" if mssql else ""
+    limit = "" if mssql else f"LIMIT {int(chunk_rows)}"
+    scanned, upto = connection.execute(
+        text(f"""
+            SELECT COUNT(*), MAX(ActivityLogID) FROM (
+                SELECT {top} al.ActivityLogID FROM ActivityLog al
+                WHERE al.ActivityLogID > :after AND {where}
+                ORDER BY al.ActivityLogID {limit}
+            ) chunk
+        """),
+        params
+    ).fetchone()
+    if not scanned:
+        return None, 0, 0
+    params["upto"] = upto
+
+    recalculated = recalcCo2eSql(connection)
+    in_chunk = f"al.ActivityLogID > :after AND al.ActivityLogID <= :upto AND {where}"
+    changed = f"ABS(al.Co2e - {recalculated}) > 0.000001"
+    lock = "WITH (UPDLOCK)" if mssql else ""
+    changes = connection.execute(
+        text(f"""
+            SELECT al.UserID, al.ActivityTypeID, {sqlDate(connection, "al.LogTime")}, {recalculated} - al.Co2e
+            FROM ActivityLog al {lock}
+            WHERE {in_chunk} AND {changed}
+        """),
+        params
+    ).fetchall()
+
+    if changes:
+        if mssql:
+            connection.execute(
+                text(f"UPDATE al SET Co2e = {recalculated} FROM ActivityLog al WHERE {in_chunk} AND {changed}"),
+                params
+            )
+        else:
+            connection.execute(
+                text(f"UPDATE ActivityLog AS al SET Co2e = {recalculated} WHERE {in_chunk} AND {changed}"),
+                params
+            )
+
+        # One Co2e correction per user, day and type; logs from before ActivityLog.UserID have no rollup rows
+        deltas = {}
+        for user_id, log_type, log_date, delta in changes:
+            if user_id is not None:
+                key = (user_id, log_date, log_type)
+                deltas[key] = deltas.get(key, 0.0) + float(delta)
+        by_user = {}
+        for (user_id, log_date, log_type), delta in deltas.items():
+            by_user.setdefault(user_id, []).append(
+                {"type_id": log_type, "co2e": delta, "log_time": log_date, "count": 0})
+        for user_id, entries in by_user.items():
+            applyRollupDeltas(connection, user_id, entries)
+
+    connection.execute(
+        text("""
+            UPDATE Co2eRecalcJob
+            SET LastActivityLogID = :upto, RowsScanned = RowsScanned + :scanned, RowsChanged = RowsChanged + :changed
+            WHERE JobID = :job_id
+        """),
+        {"upto": upto, "scanned": scanned, "changed": len(changes), "job_id": job_id}
+    )
+    return upto, scanned, len(changes)
+
+
+# User log pagination
+LOGS_PER_PAGE = 10
+MAX_LOGS_PER_PAGE = 100
+
+# A cursor is the (LogTime, ActivityLogID) of a row, base64 encoded so it is URL safe
+def encodeLogCursor(log_time, activity_log_id):
+    raw = f"{log_time.isoformat()}|{activity_log_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decodeLogCursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        log_time, activity_log_id = raw.split("|")
+        return datetime.fromisoformat(log_time), int(activity_log_id)
+    except Exception:
+        raise ValueError("Invalid cursor.")
+
+# Fetch one page of a user's logs, newest first, seeking from a cursor instead of using OFFSET
+# Returns (logs, next_cursor, prev_cursor); next goes to older rows, prev to newer rows
+def fetchLogPage(db_session, user_id, after=None, before=None, limit=LOGS_PER_PAGE):
+    params = {"user_id": user_id, "limit": limit + 1}
+    seek = ""
+    order = "DESC"
+
+    if after:
+        params["cursor_time"], params["cursor_id"] = decodeLogCursor(after)
+        seek = """AND (al.LogTime < :cursor_time
+                   OR (al.LogTime = :cursor_time AND al.ActivityLogID < :cursor_id))"""
+    elif before:
+        # Walk forwards from the cursor then flip the rows back to newest first
+        params["cursor_time"], params["cursor_id"] = decodeLogCursor(before)
+        seek = """AND (al.LogTime > :cursor_time
+                   OR (al.LogTime = :cursor_time AND al.ActivityLogID > :cursor_id))"""
+        order = "ASC"
+
+    top, limit_clause = ("TOP (:limit)", "") if isMssql(db_session) else ("", "LIMIT :limit")
+    query = f"""
+        SELECT {top}
+               al.ActivityLogID,
+               CASE 
+                   WHEN at.ActivityTypeName = 'Food' THEN f.Product
+                   WHEN at.ActivityTypeName = 'Transport' THEN t.TransportName
+                   WHEN at.ActivityTypeName = 'Appliance' THEN a.ApplianceName
+               END AS ActivityName,
+               al.Co2e, 
+               al.LogTime
+        FROM ActivityLog al
+        JOIN ActivityType at ON al.ActivityTypeID = at.ActivityID
+        LEFT JOIN Food f ON al.ActivityItemID = f.FoodID AND at.ActivityTypeName = 'Food'
+        LEFT JOIN Transport t ON al.ActivityItemID = t.TransportID AND at.ActivityTypeName = 'Transport'
+        LEFT JOIN Appliance a ON al.ActivityItemID = a.ApplianceID AND at.ActivityTypeName = 'Appliance'
+        WHERE al.UserID = :user_id
+          {seek}
+        ORDER BY al.LogTime {order}, al.ActivityLogID {order}
+        {limit_clause}
+    """
+
+    logs = db_session.execute(text(query), params).fetchall()
+    has_more = len(logs) > limit
+    logs = logs[:limit]
+
+    if before:
+        logs.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = bool(after), has_more
+
+    next_cursor = encodeLogCursor(logs[-1].LogTime, logs[-1].ActivityLogID) if logs and has_older else None
+    prev_cursor = encodeLogCursor(logs[0].LogTime, logs[0].ActivityLogID) if logs and has_newer else None
+    return logs, next_cursor, prev_cursor
+
+# Total log count for the pager, summed from the daily rollup instead of counting ActivityLog rows
+def getLogTotal(db_session, user_id):
+    total = db_session.execute(
+        text("SELECT SUM(LogCount) FROM DailyCo2eRollup WHERE UserID = :user_id"),
+        {"user_id": user_id}
+    ).fetchone()[0]
+    return total or 0
+# Chart bucketing for /api/activity-data
+CHART_GRANULARITIES = ("day", "week", "month")
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "120"))
+
+# How many buckets of a granularity cover start..end (inclusive dates)
+def bucketCount(granularity, start_date, end_date):
+    if granularity == "day":
+        return (end_date - start_date).days + 1
+    if granularity == "week":
+        week_start = start_date - timedelta(days=start_date.weekday())
+        return (end_date - week_start).days // 7 + 1
+    return (end_date.year - start_date.year) * 12 + end_date.month - start_date.month + 1
+
+# The requested granularity, or the next coarser one that fits in CHART_MAX_POINTS; "auto" starts from day
+def chooseGranularity(requested, start_date, end_date):
+    requested = (requested or "auto").lower()
+    if requested != "auto" and requested not in CHART_GRANULARITIES:
+        raise ValueError("granularity must be day, week, month or auto.")
+    candidates = CHART_GRANULARITIES[CHART_GRANULARITIES.index(requested):] if requested != "auto" else CHART_GRANULARITIES
+    for granularity in candidates:
+        if bucketCount(granularity, start_date, end_date) <= CHART_MAX_POINTS:
+            return granularity
+    raise ValueError(f"Date range too long, at most {CHART_MAX_POINTS} months can be charted.")
+
+# SQL for the first day of the bucket a date falls in; weeks start on Monday
+def sqlBucket(db, granularity, column):
+    if granularity == "day":
+        return column
+    if isMssql(db):
+        if granularity == "week":
+            # 1900-01-01 was a Monday
+            return f"DATEADD(day, -(DATEDIFF(day, '19000101', {column}) % 7), {column})"
+        return f"DATEFROMPARTS(YEAR({column}), MONTH({column}), 1)"
+    if granularity == "week":
+        return f"date({column}, 'weekday 0', '-6 days')"
+    return f"date({column}, 'start of month')"
+
+# Co2e per activity type between two dates, bucketed and pivoted in SQL into the columnar shape
+# /api/activity-data returns: {"granularity", "dates", "Appliance", "Food", "Transport"}, one entry per bucket with data
+def fetchActivityData(db_session, user_id, start_date, end_date, granularity="auto"):
+    if isinstance(start_date, str):
+        start_date = parseDateArg(start_date, "start")
+    if isinstance(end_date, str):
+        end_date = parseDateArg(end_date, "end")
+    start_date = start_date.date() if isinstance(start_date, datetime) else start_date
+    end_date = end_date.date() if isinstance(end_date, datetime) else end_date
+    if end_date < start_date:
+        raise ValueError("end must not be before start.")
+
+    granularity = chooseGranularity(granularity, start_date, end_date)
+    bucket = sqlBucket(db_session, granularity, "r.LogDate")
+
+    # Read the pre-aggregated daily totals rather than the raw ActivityLog rows
+    query = f"""
+        SELECT {bucket} AS Bucket,
+               SUM(CASE WHEN r.ActivityTypeID = :appliance THEN r.TotalCo2e ELSE 0 END) AS Appliance,
+               SUM(CASE WHEN r.ActivityTypeID = :food THEN r.TotalCo2e ELSE 0 END) AS Food,
+               SUM(CASE WHEN r.ActivityTypeID = :transport THEN r.TotalCo2e ELSE 0 END) AS Transport
+        FROM DailyCo2eRollup r
+        WHERE r.UserID = :user_id
+          AND r.LogDate BETWEEN :start_date AND :end_date
+        GROUP BY {bucket}
+        ORDER BY {bucket}
+    """
+
+    results = db_session.execute(
+        text(query),
+        {
+            "user_id": user_id, "start_date": start_date, "end_date": end_date,
+            "appliance": ACTIVITY_TYPE_IDS["appliance"],
+            "food": ACTIVITY_TYPE_IDS["food"],
+            "transport": ACTIVITY_TYPE_IDS["transport"]
+        }
+    ).fetchall()
+
+    return {
+        "granularity": granularity,
+        "dates": [row[0].isoformat() if hasattr(row[0], "isoformat") else str(row[0]) for row in results],
+        "Appliance": [float(row[1]) for row in results],
+        "Food": [float(row[2]) for row in results],
+        "Transport": [float(row[3]) for row in results]
+    }
+
+# How a user's total for the period containing `day` compares with everyone's, per activity type and overall:
+# {"period", "start", "end", "computedAt", "All": {...}, "Appliance": {...}, ...}. Reads only the user's own
+# rollup rows, the rest comes from the precomputed histograms. LookupError if the period hasn't been summarised
+def fetchComparison(db_session, user_id, period, day=None):
+    day = parseDateArg(day, "date") or datetime.now()
+    start, end, computed_at, histograms = distributions.get(period, day)
+
+    totals = dict(db_session.execute(
+        text("""
+            SELECT r.ActivityTypeID, SUM(r.TotalCo2e)
+            FROM DailyCo2eRollup r
+            WHERE r.UserID = :user_id AND r.LogDate >= :start AND r.LogDate < :end
+            GROUP BY r.ActivityTypeID
+        """),
+        {"user_id": user_id, "start": start, "end": end}
+    ).fetchall())
+    totals = {type_id: float(total) for type_id, total in totals.items()}
+    totals[0] = sum(totals.values())
+
+    response = {
+        "period": period,
+        "start": start.isoformat(),
+        "end": (end - timedelta(days=1)).isoformat(),
+        "computedAt": computed_at.isoformat() if computed_at else None
+    }
+    names = dict([(0, "All")] + [(type_id, name.capitalize()) for name, type_id in ACTIVITY_TYPE_IDS.items()])
+    for type_id, name in names.items():
+        histogram = histograms.get(type_id)
+        co2e = totals.get(type_id, 0.0)
+        rank = histogram.rank(co2e) if histogram else None
+        response[name] = {
+            "co2e": co2e,
+            "percentile": round(100 * rank, 1) if rank is not None else None,  # share of users below you
+            "users": histogram.users if histogram else 0,
+            "mean": histogram.mean() if histogram else None,
+            "median": histogram.quantile(0.5) if histogram else None,
+            "p90": histogram.quantile(0.9) if histogram else None
+        }
+    return response
+
+# Full activity history export
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+EXPORT_COLUMNS = ["ActivityLogID", "ActivityType", "ActivityName", "Co2e", "LogTime"]
+
+# Parse an optional YYYY-MM-DD query argument
+def parseDateArg(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"{name} must be a date in YYYY-MM-DD format.")
+
+# Yield a user's logs oldest first, EXPORT_CHUNK_ROWS at a time, straight off the database cursor
+# so memory stays flat however long the history is
+def streamUserLogs(db_session, user_id, start=None, end=None):
+    params = {"user_id": user_id}
+    date_filter = ""
+    if start is not None:
+        date_filter += " AND al.LogTime >= :start"
+        params["start"] = start
+    if end is not None:
+        # end is inclusive, compare against the next midnight so LogTime stays sargable
+        date_filter += " AND al.LogTime < :end"
+        params["end"] = end + timedelta(days=1)
+
+    result = db_session.execute(
+        text(f"""
+            SELECT al.ActivityLogID,
+                   at.ActivityTypeName,
+                   CASE 
+                       WHEN at.ActivityTypeName = 'Food' THEN f.Product
+                       WHEN at.ActivityTypeName = 'Transport' THEN t.TransportName
+                       WHEN at.ActivityTypeName = 'Appliance' THEN a.ApplianceName
+                   END AS ActivityName,
+                   al.Co2e,
+                   al.LogTime
+            FROM ActivityLog al
+            JOIN ActivityType at ON al.ActivityTypeID = at.ActivityID
+                LEFT JOIN Food f ON al.ActivityItemID = f.FoodID AND at.ActivityTypeName = 'Food'
+            LEFT JOIN Transport t ON al.ActivityItemID = t.TransportID AND at.ActivityTypeName = 'Transport'
+            LEFT JOIN Appliance a ON al.ActivityItemID = a.ApplianceID AND at.ActivityTypeName = 'Appliance'
+            WHERE al.UserID = :user_id{date_filter}
+            ORDER BY al.LogTime, al.ActivityLogID
+        """),
+        params,
+        execution_options={"stream_results": True, "yield_per": EXPORT_CHUNK_ROWS}
+    )
+    try:
+        for rows in result.partitions():
+            yield rows
+    finally:
+        result.close()
+
+def exportRow(row):
+    return [row[0], row[1], row[2], float(row[3]), row[4].isoformat()]
+
+def exportCsv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in chunks:
+        for row in rows:
+            writer.writerow(exportRow(row))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def exportNdjson(chunks):
+    for rows in chunks:
+        yield "".join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, exportRow(row)))) + "\n"
+            for row in rows
+        )
 
 
 ## template routes-----------------------------------------------------------------------------------
-@app.route("/login/", methods=["GET"])
+@web.route("/login/", methods=["GET"])
 def login_page():
     return render_template("login.html")
 
-@app.route("/register/")
+@web.route("/register/")
 def register_page():
     return render_template("register.html")
 
-@app.route("/")
+@web.route("/")
 def homepage():
     return render_template("homepage.html")
 
-@app.route("/forgot-password")
+@web.route("/forgot-password")
 def forgot_password_page():
     return render_template("forgot_password.html")
 
@@ -109,13 +1070,13 @@ def forgot_password_page():
 #----------------------------------------------------------------
 ## Protected routes
 
-@app.route("/menu/")
+@web.route("/menu/")
 @login_required
 def user_menu():
     return render_template("menu.html", username=session.get("username"))
 
 
-@app.route("/additem/")
+@web.route("/additem/")
 @login_required
 def additem():
     categories = getActivityTypes()
@@ -131,53 +1092,35 @@ def additem():
     )
 
 
-@app.route("/userlog/<int:page>")
+# Older pages are reached with ?after=<cursor>, newer ones with ?before=<cursor>
+# page is only kept so existing /userlog/1 links keep working
+@web.route("/userlog/<int:page>")
 @login_required
+@read_only
 def userlog(page=1):
-    logs_per_page = 10
-    offset = (page - 1) * logs_per_page
-
-    # Updated Query: Filter by current user using UserLog
-    query = """
-        SELECT al.ActivityLogID, 
-               CASE 
-                   WHEN at.ActivityTypeName = 'Food' THEN f.Product
-                   WHEN at.ActivityTypeName = 'Transport' THEN t.TransportName
-                   WHEN at.ActivityTypeName = 'Appliance' THEN a.ApplianceName
-               END AS ActivityName,
-               al.Co2e, 
-               al.LogTime
-        FROM ActivityLog al
-        JOIN ActivityType at ON al.ActivityTypeID = at.ActivityID
-        JOIN UserLog ul ON al.ActivityLogID = ul.ActivityLogID
-        LEFT JOIN Food f ON al.ActivityItemID = f.FoodID AND at.ActivityTypeName = 'Food'
-        LEFT JOIN Transport t ON al.ActivityItemID = t.TransportID AND at.ActivityTypeName = 'Transport'
-        LEFT JOIN Appliance a ON al.ActivityItemID = a.ApplianceID AND at.ActivityTypeName = 'Appliance'
-        WHERE ul.UserID = :user_id
-        ORDER BY al.LogTime DESC
-        OFFSET :offset ROWS FETCH NEXT :limit ROWS ONLY
-    """
-
-    logs = g.db_session.execute(
-        text(query),
-        {
-            "user_id": session["user_id"],
-            "limit": logs_per_page,
-            "offset": offset
-        }
-    ).fetchall()
+    try:
+        logs, next_cursor, prev_cursor = fetchLogPage(
+            getDbSession(),
+            session["user_id"],
+            after=request.args.get("after"),
+            before=request.args.get("before")
+        )
+    except ValueError:
+        return redirect(url_for(".userlog", page=1))
 
-    # Update total log count for pagination to be user-specific
-    total_logs = g.db_session.execute(
-        text("SELECT COUNT(*) FROM UserLog WHERE UserID = :user_id"),
-        {"user_id": session["user_id"]}
-    ).fetchone()[0]
+    total_logs = getLogTotal(getDbSession(), session["user_id"])
 
-    return render_template("userlog.html", logs=logs, page=page, total_logs=total_logs)
+    return render_template(
+        "userlog.html",
+        logs=logs,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor,
+        total_logs=total_logs
+    )
 
 
 
-@app.route("/viewdata/")
+@web.route("/viewdata/")
 @login_required
 def viewdata():
     return render_template("viewdata.html")
@@ -187,7 +1130,7 @@ def viewdata():
 # ---------------------------------------------------------------
 ## API endpoints
 # Registration Endpoint
-@app.route("/api/register", methods=["POST"])
+@web.route("/api/register", methods=["POST"])
 def register():
     try:
         data = request.get_json()
@@ -202,32 +1145,44 @@ def register():
         if password != confirm_password:
             return jsonify({"success": False, "message": "Passwords do not match"}), 400
         
-        result = g.db_session.execute(
-            text("SELECT COUNT(*) FROM UserDetails WHERE username = :username OR email = :email"),
-            {"username": username, "email": email}
+        # Both checks are index seeks: username and the keyed email digest
+        email_digest = emailDigest(email)
+        result = getDbSession().execute(
+            text("SELECT COUNT(*) FROM UserDetails WHERE username = :username OR EmailDigest = :email_digest"),
+            {"username": username, "email_digest": email_digest}
         ).fetchone()
 
         if result[0] > 0:
             return jsonify({"success": False, "message": "Username or email already exists"}), 400
 
-        hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
-        hashed_email = bcrypt.generate_password_hash(email).decode('utf-8')
+        hashed_password = hasher.hash(password)
 
-        g.db_session.execute(
-            text("INSERT INTO UserDetails (username, email, password) VALUES (:username, :email, :password)"),
-            {"username": username, "email": hashed_email, "password": hashed_password}
+        # The digest is all we need to match the email later, so it is stored in place of a second bcrypt hash
+        getDbSession().execute(
+            text("""
+                INSERT INTO UserDetails (username, email, EmailDigest, password)
+                VALUES (:username, :email_digest, :email_digest, :password)
+            """),
+            {"username": username, "email_digest": email_digest, "password": hashed_password}
         )
-        g.db_session.commit()
+        getDbSession().commit()
 
         return jsonify({"success": True, "message": "User registered successfully!"}), 201
 
+    except IntegrityError:
+        # Lost a race with another signup for the same username/email
+        rollbackDbSession()
+        return jsonify({"success": False, "message": "Username or email already exists"}), 400
+    except HashPoolBusy as e:
+        rollbackDbSession()
+        return busyResponse(str(e))
     except Exception as e:
-        g.db_session.rollback()
+        rollbackDbSession()
         return jsonify({"success": False, "message": str(e)}), 500
 
 
 # Login Endpoint
-@app.route("/api/login", methods=["POST"])
+@web.route("/api/login", methods=["POST"])
 def login():
     try:
         data = request.get_json()
@@ -237,7 +1192,7 @@ def login():
         if not username or not password:
             return jsonify({"success": False, "message": "Missing fields"}), 400
         
-        result = g.db_session.execute(
+        result = getDbSession().execute(
             text("SELECT UserID, username, password FROM UserDetails WHERE username = :username"),
             {"username": username}
         ).fetchone()
@@ -247,20 +1202,30 @@ def login():
 
         user_ID, username, stored_hashed_password = result
 
-        if not bcrypt.check_password_hash(stored_hashed_password, password):
+        if not hasher.verify(stored_hashed_password, password):
             return jsonify({"success": False, "message": "Invalid username or password"}), 401
 
+        # The work factor has changed since this hash was made, upgrade it while we have the password
+        if hasher.needs_rehash(stored_hashed_password):
+            getDbSession().execute(
+                text("UPDATE UserDetails SET password = :password WHERE UserID = :user_id"),
+                {"password": hasher.hash(password), "user_id": user_ID}
+            )
+            getDbSession().commit()
+
         session["user_id"] = user_ID
         session["username"] = username
 
         return jsonify({"success": True, "message": "Login successful!"}), 200
 
+    except HashPoolBusy as e:
+        return busyResponse(str(e))
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
 
 # Forgotten password Endpoint
-@app.route("/api/forgot-password", methods=["POST"])
+@web.route("/api/forgot-password", methods=["POST"])
 def forgot_password():
     try:
         data = request.get_json()
@@ -270,297 +1235,398 @@ def forgot_password():
         if not username or not email:
             return jsonify({"success": False, "message": "Username and email are required."}), 400
 
-        result = g.db_session.execute(
-            text("SELECT email FROM UserDetails WHERE username = :username"),
+        result = getDbSession().execute(
+            text("SELECT UserID, email, EmailDigest FROM UserDetails WHERE username = :username"),
             {"username": username}
         ).fetchone()
 
         if not result:
             return jsonify({"success": False, "message": "No such user found."}), 404
 
-        stored_hashed_email = result[0]
+        user_ID, stored_hashed_email, stored_digest = result
+        email_digest = emailDigest(email)
 
-        if not bcrypt.check_password_hash(stored_hashed_email, email):
-            return jsonify({"success": False, "message": "Email does not match our records."}), 403
+        if stored_digest is not None:
+            if not hmac.compare_digest(stored_digest, email_digest):
+                return jsonify({"success": False, "message": "Email does not match our records."}), 403
+        else:
+            # Account from before EmailDigest existed: check the old bcrypt hash once, then backfill
+            if not hasher.verify(stored_hashed_email, email):
+                return jsonify({"success": False, "message": "Email does not match our records."}), 403
+
+            getDbSession().execute(
+                text("UPDATE UserDetails SET EmailDigest = :email_digest WHERE UserID = :user_id"),
+                {"email_digest": email_digest, "user_id": user_ID}
+            )
+            getDbSession().commit()
 
         return jsonify({"success": True, "message": "If the details are correct, a password reset link will be sent."}), 200
 
+    except HashPoolBusy as e:
+        return busyResponse(str(e))
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
     
 # logout Endpoint
-@app.route("/logout/")
+@web.route("/logout/")
 def logout():
     session.clear()
-    return redirect(url_for("login_page"))
+    return redirect(url_for(".login_page"))
+
+# Typeahead over every item name: /api/items/search?q=gas boi[&activity=appliance][&limit=10]
+# Answered from the catalog's in-memory index, so typing never queries the database
+@web.route("/api/items/search", methods=["GET"])
+@login_required
+def search_items():
+    query = request.args.get("q", "").strip()
+    activity = request.args.get("activity") or None
+    if activity is not None and activity not in ACTIVITY_TYPE_IDS:
+        return jsonify({"error": "Invalid activity type"}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", SEARCH_DEFAULT_LIMIT)), 1), SEARCH_MAX_LIMIT)
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+
+    # Results only change with the catalog, so the catalog's validators work for every query URL
+    etag, last_modified = catalog.validators()
+    if catalogNotModified(etag, last_modified):
+        return catalogHeaders(Response(status=304), etag, last_modified)
+
+    results = catalog.search(query, limit, activity) if query else []
+    return catalogHeaders(jsonify({"query": query, "results": results}), etag, last_modified)
 
-@app.route("/api/items/<activity>/<category>", methods=["GET"])
+@web.route("/api/items/<activity>/<category>", methods=["GET"])
 @login_required
 def get_items(activity, category):
-    with engine.connect() as connection:
-        # ---------------- Appliance ----------------
-        if activity == "appliance":
-            result = connection.execute(
-                text("""
-                    SELECT ApplianceName, AverageKWH 
-                    FROM Appliance 
-                    WHERE ApplianceTypeID = (SELECT TypeID FROM ApplianceTypes WHERE Category = :category)
-                """),
-                {"category": category}
-            )
-            items = [{"name": row[0], "wattage": row[1]} for row in result]
-            return jsonify(items)
+    # Validators first, so they are never newer than the list they go out with
+    etag, last_modified = catalog.validators()
+    items = catalog.items(activity, category)
+
+    # An unknown activity or category is an error whatever ETag the client holds
+    if items is None:
+        if activity == "transport":
+            return jsonify({"error": "Invalid transport category"}), 400
+        return jsonify({"error": "Invalid activity type"}), 400
+
+    # The lists only change with the catalog, so a client holding the current ETag gets a bodiless 304
+    if catalogNotModified(etag, last_modified):
+        return catalogHeaders(Response(status=304), etag, last_modified)
+
+    return catalogHeaders(jsonify(items), etag, last_modified)
+
+def catalogNotModified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    return request.if_modified_since is not None and last_modified <= request.if_modified_since
+
+def catalogHeaders(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.max_age = CATALOG_MAX_AGE
+    return response
+
+
+# Reload the reference data after the Appliance/Transport/Food tables change
+@web.route("/api/catalog/refresh", methods=["POST"])
+@admin_required
+def refresh_catalog():
+    try:
+        version = catalog.refresh()
+        return jsonify({"success": True, "version": version})
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
 
-        # ---------------- Transport ----------------
-        elif activity == "transport":
-            transport_type_map = {"personal": 1, "public": 2}
-            transport_type_id = transport_type_map.get(category.lower())
 
-            if not transport_type_id:
-                return jsonify({"error": "Invalid transport category"}), 400
 
-            result = connection.execute(
-                text("""
-                    SELECT TransportName, Co2e, FuelType
-                    FROM Transport
-                    WHERE TransportTypeID = :type_id
-                """),
-                {"type_id": transport_type_id}
-            )
-            items = [{"name": row[0], "co2e_per_mile": row[1], "fuel_type": row[2]} for row in result]
-            return jsonify(items)
+# Prometheus scrape endpoint. It carries pool, replica, queue and startup figures and slow SQL statements,
+# so like the other stats endpoints it needs ADMIN_TOKEN: have the scraper send it, e.g. in Prometheus
+# scrape_configs: http_headers: {X-Admin-Token: {secrets: [<token>]}}. Without ADMIN_TOKEN set it answers 403
+@web.route("/metrics", methods=["GET"])
+@admin_required
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
-        # ---------------- Food ----------------
-        elif activity == "food":
-            result = connection.execute(
-            text("""
-                SELECT f.Product, f.Co2e
-                FROM Food f
-                JOIN FoodType ft ON f.FoodTypeID = ft.TypeID
-                WHERE ft.TypeName = :category
-            """),
-            {"category": category}
-            )
-            items = [{"name": row[0], "co2e_per_kg": row[1]} for row in result]
-            return jsonify(items)
+# Connection pool usage, for sizing workers against the database
+@web.route("/api/pool-stats", methods=["GET"])
+@admin_required
+def get_pool_stats():
+    return jsonify(pool_stats.snapshot())
 
+# Sampling profiler settings and counts; the profiles themselves are files under PROFILE_DIR
+@web.route("/api/profile-stats", methods=["GET"])
+@admin_required
+def get_profile_stats():
+    return jsonify(profiler.stats())
 
-        # ---------------- Invalid Activity ----------------
-        else:
-            return jsonify({"error": "Invalid activity type"}), 400
+# Read replica health and how many reads it served, stuck to the primary or fell back
+@web.route("/api/replica-stats", methods=["GET"])
+@admin_required
+def get_replica_stats():
+    return jsonify(replica_router.stats())
 
+# How long this worker took to start, phase by phase
+@web.route("/api/startup-stats", methods=["GET"])
+@admin_required
+def get_startup_stats():
+    return jsonify(startup_stats)
 
 
-# log new entry endpoint
-@app.route("/api/log-appliance", methods=["POST"])
-@login_required
-def log_appliance():
-    try:
-        data = request.get_json()
-        user_id = data.get("userID")
-        appliance_name = data.get("applianceName")
-        usage_time = data.get("usageTime")
-        wattage = data.get("wattage")
-        log_time = data.get("logTime")
-
-        if not all([user_id, appliance_name, usage_time, wattage, log_time]):
-            return jsonify({"success": False, "message": "Missing required fields."}), 400
-
-        # 1. Get ApplianceID
-        appliance_result = g.db_session.execute(
-            text("SELECT ApplianceID FROM Appliance WHERE ApplianceName = :name"),
-            {"name": appliance_name}
-        ).fetchone()
 
-        if not appliance_result:
-            return jsonify({"success": False, "message": "Appliance not found."}), 404
+# bcrypt pool queue depth and latency
+@web.route("/api/hash-stats", methods=["GET"])
+@admin_required
+def get_hash_stats():
+    return jsonify(hasher.stats())
 
-        appliance_id = appliance_result[0]
 
-        # 2. Calculate Co2e (example calculation)
-        co2e = float(usage_time) * float(wattage)  * CO2_PER_KWH
 
-        # 3. Insert into ActivityLog & get new ID
-        activity_log_insert = g.db_session.execute(
-            text("""
-                INSERT INTO ActivityLog (ActivityItemID, ActivityTypeID, Co2e, LogTime)
-                OUTPUT INSERTED.ActivityLogID
-                VALUES (:item_id, :type_id, :co2e, :log_time)
-            """),
-            {
-                "item_id": appliance_id,
-                "type_id": 1,   # Assuming 1 = Appliance in ActivityType
-                "co2e": co2e,
-                "log_time": log_time
-            }
-        )
+# Per-route limits, in-flight and waiting requests and shed counts
+@web.route("/api/admission-stats", methods=["GET"])
+@admin_required
+def get_admission_stats():
+    return jsonify(admission.stats())
 
-        activity_log_id = activity_log_insert.fetchone()[0]
 
-        # 4. Insert into UserLog
-        g.db_session.execute(
-            text("""
-                INSERT INTO UserLog (UserID, ActivityLogID)
-                VALUES (:user_id, :activity_log_id)
-            """),
-            {
-                "user_id": user_id,
-                "activity_log_id": activity_log_id
-            }
-        )
 
-        g.db_session.commit()
+# Write-behind queue depth, lag and drain errors
+@web.route("/api/ingest-stats", methods=["GET"])
+@admin_required
+def get_ingest_stats():
+    if ingest_queue is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(ingest_queue.stats(), enabled=True))
+
 
-        return jsonify({"success": True, "message": "Appliance logged successfully."})
 
+# log new entry endpoint
+@web.route("/api/log-appliance", methods=["POST"])
+@login_required
+def log_appliance():
+    try:
+        data = request.get_json()
+
+        if not bodyOwnerMatches(data, session["user_id"]):
+            return jsonify({"success": False, "message": "userID does not match the logged in user."}), 403
+
+        # Look up the appliance and calculate Co2e
+        entry = prepareLogEntry("appliance", data)
+
+        return saveLogEntry(entry, "Appliance logged successfully.")
+
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except LookupError as e:
+        return jsonify({"success": False, "message": str(e)}), 404
     except Exception as e:
-        g.db_session.rollback()
+        rollbackDbSession()
         return jsonify({"success": False, "message": str(e)}), 500
     
-@app.route("/delete_log/<int:log_id>", methods=["POST"])
+@web.route("/delete_log/<int:log_id>", methods=["POST"])
 @login_required
 def delete_log(log_id):
     try:
-        # Delete from UserLog first (foreign key constraint)
-        g.db_session.execute(
-            text("DELETE FROM UserLog WHERE ActivityLogID = :log_id"),
-            {"log_id": log_id}
-        )
-
-        # Then delete from ActivityLog
-        g.db_session.execute(
-            text("DELETE FROM ActivityLog WHERE ActivityLogID = :log_id"),
-            {"log_id": log_id}
-        )
-
-        g.db_session.commit()
-        flash("Log deleted successfully", "success")
-        return redirect(url_for("userlog", page=1))
+        # Only the user's own log is deleted, someone else's id looks the same as a missing one
+        if deleteUserLogs(getDbSession(), session["user_id"], log_ids=[log_id]):
+            flash("Log deleted successfully", "success")
+        else:
+            flash("Log not found.", "danger")
+        return redirect(url_for(".userlog", page=1))
 
     except Exception as e:
-        g.db_session.rollback()
+        rollbackDbSession()
         flash(f"Error deleting log: {str(e)}", "danger")
-        return redirect(url_for("userlog", page=1))
+        return redirect(url_for(".userlog", page=1))
+
+# Delete several of the user's logs at once: {"ids": [...]} or a date range {"start": "YYYY-MM-DD", "end": "YYYY-MM-DD"}
+@web.route("/api/logs/delete", methods=["POST"])
+@login_required
+def delete_logs():
+    try:
+        data = request.get_json(silent=True) or {}
+        log_ids = data.get("ids")
+
+        if log_ids is not None:
+            if not isinstance(log_ids, list) or not all(type(log_id) is int for log_id in log_ids):
+                return jsonify({"success": False, "message": "ids must be a list of log ids."}), 400
+            if len(log_ids) > BULK_DELETE_MAX_IDS:
+                return jsonify({"success": False, "message": f"At most {BULK_DELETE_MAX_IDS} ids per request."}), 400
+            log_ids = list(dict.fromkeys(log_ids))
+            deleted = deleteUserLogs(getDbSession(), session["user_id"], log_ids=log_ids)
+            # Ids that weren't deleted are missing or not the user's, both are reported the same way
+            return jsonify({"success": True, "deleted": len(deleted), "notFound": sorted(set(log_ids) - set(deleted))})
+
+        start = parseDateArg(data.get("start"), "start")
+        end = parseDateArg(data.get("end"), "end")
+        if not start or not end:
+            return jsonify({"success": False, "message": "Send ids, or start and end dates."}), 400
+        if end < start:
+            return jsonify({"success": False, "message": "end must not be before start."}), 400
+
+        deleted = deleteUserLogs(getDbSession(), session["user_id"], start=start, end=end)
+        return jsonify({"success": True, "deleted": len(deleted)})
+
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        rollbackDbSession()
+        return jsonify({"success": False, "message": str(e)}), 500
 
-@app.route("/api/log-transport", methods=["POST"])
+@web.route("/api/log-transport", methods=["POST"])
 @login_required
 def log_transport():
     try:
         data = request.get_json()
-        user_id = data.get("userID")
-        transport_name = data.get("transportName")
-        distance = data.get("distance")  # in miles
-        log_time = data.get("logTime")
-
-        if not all([user_id, transport_name, distance, log_time]):
-            return jsonify({"success": False, "message": "Missing required fields."}), 400
-
-        # Get TransportID and Co2e per mile
-        transport_result = g.db_session.execute(
-            text("SELECT TransportID, Co2e FROM Transport WHERE TransportName = :name"),
-            {"name": transport_name}
-        ).fetchone()
-
-        if not transport_result:
-            return jsonify({"success": False, "message": "Transport type not found."}), 404
-
-        transport_id, co2_per_mile = transport_result
-
-        # Calculate total CO2e
-        co2e = float(distance) * float(co2_per_mile)
-
-        # Insert into ActivityLog
-        activity_log_insert = g.db_session.execute(
-            text("""
-                INSERT INTO ActivityLog (ActivityItemID, ActivityTypeID, Co2e, LogTime)
-                OUTPUT INSERTED.ActivityLogID
-                VALUES (:item_id, :type_id, :co2e, :log_time)
-            """),
-            {
-                "item_id": transport_id,
-                "type_id": 2,   # 2 = Transport in your ActivityType table
-                "co2e": co2e,
-                "log_time": log_time
-            }
-        )
 
-        activity_log_id = activity_log_insert.fetchone()[0]
+        if not bodyOwnerMatches(data, session["user_id"]):
+            return jsonify({"success": False, "message": "userID does not match the logged in user."}), 403
 
-        # Link to UserLog
-        g.db_session.execute(
-            text("""
-                INSERT INTO UserLog (UserID, ActivityLogID)
-                VALUES (:user_id, :activity_log_id)
-            """),
-            {"user_id": user_id, "activity_log_id": activity_log_id}
-        )
+        entry = prepareLogEntry("transport", data)
 
-        g.db_session.commit()
-        return jsonify({"success": True, "message": "Transport logged successfully!"})
+        return saveLogEntry(entry, "Transport logged successfully!")
 
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except LookupError as e:
+        return jsonify({"success": False, "message": str(e)}), 404
     except Exception as e:
-        g.db_session.rollback()
+        rollbackDbSession()
         return jsonify({"success": False, "message": str(e)}), 500
 
-@app.route("/api/log-food", methods=["POST"])
+@web.route("/api/log-food", methods=["POST"])
 @login_required
 def log_food():
     try:
         data = request.get_json()
-        user_id = data.get("userID")
-        food_name = data.get("foodName")
-        quantity = data.get("quantity")  # in kg
-        log_time = data.get("logTime")
 
-        if not all([user_id, food_name, quantity, log_time]):
-            return jsonify({"success": False, "message": "Missing required fields."}), 400
+        if not bodyOwnerMatches(data, session["user_id"]):
+            return jsonify({"success": False, "message": "userID does not match the logged in user."}), 403
 
-        food_result = g.db_session.execute(
-            text("SELECT FoodID, Co2e FROM Food WHERE Product = :name"),
-            {"name": food_name}
-        ).fetchone()
+        entry = prepareLogEntry("food", data)
 
-        if not food_result:
-            return jsonify({"success": False, "message": "Food item not found."}), 404
+        return saveLogEntry(entry, "Food logged successfully!")
 
-        food_id, co2_per_kg = food_result
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except LookupError as e:
+        return jsonify({"success": False, "message": str(e)}), 404
+    except Exception as e:
+        rollbackDbSession()
+        return jsonify({"success": False, "message": str(e)}), 500
 
-        co2e = float(quantity) * float(co2_per_kg)
+# Log many appliance/transport/food entries in one transaction
+# Body: {"entries": [{"type": "appliance", "applianceName": ..., "usageTime": ..., "wattage": ..., "logTime": ...}, ...]}
+@web.route("/api/log-batch", methods=["POST"])
+@login_required
+def log_batch():
+    try:
+        data = request.get_json()
+        entries = data.get("entries") if isinstance(data, dict) else None
+
+        if not isinstance(entries, list) or not entries:
+            return jsonify({"success": False, "message": "entries must be a non-empty list."}), 400
+
+        if len(entries) > MAX_BATCH_ENTRIES:
+            return jsonify({"success": False, "message": f"At most {MAX_BATCH_ENTRIES} entries per batch."}), 400
+
+        # Validate and price every entry, names come from the catalog cache
+        results = []
+        valid = []
+        for index, raw in enumerate(entries):
+            try:
+                if not isinstance(raw, dict):
+                    raise ValueError("Entry must be an object.")
+                entry = prepareLogEntry(str(raw.get("type", "")).lower(), raw)
+                valid.append((index, entry))
+                results.append({"index": index, "success": True, "co2e": entry["co2e"]})
+            except (ValueError, LookupError) as e:
+                results.append({"index": index, "success": False, "message": str(e)})
+
+        if not valid:
+            return jsonify({"success": False, "message": "No valid entries.", "results": results}), 400
+
+        # Insert all valid entries in one transaction
+        log_ids = insertActivityLogs(getDbSession(), session["user_id"], [entry for _, entry in valid])
+        getDbSession().commit()
+
+        for (index, _), log_id in zip(valid, log_ids):
+            results[index]["activityLogId"] = log_id
+
+        return jsonify({
+            "success": len(valid) == len(entries),
+            "logged": len(valid),
+            "failed": len(entries) - len(valid),
+            "results": results
+        })
 
-        activity_log_insert = g.db_session.execute(
-            text("""
-                INSERT INTO ActivityLog (ActivityItemID, ActivityTypeID, Co2e, LogTime)
-                OUTPUT INSERTED.ActivityLogID
-                VALUES (:item_id, :type_id, :co2e, :log_time)
-            """),
-            {
-                "item_id": food_id,
-                "type_id": 4,   # 4 = Food in ActivityType
-                "co2e": co2e,
-                "log_time": log_time
-            }
-        )
+    except Exception as e:
+        rollbackDbSession()
+        return jsonify({"success": False, "message": str(e)}), 500
 
-        activity_log_id = activity_log_insert.fetchone()[0]
+# Keyset paginated activity logs for the current user
+@web.route("/api/logs", methods=["GET"])
+@login_required
+@read_only
+def get_logs():
+    try:
+        limit = min(max(request.args.get("limit", LOGS_PER_PAGE, type=int), 1), MAX_LOGS_PER_PAGE)
+        after = request.args.get("after")
+        before = request.args.get("before")
 
-        g.db_session.execute(
-            text("""
-                INSERT INTO UserLog (UserID, ActivityLogID)
-                VALUES (:user_id, :activity_log_id)
-            """),
-            {"user_id": user_id, "activity_log_id": activity_log_id}
+        logs, next_cursor, prev_cursor = fetchLogPage(
+            getDbSession(), session["user_id"], after=after, before=before, limit=limit
         )
 
-        g.db_session.commit()
-        return jsonify({"success": True, "message": "Food logged successfully!"})
-
+        return jsonify({
+            "logs": [
+                {
+                    "activityLogId": log.ActivityLogID,
+                    "activityName": log.ActivityName,
+                    "co2e": float(log.Co2e),
+                    "logTime": log.LogTime.isoformat()
+                }
+                for log in logs
+            ],
+            "next": next_cursor,
+            "prev": prev_cursor,
+            "total": getLogTotal(getDbSession(), session["user_id"])
+        })
+
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     except Exception as e:
-        g.db_session.rollback()
         return jsonify({"success": False, "message": str(e)}), 500
 
-@app.route("/api/activity-data", methods=["GET"])
+# Stream the current user's whole history as CSV or NDJSON, optionally between two dates
+@web.route("/api/export", methods=["GET"])
 @login_required
+@read_only
+def export_logs():
+    export_format = request.args.get("format", "csv").lower()
+    if export_format not in ("csv", "ndjson"):
+        return jsonify({"success": False, "message": "format must be csv or ndjson."}), 400
+
+    try:
+        start = parseDateArg(request.args.get("start"), "start")
+        end = parseDateArg(request.args.get("end"), "end")
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    chunks = streamUserLogs(getDbSession(), session["user_id"], start, end)
+    if export_format == "csv":
+        body, mimetype = exportCsv(chunks), "text/csv"
+    else:
+        body, mimetype = exportNdjson(chunks), "application/x-ndjson"
+
+    # stream_with_context keeps the request (and its database session) open until the last row is sent
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename=activity-log.{export_format}"
+    return response
+
+@web.route("/api/activity-data", methods=["GET"])
+@login_required
+@read_only
 def get_activity_data():
     try:
         start_date = request.args.get("start")
@@ -569,55 +1635,370 @@ def get_activity_data():
         if not start_date or not end_date:
             return jsonify({"success": False, "message": "Start and end dates are required."}), 400
 
-        query = """
-            SELECT 
-                CAST(al.LogTime AS DATE) AS LogDate,
-                at.ActivityTypeName,
-                SUM(al.Co2e) AS TotalCo2e
-            FROM ActivityLog al
-            JOIN ActivityType at ON al.ActivityTypeID = at.ActivityID
-            JOIN UserLog ul ON al.ActivityLogID = ul.ActivityLogID
-            WHERE ul.UserID = :user_id
-              AND CAST(al.LogTime AS DATE) BETWEEN :start_date AND :end_date
-              AND at.ActivityTypeName IN ('Appliance', 'Food', 'Transport')
-            GROUP BY CAST(al.LogTime AS DATE), at.ActivityTypeName
-            ORDER BY LogDate
-        """
-
-        results = g.db_session.execute(
-            text(query),
-            {"user_id": session["user_id"], "start_date": start_date, "end_date": end_date}
-        ).fetchall()
+        response = fetchActivityData(
+            getDbSession(), session["user_id"], start_date, end_date, request.args.get("granularity")
+        )
+        return jsonify(response)
 
-        # Process data into Chart.js friendly format
-        data = {}
-        dates_set = set()
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
 
-        # Initialize categories
-        categories = ['Appliance', 'Food', 'Transport']
-        for cat in categories:
-            data[cat] = {}
 
-        for row in results:
-            log_date = row[0].strftime('%Y-%m-%d')
-            category = row[1]
-            total_co2e = float(row[2])
+# Percentile of the user's Co2e for a week or month among everyone who logged anything in it
+@web.route("/api/compare", methods=["GET"])
+@login_required
+@read_only
+def compare():
+    try:
+        response = fetchComparison(
+            getDbSession(), session["user_id"], request.args.get("period", "week"), request.args.get("date")
+        )
+        return jsonify(response)
 
-            dates_set.add(log_date)
-            data[category][log_date] = total_co2e
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except LookupError as e:
+        return jsonify({"success": False, "message": str(e)}), 404
+    except Exception as e:
+        return jsonify({"success": False, "message": str(e)}), 500
 
-        sorted_dates = sorted(list(dates_set))
 
-        response = {"dates": sorted_dates}
-        for cat in categories:
-            # Fill missing dates with 0
-            response[cat] = [data[cat].get(date, 0) for date in sorted_dates]
+# ---------------------------------------------------------------
+## App factory
+# Warm-up before serving: open pool connections, load the catalog, compile templates and hash static files.
+# Only create_app() warms up, importing carbon (flask CLI commands, bench scripts, asyncapp) doesn't connect
+APP_WARM_UP = os.getenv("APP_WARM_UP", "true").lower() in ("1", "true", "yes")
+WARM_UP_CONNECTIONS = int(os.getenv("WARM_UP_CONNECTIONS", str(POOL_SIZE)))
+
+# Seconds per startup phase for this process, served at /api/startup-stats and /metrics
+startup_stats = {"pid": os.getpid(), "forked": False, "warm": False, "phases": {}}
+
+@contextmanager
+def startupPhase(name, optional=False):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        if not optional:
+            raise
+        # A failed warm-up step only means the first request does that work instead
+        log.warning("Startup %s failed: %s", name, e)
+    finally:
+        startup_stats["phases"][name] = round(time.perf_counter() - start, 4)
+
+def recordReady():
+    startup_stats["ready_seconds"] = round(time.perf_counter() - STARTUP_BEGAN, 4)
+    log.info("Ready in %.3fs: %s", startup_stats["ready_seconds"], startup_stats["phases"])
+
+# Check out n connections at once so the pool holds n open ones, then hand them back
+def warmPool(n, pool_engine=None):
+    pool_engine = pool_engine or engine
+    connections = []
+    try:
+        for _ in range(n):
+            connection = pool_engine.connect()
+            connections.append(connection)
+            connection.exec_driver_sql("SELECT 1")
+    finally:
+        for connection in connections:
+            connection.close()
+
+def warmStaticAssets(flask_app):
+    for folder, _, filenames in os.walk(flask_app.static_folder):
+        for filename in filenames:
+            static_assets.digest(
+                os.path.relpath(os.path.join(folder, filename), flask_app.static_folder).replace(os.sep, "/"))
+
+# Do the first request's work now, so the worker is fast from its first request on
+def warmUp(flask_app, connections=WARM_UP_CONNECTIONS):
+    with flask_app.app_context():
+        with startupPhase("pool", optional=True):
+            warmPool(connections)
+        if replica_router.enabled:
+            with startupPhase("replica_pool", optional=True):
+                warmPool(connections, replica_router.replica)
+        with startupPhase("catalog", optional=True):
+            catalog.refresh()
+        with startupPhase("templates", optional=True):
+            for name in flask_app.jinja_env.list_templates():
+                flask_app.jinja_env.get_template(name)
+        with startupPhase("static", optional=True):
+            warmStaticAssets(flask_app)
+        appState().warm = True
+    startup_stats["warm"] = True
+
+# A new Flask app with the routes, the request hooks and its own AppState
+def buildApp(database_url, replica_url=None, secret_key=None, config=None):
+    flask_app = Flask(__name__)
+    flask_app.secret_key = secret_key
+    flask_app.config.update(config or {})
+    for extension in (metrics, admission, profiler, static_assets, compressor):
+        extension.init_app(flask_app)
+
+    state = AppState(database_url, replica_url)
+    state.replica_router.init_app(flask_app)
+    flask_app.extensions["carbon"] = state
+    app_states.add(state)
+
+    flask_app.register_blueprint(web)
+    return flask_app
+
+# Without a config: the module's `app`, warmed up on the first call (APP_WARM_UP), e.g. gunicorn "carbon:create_app()".
+# With one: a new app with its own engine and caches, leaving the module's app alone. config may set DATABASE_URL,
+# DATABASE_REPLICA_URL, SECRET_KEY, WARM_UP and WARM_UP_CONNECTIONS, anything else goes into app.config
+def create_app(config=None):
+    checkConfig()
+    if config is None:
+        if APP_WARM_UP and not default_state.warm:
+            warmUp(app)
+            recordReady()
+        return app
+
+    config = dict(config)
+    with startupPhase("config"):
+        database_url = config.pop("DATABASE_URL", DATABASE_URL)
+        replica_url = config.pop("DATABASE_REPLICA_URL", DATABASE_REPLICA_URL)
+        secret_key = config.pop("SECRET_KEY", os.getenv("FLASK_SECRET_KEY"))
+        warm = config.pop("WARM_UP", APP_WARM_UP)
+        connections = config.pop("WARM_UP_CONNECTIONS", WARM_UP_CONNECTIONS)
+    with startupPhase("engine"):
+        flask_app = buildApp(database_url, replica_url, secret_key, config)
+
+    if warm:
+        warmUp(flask_app, connections)
+    recordReady()
+    return flask_app
+
+# A server that forks workers after importing the app (gunicorn --preload and the like) would otherwise
+# share the parent's database sockets, bcrypt threads and queue connection between processes. Every forked
+# child drops its copies without closing the parent's; nothing here connects, so a child that never serves
+# requests (multiprocessing, a forked helper) opens nothing
+def afterForkInChild():
+    startup_stats.update(pid=os.getpid(), forked=True)
+    for state in list(app_states):
+        state.engine.dispose(close=False)
+        state.replica_router.after_fork()
+    hasher.after_fork()
+    if ingest_queue is not None:
+        ingest_queue.after_fork()
+
+# A server worker forked from a master that warmed up opens its own pool connections before its first
+# request. Called from the server's worker-boot hook, see post_fork in gunicorn.conf.py
+def warmForkedWorker():
+    for state in list(app_states):
+        if state.warm:
+            with startupPhase("fork_pool", optional=True):
+                warmPool(WARM_UP_CONNECTIONS, state.engine)
+                if state.replica_router.enabled:
+                    warmPool(WARM_UP_CONNECTIONS, state.replica_router.replica)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=afterForkInChild)
 
-        return jsonify(response)
 
-    except Exception as e:
-        return jsonify({"success": False, "message": str(e)}), 500
+# ---------------------------------------------------------------
+## CLI commands
+# Bring the database schema up to date: flask --app carbon migrate
+@web.cli.command("migrate")
+@click.option("--target", type=int, default=None, help="Stop after this migration version.")
+@click.option("--dry-run", is_flag=True, help="Only list the migrations that would run.")
+def migrate_command(target, dry_run):
+    import migrate
+    if dry_run:
+        for version, name, _ in migrate.pendingMigrations(engine):
+            if target is None or version <= target:
+                click.echo(f"{version:04d} {name}")
+        return
+    ran = migrate.migrate(engine, target)
+    for version, name in ran:
+        click.echo(f"Applied {version:04d} {name}")
+    click.echo(f"{len(ran)} migrations applied.")
+    catalog.invalidate()
+
+# Backfill or rebuild the daily rollup: flask --app carbon rebuild-rollup [--user-id N]
+@web.cli.command("rebuild-rollup")
+@click.option("--user-id", type=int, default=None, help="Only rebuild this user's rows.")
+def rebuild_rollup_command(user_id):
+    with engine.begin() as connection:
+        rows = rebuildRollup(connection, user_id)
+    click.echo(f"Rebuilt DailyCo2eRollup: {rows} rows.")
+
+# Write everything in the write-behind queue now: flask --app carbon drain-ingest [--retry-dead]
+@web.cli.command("drain-ingest")
+@click.option("--retry-dead", is_flag=True, help="Put dead letters back in the queue first.")
+def drain_ingest_command(retry_dead):
+    if ingest_queue is None:
+        raise click.ClickException("INGEST_QUEUE_PATH is not set, write-behind mode is off.")
+    if retry_dead:
+        click.echo(f"Requeued {ingest_queue.retry_dead()} dead letters.")
+    click.echo(f"Wrote {ingest_queue.drain()} queued entries.")
+    stats = ingest_queue.stats()
+    click.echo(f"{stats['depth']} left in the queue, {stats['dead_letters']} dead letters.")
+# Add an emission factor from a date on: flask --app carbon add-factor --type appliance --from 2025-01-01 --factor 0.18
+# Without --item it applies to every item of the type. Logs already stored keep their Co2e until recalc-co2e runs
+@web.cli.command("add-factor")
+@click.option("--type", "activity", type=click.Choice(sorted(ACTIVITY_TYPE_IDS)), required=True)
+@click.option("--item", default=None, help="Item name; the whole activity type when left out.")
+@click.option("--from", "valid_from", type=click.DateTime(), required=True, help="First LogTime it applies to.")
+@click.option("--factor", type=float, required=True, help="kg Co2e per kWh, mile or kg.")
+def add_factor_command(activity, item, valid_from, factor):
+    item_id = None
+    if item is not None:
+        found = catalog.lookup(activity, item)
+        if not found:
+            raise click.ClickException(LOG_ENTRY_FIELDS[activity][2])
+        item_id = found[0]
+    with engine.begin() as connection:
+        connection.execute(
+            text("""
+                INSERT INTO EmissionFactor (ActivityTypeID, ActivityItemID, ValidFrom, Factor)
+                VALUES (:type_id, :item_id, :valid_from, :factor)
+            """),
+            {"type_id": ACTIVITY_TYPE_IDS[activity], "item_id": item_id, "valid_from": valid_from, "factor": factor}
+        )
+    catalog.refresh()
+    click.echo(f"Added factor {factor} for {activity} {item or '(all items)'} from {valid_from}.")
+    click.echo("Running workers pick it up within CATALOG_TTL, or POST /api/catalog/refresh.")
+    click.echo(f"Update stored logs with: flask --app carbon recalc-co2e --type {activity} --since {valid_from.date()}")
+
+# Recalculate stored Co2e with the current emission factors, in chunks:
+# flask --app carbon recalc-co2e [--type transport] [--item "Bus"] [--since 2025-01-01] | --resume JOB_ID
+@web.cli.command("recalc-co2e")
+@click.option("--type", "activity", type=click.Choice(sorted(ACTIVITY_TYPE_IDS)), default=None)
+@click.option("--item", default=None, help="Only this item (needs --type).")
+@click.option("--since", type=click.DateTime(), default=None, help="Only logs from this time on.")
+@click.option("--chunk", type=int, default=RECALC_CHUNK_ROWS, show_default=True, help="Logs per transaction.")
+@click.option("--resume", "job_id", type=int, default=None, help="Carry on with an unfinished job.")
+def recalc_co2e_command(activity, item, since, chunk, job_id):
+    if job_id is not None:
+        with engine.connect() as connection:
+            job = connection.execute(
+                text("""
+                    SELECT ActivityTypeID, ActivityItemID, Since, LastActivityLogID, FinishedAt
+                    FROM Co2eRecalcJob WHERE JobID = :job_id
+                """),
+                {"job_id": job_id}
+            ).fetchone()
+        if job is None:
+            raise click.ClickException(f"No recalculation job {job_id}.")
+        if job.FinishedAt is not None:
+            raise click.ClickException(f"Job {job_id} already finished at {job.FinishedAt}.")
+        type_id, item_id, since, after = job.ActivityTypeID, job.ActivityItemID, job.Since, job.LastActivityLogID
+        if isinstance(since, str):
+            since = datetime.fromisoformat(since)
+    else:
+        if item is not None and activity is None:
+            raise click.UsageError("--item needs --type.")
+        type_id = ACTIVITY_TYPE_IDS[activity] if activity else None
+        item_id = None
+        if item is not None:
+            found = catalog.lookup(activity, item)
+            if not found:
+                raise click.ClickException(LOG_ENTRY_FIELDS[activity][2])
+            item_id = found[0]
+        after = 0
+        with engine.begin() as connection:
+            returning = "OUTPUT INSERTED.JobID" if isMssql(connection) else ""
+            job_id = connection.execute(
+                text(f"""
+                    INSERT INTO Co2eRecalcJob (ActivityTypeID, ActivityItemID, Since)
+                    {returning}
+                    VALUES (:type_id, :item_id, :since)
+                    {"" if returning else "RETURNING JobID"}
+                """),
+                {"type_id": type_id, "item_id": item_id, "since": since}
+            ).scalar()
+        click.echo(f"Started recalculation job {job_id}; if it stops, carry on with --resume {job_id}")
 
+    with engine.connect() as connection:
+        last_id = connection.execute(text("SELECT MAX(ActivityLogID) FROM ActivityLog")).scalar() or 0
+    first = after
+    scanned_total = changed_total = 0
+    started = time.perf_counter()
+    while True:
+        with engine.begin() as connection:
+            upto, scanned, changed = recalcChunk(connection, job_id, after, chunk, type_id, item_id, since)
+        if upto is None:
+            break
+        after = upto
+        scanned_total += scanned
+        changed_total += changed
+        rate = scanned_total / max(time.perf_counter() - started, 1e-9)
+        done = 100.0 * (after - first) / max(last_id - first, 1)
+        click.echo(f"  up to ActivityLogID {after}: {scanned_total:,} scanned, {changed_total:,} changed "
+                   f"({rate:,.0f} rows/s, {min(done, 100.0):.0f}%)")
+
+    with engine.begin() as connection:
+        now = "SYSUTCDATETIME()" if isMssql(connection) else "CURRENT_TIMESTAMP"  # UTC, like StartedAt
+        connection.execute(
+            text(f"UPDATE Co2eRecalcJob SET FinishedAt = {now} WHERE JobID = :job_id"),
+            {"job_id": job_id}
+        )
+    click.echo(f"Job {job_id} finished: {scanned_total:,} logs scanned, {changed_total:,} changed.")
+
+# Summarise everyone's Co2e for /api/compare, run it from cron (hourly is plenty):
+# flask --app carbon refresh-distributions [--period week] [--since 2025-01-01]
+# Without --since it redoes the current and the previous period, which catches late logs
+@web.cli.command("refresh-distributions")
+@click.option("--period", type=click.Choice(PERIODS), default=None, help="Only this period length.")
+@click.option("--since", type=click.DateTime(["%Y-%m-%d"]), default=None, help="Backfill every period from this date.")
+def refresh_distributions_command(period, since):
+    today = datetime.now().date()
+    for name in [period] if period else PERIODS:
+        start = periodBounds(name, since or today)[0]
+        if since is None:
+            start = periodBounds(name, start - timedelta(days=1))[0]
+        while start <= today:
+            users = distributions.refresh(name, start)
+            click.echo(f"{name} of {start.isoformat()}: {users:,} users")
+            start = periodBounds(name, start)[1]
+# Delete logs past the retention period, in chunks: flask --app carbon purge-logs [--days 730] [--dry-run]
+# Safe to stop and run again, each chunk commits with its rollup update
+@web.cli.command("purge-logs")
+@click.option("--days", type=int, default=LOG_RETENTION_DAYS, show_default=True, help="Keep this many days of logs.")
+@click.option("--chunk", type=int, default=DELETE_CHUNK_ROWS, show_default=True, help="Logs per transaction.")
+@click.option("--dry-run", is_flag=True, help="Only count what would be deleted.")
+def purge_logs_command(days, chunk, dry_run):
+    if days <= 0:
+        raise click.ClickException("No retention period, set LOG_RETENTION_DAYS or pass --days.")
+    cutoff = datetime.combine(datetime.now().date() - timedelta(days=days), datetime.min.time())
+    with engine.connect() as connection:
+        expired = connection.execute(
+            text("SELECT COUNT(*) FROM ActivityLog WHERE LogTime < :cutoff"), {"cutoff": cutoff}
+        ).scalar()
+    click.echo(f"{expired:,} logs from before {cutoff.date().isoformat()}.")
+    if dry_run or not expired:
+        return
+
+    deleted = 0
+    started = time.perf_counter()
+    while True:
+        with engine.begin() as connection:
+            ids = deleteLogChunk(connection, "LogTime < :cutoff", {"cutoff": cutoff}, chunk)
+        deleted += len(ids)
+        if ids:
+            rate = deleted / max(time.perf_counter() - started, 1e-9)
+            click.echo(f"  {deleted:,}/{expired:,} deleted ({rate:,.0f} rows/s, {min(100.0 * deleted / expired, 100.0):.0f}%)")
+        if len(ids) < chunk:
+            break
+    click.echo(f"Purged {deleted:,} logs.")
+
+# Print how long startup took here: flask --app carbon startup-report
+@web.cli.command("startup-report")
+def startup_report_command():
+    for phase, took in startup_stats["phases"].items():
+        click.echo(f"{phase:<10} {took * 1000:8.1f} ms")
+    click.echo(f"{'ready':<10} {startup_stats.get('ready_seconds', 0) * 1000:8.1f} ms after import began")
+
+
+# The app `flask --app carbon`, asyncapp and the bench scripts use, configured from the environment.
+# Building it doesn't connect to the database, create_app() warms it up
+with startupPhase("engine"):
+    app = buildApp(DATABASE_URL, DATABASE_REPLICA_URL, os.getenv("FLASK_SECRET_KEY"))
+default_state = app.extensions["carbon"]
+recordReady()
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,231 @@
+from sqlalchemy import text
+from datetime import datetime, timezone
+from search import ItemSearchIndex, SEARCH_DEFAULT_LIMIT
+
+import bisect
+import hashlib
+import json
+import threading
+import time
+import os
+
+# How long (seconds) the reference data is trusted before it is reloaded
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "300"))
+
+# A lookup miss reloads the catalog, but never more often than this (seconds)
+CATALOG_MISS_RELOAD = float(os.getenv("CATALOG_MISS_RELOAD", "30"))
+
+# Transport categories are fixed ids in TransportType
+TRANSPORT_TYPE_MAP = {"personal": 1, "public": 2}
+
+
+# MSSQL compares names case-insensitively and ignores trailing spaces, match that here
+def _key(name):
+    return str(name).strip().casefold()
+
+
+class CatalogCache:
+    """In-process copy of the near-static reference tables.
+
+    Holds the type lists shown on /additem/, the per-category item lists
+    served by /api/items, the name -> (ID, factor) lookups used when
+    logging, the EmissionFactor timelines that price a log by its LogTime
+    and the typeahead index behind /api/items/search. Everything is swapped in as one snapshot so readers never see
+    a half-loaded catalog.
+    """
+
+    def __init__(self, engine, ttl=CATALOG_TTL):
+        self.engine = engine
+        self.ttl = ttl
+        self.version = 0
+        self.digest = None
+        self.modified_at = None
+        self.loaded_at = None
+        self._data = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()  # held by the one thread reloading
+
+    ## loading -------------------------------------------------------------------
+    def _fetch(self, connection):
+        data = {
+            "activity_types": [row[0] for row in connection.execute(
+                text("SELECT ActivityTypeName FROM ActivityType ORDER BY ActivityTypeName"))],
+            "appliance_types": [row[0] for row in connection.execute(
+                text("SELECT Category FROM ApplianceTypes ORDER BY Category"))],
+            "food_types": [row[0] for row in connection.execute(
+                text("SELECT TypeName FROM FoodType ORDER BY TypeName"))],
+            "transport_types": [row[0] for row in connection.execute(
+                text("SELECT TypeName FROM TransportType ORDER BY TypeName"))],
+            "items": {"appliance": {}, "transport": {}, "food": {}},
+            "lookup": {"appliance": {}, "transport": {}, "food": {}},
+            "factors": {},
+        }
+        items = data["items"]
+        lookup = data["lookup"]
+        entries = []  # (activity, category, name, details) for the search index
+        transport_categories = {type_id: name for name, type_id in TRANSPORT_TYPE_MAP.items()}
+
+        # Appliances, grouped by ApplianceTypes.Category
+        result = connection.execute(text("""
+            SELECT apt.Category, a.ApplianceID, a.ApplianceName, a.AverageKWH
+            FROM Appliance a
+            JOIN ApplianceTypes apt ON a.ApplianceTypeID = apt.TypeID
+        """))
+        for category, item_id, name, kwh in result:
+            items["appliance"].setdefault(_key(category), []).append({"name": name, "wattage": kwh})
+            entries.append(("appliance", category, name, {"wattage": kwh}))
+            lookup["appliance"].setdefault(_key(name), (item_id, kwh))
+
+        # Transport, grouped by TransportTypeID
+        result = connection.execute(text("""
+            SELECT TransportTypeID, TransportID, TransportName, Co2e, FuelType
+            FROM Transport
+        """))
+        for type_id, item_id, name, co2e, fuel_type in result:
+            items["transport"].setdefault(type_id, []).append(
+                {"name": name, "co2e_per_mile": co2e, "fuel_type": fuel_type})
+            entries.append(("transport", transport_categories.get(type_id, str(type_id)), name,
+                            {"co2e_per_mile": co2e, "fuel_type": fuel_type}))
+            lookup["transport"].setdefault(_key(name), (item_id, co2e))
+
+        # Food, grouped by FoodType.TypeName
+        result = connection.execute(text("""
+            SELECT ft.TypeName, f.FoodID, f.Product, f.Co2e
+            FROM Food f
+            JOIN FoodType ft ON f.FoodTypeID = ft.TypeID
+        """))
+        for category, item_id, name, co2e in result:
+            items["food"].setdefault(_key(category), []).append({"name": name, "co2e_per_kg": co2e})
+            entries.append(("food", category, name, {"co2e_per_kg": co2e}))
+            lookup["food"].setdefault(_key(name), (item_id, co2e))
+
+        # Emission factors over time, (ActivityTypeID, ActivityItemID or None) -> ([ValidFrom...], [Factor...])
+        result = connection.execute(text("""
+            SELECT ActivityTypeID, ActivityItemID, ValidFrom, Factor
+            FROM EmissionFactor
+            ORDER BY ActivityTypeID, ActivityItemID, ValidFrom
+        """))
+        for type_id, item_id, valid_from, factor in result:
+            if isinstance(valid_from, str):
+                valid_from = datetime.fromisoformat(valid_from)
+            starts, values = data["factors"].setdefault((type_id, item_id), ([], []))
+            starts.append(valid_from)
+            values.append(float(factor))
+
+        data["search"] = ItemSearchIndex(entries)
+        return data
+
+    def refresh(self):
+        # Explicit refresh hook: reload everything now, the version only moves when the content changed
+        with self._refresh_lock:
+            return self._load()
+
+    def _load(self):
+        with self.engine.connect() as connection:
+            data = self._fetch(connection)
+        # The digest is the item lists' ETag, the factor timelines and search index are derived data
+        shown = {key: value for key, value in data.items() if key not in ("factors", "search")}
+        digest = hashlib.sha256(json.dumps(shown, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+        with self._lock:
+            self._data = data
+            self.loaded_at = time.monotonic()
+            if digest != self.digest:
+                self.digest = digest
+                self.version += 1
+                self.modified_at = datetime.now(timezone.utc).replace(microsecond=0)
+        return self.version
+
+    def invalidate(self):
+        # Drop the snapshot, the next read reloads it
+        with self._lock:
+            self.loaded_at = None
+
+    def _age(self):
+        if self.loaded_at is None:
+            return None
+        return time.monotonic() - self.loaded_at
+
+    def stale(self):
+        age = self._age()
+        return self._data is None or age is None or age > self.ttl
+
+    def _snapshot(self):
+        if self.stale():
+            # Single flight: one thread reloads while the others keep serving the snapshot they have,
+            # rather than every request querying the reference tables at once. With nothing loaded yet
+            # they wait for that thread instead
+            if self._refresh_lock.acquire(blocking=self._data is None):
+                try:
+                    if self.stale():
+                        self._load()
+                finally:
+                    self._refresh_lock.release()
+        return self._data
+
+    ## reads ---------------------------------------------------------------------
+    def validators(self):
+        # (ETag, Last-Modified) for responses built from the catalog; the ETag comes from the
+        # content so every worker process hands out the same one
+        self._snapshot()
+        return self.digest, self.modified_at
+
+    def activity_types(self):
+        return self._snapshot()["activity_types"]
+
+    def appliance_types(self):
+        return self._snapshot()["appliance_types"]
+
+    def food_types(self):
+        return self._snapshot()["food_types"]
+
+    def transport_types(self):
+        return self._snapshot()["transport_types"]
+
+    def items(self, activity, category):
+        # Returns None for an unknown activity/category so callers can 400
+        items = self._snapshot()["items"]
+        if activity == "transport":
+            type_id = TRANSPORT_TYPE_MAP.get(category.lower())
+            if not type_id:
+                return None
+            return items["transport"].get(type_id, [])
+        if activity in ("appliance", "food"):
+            return items[activity].get(_key(category), [])
+        return None
+
+    def lookup(self, activity, name):
+        # name -> (item ID, emission factor); for appliances the factor is AverageKWH
+        found = self._snapshot()["lookup"][activity].get(_key(name))
+        if found is None:
+            # Maybe the item was added since the last load, reload at most once per window
+            age = self._age()
+            if age is None or age > CATALOG_MISS_RELOAD:
+                with self._refresh_lock:
+                    # Another thread may have reloaded while this one waited
+                    age = self._age()
+                    if age is None or age > CATALOG_MISS_RELOAD:
+                        self._load()
+                found = self._data["lookup"][activity].get(_key(name))
+        return found
+
+    def search(self, query, limit=SEARCH_DEFAULT_LIMIT, activity=None):
+        # Typeahead matches across every activity (or one), best first, each with its category
+        return [dict(details, activity=item_activity, category=category, name=name)
+                for (item_activity, category, name, details), _, _
+                in self._snapshot()["search"].search(query, limit, activity)]
+
+    def factor_at(self, type_id, item_id, log_time):
+        # Emission factor in force at log_time: the item's own timeline first, then the one for the
+        # whole activity type; None when neither covers it (callers fall back to the item's factor)
+        factors = self._snapshot()["factors"]
+        for key in ((type_id, item_id), (type_id, None)):
+            timeline = factors.get(key)
+            if timeline:
+                i = bisect.bisect_right(timeline[0], log_time)
+                if i:
+                    return timeline[1][i - 1]
+        return None
+
+    def stats(self):
+        return {"version": self.version, "digest": self.digest, "age_seconds": self._age(), "ttl_seconds": self.ttl,
+                "search_items": len(self._data["search"]) if self._data else 0}
@@ -0,0 +1,69 @@
+from flask import request
+
+import gzip
+import os
+import threading
+
+# Bodies smaller than this aren't worth the CPU or the extra header
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "500"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+
+COMPRESSIBLE_TYPES = {
+    "application/json", "application/javascript", "text/javascript",
+    "text/css", "text/html", "text/plain", "image/svg+xml",
+}
+
+
+class Compressor:
+    """gzip for JSON, HTML and text assets when the client accepts it.
+
+    Static files are compressed once per ETag and kept in memory, everything
+    else is compressed per response. Streamed responses (the export) are
+    left alone so they keep streaming, and range requests get the identity
+    body the ranges refer to.
+    """
+
+    def __init__(self, min_bytes=COMPRESS_MIN_BYTES, level=COMPRESS_LEVEL):
+        self.min_bytes = min_bytes
+        self.level = level
+        self._static = {}  # (path, etag) -> gzipped bytes
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.after_request(self._compress)
+
+    def _compress(self, response):
+        if (response.status_code != 200
+                or response.mimetype not in COMPRESSIBLE_TYPES
+                or "Content-Encoding" in response.headers
+                or response.is_streamed and request.endpoint != "static"):
+            return response
+        response.vary.add("Accept-Encoding")
+        # Byte ranges count into the identity body, so a client asking for one gets that
+        if "gzip" not in request.accept_encodings or request.method == "HEAD" or "Range" in request.headers:
+            return response
+
+        etag, _ = response.get_etag()
+        key = (request.path, etag) if request.endpoint == "static" and etag else None
+        with self._lock:
+            body = self._static.get(key) if key else None
+        if body is None:
+            response.direct_passthrough = False
+            data = response.get_data()
+            if len(data) < self.min_bytes:
+                return response
+            body = gzip.compress(data, self.level)
+            if key:
+                with self._lock:
+                    self._static[key] = body
+        else:
+            response.direct_passthrough = False
+
+        response.set_data(body)
+        response.headers["Content-Encoding"] = "gzip"
+        # Ranges are served from the uncompressed file, they don't apply to these bytes
+        response.headers.pop("Accept-Ranges", None)
+        if etag:
+            # The gzipped bytes are a different representation of the same resource
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,228 @@
+from sqlalchemy import text
+from datetime import datetime, timedelta
+
+import bisect
+import json
+import math
+import os
+import threading
+import time
+
+# Periods summarised for /api/compare; weeks start on Monday like the chart buckets
+PERIODS = ("week", "month")
+
+# Histogram resolution: buckets per factor of ten of kg Co2e, 20 puts bucket edges about 12% apart
+DISTRIBUTION_BUCKETS_PER_DECADE = int(os.getenv("DISTRIBUTION_BUCKETS_PER_DECADE", "20"))
+
+# Totals below this (kg) share the lowest bucket
+DISTRIBUTION_MIN_CO2E = float(os.getenv("DISTRIBUTION_MIN_CO2E", "0.001"))
+
+# How long (seconds) a loaded summary is served before it is read again, and how many are kept
+DISTRIBUTION_TTL = float(os.getenv("DISTRIBUTION_TTL", "300"))
+DISTRIBUTION_CACHE_SIZE = int(os.getenv("DISTRIBUTION_CACHE_SIZE", "32"))
+
+
+# First day of the period a date falls in, and the first day after it
+def periodBounds(period, day):
+    if period not in PERIODS:
+        raise ValueError("period must be one of: " + ", ".join(PERIODS) + ".")
+    day = day.date() if isinstance(day, datetime) else day
+    if period == "week":
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=7)
+    start = day.replace(day=1)
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+
+class Histogram:
+    """Log-scale histogram of per-user Co2e totals.
+
+    Bucket b holds totals in [10^(b/n), 10^((b+1)/n)) for n buckets per
+    decade, so two histograms of the same period merge by adding counts
+    (shards, or types into an overall view) and percentiles come out within
+    one bucket width whatever the number of users.
+    """
+
+    def __init__(self, counts=None, users=0, total=0.0, per_decade=DISTRIBUTION_BUCKETS_PER_DECADE):
+        self.counts = dict(counts or {})
+        self.users = users
+        self.total = total
+        self.per_decade = per_decade
+        self._cumulative = None
+
+    def bucket(self, value):
+        value = max(value, DISTRIBUTION_MIN_CO2E)
+        return math.floor(math.log10(value) * self.per_decade)
+
+    def add(self, value, users=1):
+        b = self.bucket(value)
+        self.counts[b] = self.counts.get(b, 0) + users
+        self.users += users
+        self.total += value * users
+        self._cumulative = None
+
+    def merge(self, other):
+        if other.per_decade != self.per_decade:
+            raise ValueError("Histograms with different bucket widths don't merge.")
+        for b, count in other.counts.items():
+            self.counts[b] = self.counts.get(b, 0) + count
+        self.users += other.users
+        self.total += other.total
+        self._cumulative = None
+        return self
+
+    def _index(self):
+        # Sorted buckets and the number of users below each one
+        if self._cumulative is None:
+            buckets = sorted(self.counts)
+            below, running = [], 0
+            for b in buckets:
+                below.append(running)
+                running += self.counts[b]
+            self._cumulative = (buckets, below)
+        return self._cumulative
+
+    def rank(self, value):
+        # Share of users with a lower total, counting half of value's own bucket
+        if not self.users:
+            return None
+        if value <= 0:
+            return 0.0
+        buckets, below = self._index()
+        b = self.bucket(value)
+        i = bisect.bisect_left(buckets, b)
+        lower = below[i] if i < len(buckets) else self.users
+        same = self.counts.get(b, 0)
+        return (lower + same / 2.0) / self.users
+
+    def quantile(self, q):
+        # Geometric middle of the bucket holding the q-th user
+        if not self.users:
+            return None
+        buckets, below = self._index()
+        target = q * self.users
+        i = max(bisect.bisect_right(below, target) - 1, 0)
+        return 10 ** ((buckets[i] + 0.5) / self.per_decade)
+
+    def mean(self):
+        return self.total / self.users if self.users else None
+
+    def to_json(self):
+        return json.dumps({"perDecade": self.per_decade, "counts": {str(b): c for b, c in sorted(self.counts.items())}})
+
+    @classmethod
+    def from_json(cls, raw, users, total):
+        data = json.loads(raw)
+        return cls({int(b): c for b, c in data["counts"].items()}, users, total, data["perDecade"])
+
+
+class DistributionStore:
+    """Precomputed Co2e distributions for comparing one user with everyone.
+
+    refresh() reads a period of DailyCo2eRollup once for all users and stores
+    a histogram per activity type in Co2eDistribution. get() serves those
+    from memory, so answering "your percentile this week" costs a dictionary
+    lookup and a bisect however many users there are.
+    """
+
+    def __init__(self, engine, type_ids, ttl=DISTRIBUTION_TTL, cache_size=DISTRIBUTION_CACHE_SIZE):
+        self.engine = engine
+        self.type_ids = list(type_ids)
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = {}  # (period, start) -> (loaded at, computed at, {type id: Histogram})
+        self._lock = threading.Lock()
+
+    ## the job -------------------------------------------------------------------
+    def _compute(self, connection, start, end):
+        params = {"start": start, "end": end}
+        histograms = {type_id: Histogram() for type_id in [0] + self.type_ids}
+
+        # Stream the per-user sums, only the histograms are held in memory
+        result = connection.execute(text("""
+            SELECT ActivityTypeID, SUM(TotalCo2e)
+            FROM DailyCo2eRollup
+            WHERE LogDate >= :start AND LogDate < :end
+            GROUP BY UserID, ActivityTypeID
+        """), params)
+        for type_id, total in result:
+            if type_id in histograms and total > 0:
+                histograms[type_id].add(float(total))
+
+        result = connection.execute(text("""
+            SELECT SUM(TotalCo2e)
+            FROM DailyCo2eRollup
+            WHERE LogDate >= :start AND LogDate < :end
+            GROUP BY UserID
+        """), params)
+        for total, in result:
+            if total > 0:
+                histograms[0].add(float(total))
+        return histograms
+
+    def refresh(self, period, day):
+        # Recompute and store one period's summaries; returns how many users it covered
+        start, end = periodBounds(period, day)
+        with self.engine.begin() as connection:
+            histograms = self._compute(connection, start, end)
+            connection.execute(
+                text("DELETE FROM Co2eDistribution WHERE Period = :period AND PeriodStart = :start"),
+                {"period": period, "start": start}
+            )
+            connection.execute(
+                text("""
+                    INSERT INTO Co2eDistribution (Period, PeriodStart, ActivityTypeID, Users, TotalCo2e, Histogram)
+                    VALUES (:period, :start, :type_id, :users, :total, :histogram)
+                """),
+                [{"period": period, "start": start, "type_id": type_id, "users": h.users, "total": h.total,
+                  "histogram": h.to_json()} for type_id, h in histograms.items()]
+            )
+        with self._lock:
+            self._cache.pop((period, start), None)
+        return histograms[0].users
+
+    ## reads ---------------------------------------------------------------------
+    def _load(self, period, start):
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                text("""
+                    SELECT ActivityTypeID, Users, TotalCo2e, Histogram, ComputedAt
+                    FROM Co2eDistribution
+                    WHERE Period = :period AND PeriodStart = :start
+                """),
+                {"period": period, "start": start}
+            ).fetchall()
+        if not rows:
+            return None, None
+        histograms = {type_id: Histogram.from_json(raw, users, total) for type_id, users, total, raw, _ in rows}
+        computed_at = rows[0][4]
+        if isinstance(computed_at, str):
+            computed_at = datetime.fromisoformat(computed_at)
+        return computed_at, histograms
+
+    def get(self, period, day):
+        # (period start, period end, computed at, {type id: Histogram}); LookupError if never computed
+        start, end = periodBounds(period, day)
+        key = (period, start)
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            self.hits += 1
+            return start, end, cached[1], cached[2]
+
+        self.misses += 1
+        computed_at, histograms = self._load(period, start)
+        if histograms is None:
+            raise LookupError(f"No comparison for the {period} starting {start.isoformat()} yet.")
+        with self._lock:
+            if len(self._cache) >= self.cache_size:
+                self._cache.pop(min(self._cache, key=lambda k: self._cache[k][0]))
+            self._cache[key] = (time.monotonic(), computed_at, histograms)
+        return start, end, computed_at, histograms
+
+    def stats(self):
+        with self._lock:
+            cached = len(self._cache)
+        return {"cached": cached, "hits": self.hits, "misses": self.misses, "ttl_seconds": self.ttl}
@@ -0,0 +1,10 @@
+# gunicorn reads this from the working directory, e.g. gunicorn --preload -w 4 "carbon:create_app()"
+import sys
+
+
+# Runs in each worker right after it's forked. Only an app preloaded (and warmed up) in the master needs its
+# pool reopened here; without --preload the worker imports carbon itself and create_app() warms it up
+def post_fork(server, worker):
+    carbon = sys.modules.get("carbon")
+    if carbon is not None:
+        carbon.warmForkedWorker()
@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import bcrypt
+import hashlib
+import hmac
+import threading
+import time
+import os
+
+# bcrypt work factor (log2 rounds) for new hashes
+BCRYPT_LOG_ROUNDS = int(os.getenv("BCRYPT_LOG_ROUNDS", "12"))
+
+# Worker threads, most jobs allowed to wait for one, and how long a request waits for its result
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "32"))
+HASH_TIMEOUT = float(os.getenv("HASH_TIMEOUT", "10"))
+
+
+# Keyed digest of an email address, deterministic so it can be looked up through a unique index
+# EMAIL_PEPPER must stay the same for the lifetime of the data, changing it orphans every digest
+def emailDigest(email):
+    pepper = os.getenv("EMAIL_PEPPER")
+    if not pepper:
+        raise RuntimeError("EMAIL_PEPPER is not configured")
+    normalised = email.strip().lower()
+    return hmac.new(pepper.encode("utf-8"), normalised.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+class HashPoolBusy(Exception):
+    # Raised when the queue is full or a job takes too long, callers should answer 503
+    pass
+
+
+class PasswordHasher:
+    """Runs bcrypt hashing and verification on a small bounded thread pool.
+
+    bcrypt releases the GIL while it works, so a few threads keep the CPU
+    busy without tying up request threads. Once HASH_QUEUE_LIMIT jobs are
+    waiting, new ones are refused straight away instead of queueing forever.
+    """
+
+    def __init__(self, rounds=BCRYPT_LOG_ROUNDS, workers=HASH_WORKERS,
+                 queue_limit=HASH_QUEUE_LIMIT, timeout=HASH_TIMEOUT):
+        self.rounds = rounds
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self._pending = 0  # submitted but not finished (queued + running)
+        self._running = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._queue_wait_total = 0.0
+        self._work_total = 0.0
+        self._work_max = 0.0
+
+    def after_fork(self):
+        # The parent's worker threads don't exist in a forked child, start over with an empty pool
+        self.__init__(self.rounds, self.workers, self.queue_limit, self.timeout)
+
+    ## pool ----------------------------------------------------------------------
+    def _run(self, fn, *args):
+        with self._lock:
+            if self._pending >= self.workers + self.queue_limit:
+                self._rejected += 1
+                raise HashPoolBusy("Server is busy, please try again shortly.")
+            self._pending += 1
+        submitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            with self._lock:
+                self._running += 1
+                self._queue_wait_total += started - submitted
+            try:
+                return fn(*args)
+            finally:
+                took = time.perf_counter() - started
+                with self._lock:
+                    self._running -= 1
+                    self._pending -= 1
+                    self._completed += 1
+                    self._work_total += took
+                    self._work_max = max(self._work_max, took)
+
+        try:
+            future = self._executor.submit(job)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            raise HashPoolBusy("Server is busy, please try again shortly.")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "rounds": self.rounds,
+                "queue_limit": self.queue_limit,
+                "queue_depth": self._pending - self._running,
+                "running": self._running,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "timeouts": self._timeouts,
+                "queue_wait_seconds_avg": self._queue_wait_total / self._completed if self._completed else 0.0,
+                "work_seconds_avg": self._work_total / self._completed if self._completed else 0.0,
+                "work_seconds_max": self._work_max
+            }
+
+    ## bcrypt --------------------------------------------------------------------
+    def _hash(self, value, rounds):
+        return bcrypt.hashpw(value.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+    def _check(self, hashed, value):
+        try:
+            return bcrypt.checkpw(value.encode("utf-8"), hashed.encode("utf-8"))
+        except ValueError:
+            # Not a bcrypt hash
+            return False
+
+    def hash(self, value):
+        return self._run(self._hash, value, self.rounds)
+
+    def verify(self, hashed, value):
+        return self._run(self._check, hashed, value)
+
+    def needs_rehash(self, hashed):
+        # $2b$12$... -> 12
+        try:
+            return int(hashed.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return False
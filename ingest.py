@@ -0,0 +1,256 @@
+from datetime import datetime
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Write-behind mode is on when this points at a local SQLite file
+INGEST_QUEUE_PATH = os.getenv("INGEST_QUEUE_PATH")
+
+# Entries per drain transaction, how long an idle worker sleeps, and the retry backoff ceiling (seconds)
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "0.5"))
+INGEST_RETRY_MAX_SECONDS = float(os.getenv("INGEST_RETRY_MAX_SECONDS", "30"))
+
+# An entry that fails this many times on its own is parked as a dead letter
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "10"))
+
+QUEUE_DDL = """
+    CREATE TABLE IF NOT EXISTS IngestQueue (
+        Seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        IdempotencyKey TEXT NOT NULL UNIQUE,
+        UserID INTEGER NOT NULL,
+        Entry TEXT NOT NULL,
+        EnqueuedAt REAL NOT NULL,
+        Attempts INTEGER NOT NULL DEFAULT 0,
+        LastError TEXT,
+        Dead INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS IX_IngestQueue_Live ON IngestQueue (Dead, Seq);
+"""
+
+log = logging.getLogger(__name__)
+
+
+def _encode(entry):
+    return json.dumps({key: value.isoformat() if isinstance(value, datetime) else value
+                       for key, value in entry.items()})
+
+def _decode(raw):
+    entry = json.loads(raw)
+    entry["log_time"] = datetime.fromisoformat(entry["log_time"])
+    return entry
+
+
+class WriteBehindQueue:
+    """Durable local queue in front of the ActivityLog writes.
+
+    Requests append an already priced entry to a WAL-mode SQLite file and
+    return. A background thread drains it to the main database in batched
+    transactions through writer(batch), retrying with backoff while the
+    database is unavailable (the `transient` exception types). An entry the
+    database keeps rejecting is parked as a dead letter after max_attempts.
+    Every entry carries an idempotency key that the writer stores with the
+    row, so a batch retried after a commit whose acknowledgement was lost is
+    not written twice.
+    """
+
+    def __init__(self, path, writer, transient=(), batch_size=INGEST_BATCH_SIZE, poll=INGEST_POLL_SECONDS,
+                 retry_max=INGEST_RETRY_MAX_SECONDS, max_attempts=INGEST_MAX_ATTEMPTS):
+        self.path = path
+        self.writer = writer
+        self.transient = tuple(transient)
+        self.batch_size = batch_size
+        self.poll = poll
+        self.retry_max = retry_max
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._written = 0
+        self._failures = 0
+        self._last_error = None
+
+        self._connection = self._connect()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = FULL")
+        connection.executescript(QUEUE_DDL)
+        return connection
+
+    def _db(self):
+        # Called with _lock held; after a fork the connection is opened on first use
+        if self._connection is None:
+            self._connection = self._connect()
+        return self._connection
+
+    def after_fork(self):
+        # SQLite connections mustn't cross a fork: a forked child opens its own when it first touches
+        # the queue, and its drain thread starts on the first enqueue (see start)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._connection = None
+        self._thread = None
+
+    ## producer ------------------------------------------------------------------
+    def enqueue(self, user_id, entry, key=None):
+        # Returns the idempotency key; enqueueing the same key twice keeps the first entry
+        key = key or uuid.uuid4().hex
+        with self._lock:
+            self._db().execute(
+                "INSERT OR IGNORE INTO IngestQueue (IdempotencyKey, UserID, Entry, EnqueuedAt) VALUES (?, ?, ?, ?)",
+                (key, user_id, _encode(entry), time.time())
+            )
+        self.start()
+        self._wake.set()
+        return key
+
+    ## worker --------------------------------------------------------------------
+    def start(self):
+        # Threads don't survive a fork, so a forked worker process starts its own
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="ingest-drain", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+
+    def _run(self):
+        backoff = self.poll
+        while not self._stop.is_set():
+            try:
+                written, _ = self.drain_once()
+                backoff = self.poll
+            except self.transient:
+                # The database is unavailable and drain_once has recorded it, back off before the next try
+                backoff = min(max(backoff * 2, 0.5), self.retry_max)
+                self._stop.wait(backoff)
+                continue
+            except Exception as e:
+                # Not the entries' fault either (the queue file itself, say), keep the worker alive
+                with self._lock:
+                    self._failures += 1
+                    self._last_error = str(e)
+                log.exception("Write-behind drain failed")
+                self._stop.wait(self.retry_max)
+                continue
+            # Idle, or every entry in the batch was rejected: wait rather than retry the same entries at once
+            if not written:
+                self._wake.wait(self.poll)
+                self._wake.clear()
+
+    def _pending(self, limit, after=0):
+        with self._lock:
+            rows = self._db().execute(
+                "SELECT Seq, IdempotencyKey, UserID, Entry, Attempts FROM IngestQueue"
+                " WHERE Dead = 0 AND Seq > ? ORDER BY Seq LIMIT ?",
+                (after, limit)
+            ).fetchall()
+        return [(seq, key, user_id, _decode(raw), attempts) for seq, key, user_id, raw, attempts in rows]
+
+    def _remove(self, seqs):
+        with self._lock:
+            self._db().executemany("DELETE FROM IngestQueue WHERE Seq = ?", [(seq,) for seq in seqs])
+
+    def _record_failure(self, error, seqs=()):
+        with self._lock:
+            self._failures += 1
+            self._last_error = str(error)
+            self._db().executemany(
+                "UPDATE IngestQueue SET Attempts = Attempts + 1, LastError = ?,"
+                " Dead = CASE WHEN Attempts + 1 >= ? THEN 1 ELSE 0 END WHERE Seq = ?",
+                [(str(error)[:500], self.max_attempts, seq) for seq in seqs]
+            )
+        log.warning("Write-behind drain failed: %s", error)
+
+    def drain_once(self, after=0):
+        # Write one batch of the entries queued after Seq `after`; returns (entries written, last Seq taken),
+        # the Seq None when nothing was pending. Entries the database rejects have an attempt counted (and are
+        # parked once they run out) and are skipped, only the `transient` errors are raised
+        batch = self._pending(self.batch_size, after)
+        if not batch:
+            return 0, None
+        last = batch[-1][0]
+        try:
+            self.writer([(key, user_id, entry) for _, key, user_id, entry, _ in batch])
+        except self.transient as e:
+            # The database is down or busy, not the entries' fault: retry later without counting an attempt
+            self._record_failure(e)
+            raise
+        except Exception as e:
+            if len(batch) == 1:
+                self._record_failure(e, [batch[0][0]])
+                return 0, last
+            return self._isolate(batch), last
+        self._remove([seq for seq, *_ in batch])
+        with self._lock:
+            self._written += len(batch)
+        return len(batch), last
+
+    def _isolate(self, batch):
+        # The batch was rejected: write entries one at a time so one bad entry can't hold up the rest
+        written = 0
+        for seq, key, user_id, entry, _ in batch:
+            try:
+                self.writer([(key, user_id, entry)])
+            except self.transient as e:
+                self._record_failure(e)
+                raise
+            except Exception as e:
+                self._record_failure(e, [seq])
+                continue
+            self._remove([seq])
+            written += 1
+            with self._lock:
+                self._written += 1
+        return written
+
+    def retry_dead(self):
+        # Put dead letters back in the queue, e.g. after fixing the reference data they pointed at
+        with self._lock:
+            return self._db().execute(
+                "UPDATE IngestQueue SET Dead = 0, Attempts = 0 WHERE Dead = 1").rowcount
+
+    def drain(self):
+        # One pass over the queue in the calling thread, for the CLI and shutdown; returns how many were
+        # written. Rejected entries stay queued (or parked) for the worker, they don't stop the pass
+        total, after = 0, 0
+        while True:
+            written, after = self.drain_once(after)
+            if after is None:
+                return total
+            total += written
+
+    ## monitoring ----------------------------------------------------------------
+    def stats(self):
+        with self._lock:
+            depth, oldest = self._db().execute(
+                "SELECT COUNT(*), MIN(EnqueuedAt) FROM IngestQueue WHERE Dead = 0").fetchone()
+            dead = self._db().execute("SELECT COUNT(*) FROM IngestQueue WHERE Dead = 1").fetchone()[0]
+            return {
+                "depth": depth,
+                "lag_seconds": time.time() - oldest if oldest is not None else 0.0,
+                "dead_letters": dead,
+                "written": self._written,
+                "failures": self._failures,
+                "worker_alive": self._thread is not None and self._thread.is_alive() and self._pid == os.getpid(),
+                "last_error": self._last_error
+            }
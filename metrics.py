@@ -0,0 +1,250 @@
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+import re
+import threading
+import time
+import os
+
+# Queries slower than this (seconds) are kept as slow-query samples
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0.1"))
+SLOW_QUERY_SAMPLES = int(os.getenv("SLOW_QUERY_SAMPLES", "20"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=""):
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    # A labelled Prometheus histogram; observe() is a bisect and a few additions under a lock
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {_number(value)}")
+        return lines
+
+
+## SQL statement normalisation ----------------------------------------------------------------------------
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w@$])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_PARAM = re.compile(r"(?<!:):\w+|%\(\w+\)s|\?")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_ROWS = re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+")
+_SPACE = re.compile(r"\s+")
+
+# Turn a statement into its shape: literals and parameters become ?, long lists collapse
+def normaliseStatement(statement):
+    statement = _STRING.sub("?", statement)
+    statement = _PARAM.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    statement = _LIST.sub("(?)", statement)
+    statement = _ROWS.sub("(?), ...", statement)
+    return _SPACE.sub(" ", statement).strip()
+
+
+class Metrics:
+    """Per-route latency, per-request SQL counts/time and slow-query samples.
+
+    Rendered in Prometheus text format by render(). Extra gauges can be
+    added with add_gauges(), a callable returning (name, help, value) rows,
+    and other modules' Histogram/Counter series with add_metric().
+    """
+
+    def __init__(self):
+        self.request_latency = Histogram(
+            "http_request_duration_seconds", "Request latency by route.",
+            ("route", "method"), LATENCY_BUCKETS)
+        self.requests = Counter(
+            "http_requests_total", "Requests by route and status.",
+            ("route", "method", "status"))
+        self.request_queries = Histogram(
+            "http_request_sql_queries", "SQL statements issued per request.",
+            ("route", "method"), QUERY_COUNT_BUCKETS)
+        self.request_sql_time = Histogram(
+            "http_request_sql_seconds", "Time spent executing SQL per request.",
+            ("route", "method"), LATENCY_BUCKETS)
+        self.sql_latency = Histogram(
+            "sql_query_duration_seconds", "SQL statement latency, inside and outside requests.",
+            (), LATENCY_BUCKETS)
+        self._slow = {}  # normalised statement -> [count, total seconds, max seconds]
+        self._slow_lock = threading.Lock()
+        self._normalised = {}
+        self._gauges = []
+        self._metrics = []
+
+    ## hooks ---------------------------------------------------------------------------------------------
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def instrument_engine(self, engine):
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        event.listen(engine, "handle_error", self._handle_error)
+
+    def add_gauges(self, collector):
+        self._gauges.append(collector)
+
+    def add_metric(self, metric):
+        self._metrics.append(metric)
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_sql_seconds = 0.0
+
+    def _after_request(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _teardown_request(self, exception=None):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return
+        took = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        labels = (route, request.method)
+        status = g.pop("metrics_status", 500 if exception is not None else 200)
+        self.request_latency.observe(labels, took)
+        self.requests.inc(labels + (str(status),))
+        self.request_queries.observe(labels, g.pop("metrics_queries", 0))
+        self.request_sql_time.observe(labels, g.pop("metrics_sql_seconds", 0.0))
+
+    # Statements don't nest on a connection, so one start time per connection is enough
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info["metrics_query_start"] = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop("metrics_query_start", None)
+        if start is None:
+            return
+        took = time.perf_counter() - start
+        self.sql_latency.observe((), took)
+        if has_request_context() and "metrics_start" in g:
+            g.metrics_queries += 1
+            g.metrics_sql_seconds += took
+        if took >= SLOW_QUERY_SECONDS:
+            self._record_slow(statement, took)
+
+    def _handle_error(self, context):
+        # A statement that raised never reaches after_cursor_execute, don't leave its start on the pooled connection
+        if context.connection is not None:
+            context.connection.info.pop("metrics_query_start", None)
+
+    def _record_slow(self, statement, took):
+        shape = self._normalised.get(statement)
+        if shape is None:
+            shape = normaliseStatement(statement)[:300]
+            if len(self._normalised) < 1000:
+                self._normalised[statement] = shape
+        with self._slow_lock:
+            sample = self._slow.get(shape)
+            if sample is None:
+                if len(self._slow) >= SLOW_QUERY_SAMPLES:
+                    # Make room by dropping the least slow sample, if this one is slower
+                    fastest = min(self._slow, key=lambda key: self._slow[key][2])
+                    if self._slow[fastest][2] >= took:
+                        return
+                    del self._slow[fastest]
+                sample = self._slow[shape] = [0, 0.0, 0.0]
+            sample[0] += 1
+            sample[1] += took
+            sample[2] = max(sample[2], took)
+
+    def slow_queries(self):
+        with self._slow_lock:
+            return sorted(
+                ({"statement": shape, "count": count, "total_seconds": total, "max_seconds": worst}
+                 for shape, (count, total, worst) in self._slow.items()),
+                key=lambda sample: sample["max_seconds"], reverse=True
+            )
+
+    ## output --------------------------------------------------------------------------------------------
+    def render(self):
+        lines = []
+        for metric in (self.request_latency, self.requests, self.request_queries,
+                       self.request_sql_time, self.sql_latency, *self._metrics):
+            lines.extend(metric.render())
+
+        samples = self.slow_queries()
+        lines.append(f"# HELP sql_slow_query_max_seconds Slowest run of statements slower than {SLOW_QUERY_SECONDS}s.")
+        lines.append("# TYPE sql_slow_query_max_seconds gauge")
+        for sample in samples:
+            lines.append(f'sql_slow_query_max_seconds{{statement="{_escape(sample["statement"])}"}} {_number(sample["max_seconds"])}')
+        lines.append("# HELP sql_slow_query_total Times each slow statement was seen.")
+        lines.append("# TYPE sql_slow_query_total counter")
+        for sample in samples:
+            lines.append(f'sql_slow_query_total{{statement="{_escape(sample["statement"])}"}} {sample["count"]}')
+
+        for collector in self._gauges:
+            for name, help_text, value in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,88 @@
+from sqlalchemy import text
+
+import os
+import re
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# T-SQL batch separator, the same convention sqlcmd and SSMS use
+_GO = re.compile(r"^\s*GO\s*$", re.IGNORECASE | re.MULTILINE)
+
+VERSION_TABLE = {
+    "mssql": """
+        IF OBJECT_ID('SchemaVersion', 'U') IS NULL
+        CREATE TABLE SchemaVersion (
+            Version INT NOT NULL PRIMARY KEY,
+            Name NVARCHAR(200) NOT NULL,
+            AppliedAt DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME()
+        )
+    """,
+    "sqlite": """
+        CREATE TABLE IF NOT EXISTS SchemaVersion (
+            Version INTEGER NOT NULL PRIMARY KEY,
+            Name TEXT NOT NULL,
+            AppliedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """,
+}
+
+
+# (version, name, path) for every migration file of a dialect, in order
+def availableMigrations(dialect):
+    folder = os.path.join(MIGRATIONS_DIR, dialect)
+    if not os.path.isdir(folder):
+        raise ValueError(f"No migrations for the {dialect} dialect.")
+    found = []
+    for filename in sorted(os.listdir(folder)):
+        match = re.match(r"^(\d+)_([\w-]+)\.sql$", filename)
+        if match:
+            found.append((int(match.group(1)), match.group(2), os.path.join(folder, filename)))
+    return found
+
+def appliedVersions(engine):
+    with engine.begin() as connection:
+        connection.execute(text(VERSION_TABLE[engine.dialect.name]))
+        return {row[0] for row in connection.execute(text("SELECT Version FROM SchemaVersion"))}
+
+def pendingMigrations(engine):
+    applied = appliedVersions(engine)
+    return [m for m in availableMigrations(engine.dialect.name) if m[0] not in applied]
+
+# Apply one migration and record it, all in one transaction
+def applyMigration(engine, version, name, path):
+    with open(path) as f:
+        script = f.read()
+
+    if engine.dialect.name == "sqlite":
+        # executescript() manages its own transactions, so wrap the script and the bookkeeping in one
+        connection = engine.raw_connection()
+        try:
+            connection.executescript(
+                "BEGIN;\n" + script +
+                f"\n;INSERT INTO SchemaVersion (Version, Name) VALUES ({int(version)}, '{name}');\nCOMMIT;"
+            )
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+        return
+
+    with engine.begin() as connection:
+        for batch in _GO.split(script):
+            if batch.strip():
+                connection.exec_driver_sql(batch)
+        connection.execute(
+            text("INSERT INTO SchemaVersion (Version, Name) VALUES (:version, :name)"),
+            {"version": version, "name": name}
+        )
+
+# Apply everything that hasn't been applied yet, returns what ran
+def migrate(engine, target=None):
+    ran = []
+    for version, name, path in pendingMigrations(engine):
+        if target is not None and version > target:
+            break
+        applyMigration(engine, version, name, path)
+        ran.append((version, name))
+    return ran
@@ -0,0 +1,85 @@
+-- EcoCalc base schema. Every table is only created when missing, so this is a no-op
+-- on the existing production database and just records it as version 1
+
+IF OBJECT_ID('ActivityType', 'U') IS NULL
+CREATE TABLE ActivityType (
+    ActivityID INT NOT NULL PRIMARY KEY,
+    ActivityTypeName NVARCHAR(50) NOT NULL
+);
+GO
+
+IF OBJECT_ID('ApplianceTypes', 'U') IS NULL
+CREATE TABLE ApplianceTypes (
+    TypeID INT IDENTITY(1, 1) NOT NULL PRIMARY KEY,
+    Category NVARCHAR(100) NOT NULL
+);
+GO
+
+IF OBJECT_ID('FoodType', 'U') IS NULL
+CREATE TABLE FoodType (
+    TypeID INT IDENTITY(1, 1) NOT NULL PRIMARY KEY,
+    TypeName NVARCHAR(100) NOT NULL
+);
+GO
+
+IF OBJECT_ID('TransportType', 'U') IS NULL
+CREATE TABLE TransportType (
+    TypeID INT IDENTITY(1, 1) NOT NULL PRIMARY KEY,
+    TypeName NVARCHAR(100) NOT NULL
+);
+GO
+
+IF OBJECT_ID('Appliance', 'U') IS NULL
+CREATE TABLE Appliance (
+    ApplianceID INT IDENTITY(1, 1) NOT NULL PRIMARY KEY,
+    ApplianceName NVARCHAR(100) NOT NULL,
+    AverageKWH FLOAT NOT NULL,
+    ApplianceTypeID INT NOT NULL REFERENCES ApplianceTypes (TypeID)
+);
+GO
+
+IF OBJECT_ID('Transport', 'U') IS NULL
+CREATE TABLE Transport (
+    TransportID INT IDENTITY(1, 1) NOT NULL PRIMARY KEY,
+    TransportName NVARCHAR(100) NOT NULL,
+    Co2e FLOAT NOT NULL,
+    FuelType NVARCHAR(50) NULL,
+    TransportTypeID INT NOT NULL REFERENCES TransportType (TypeID)
+);
+GO
+
+IF OBJECT_ID('Food', 'U') IS NULL
+CREATE TABLE Food (
+    FoodID INT IDENTITY(1, 1) NOT NULL PRIMARY KEY,
+    Product NVARCHAR(100) NOT NULL,
+    Co2e FLOAT NOT NULL,
+    FoodTypeID INT NOT NULL REFERENCES FoodType (TypeID)
+);
+GO
+
+IF OBJECT_ID('UserDetails', 'U') IS NULL
+CREATE TABLE UserDetails (
+    UserID INT IDENTITY(1, 1) NOT NULL PRIMARY KEY,
+    username NVARCHAR(50) NOT NULL,
+    email NVARCHAR(255) NOT NULL,
+    password NVARCHAR(255) NOT NULL
+);
+GO
+
+IF OBJECT_ID('ActivityLog', 'U') IS NULL
+CREATE TABLE ActivityLog (
+    ActivityLogID INT IDENTITY(1, 1) NOT NULL PRIMARY KEY,
+    ActivityItemID INT NOT NULL,
+    ActivityTypeID INT NOT NULL REFERENCES ActivityType (ActivityID),
+    Co2e FLOAT NOT NULL,
+    LogTime DATETIME NOT NULL
+);
+GO
+
+IF OBJECT_ID('UserLog', 'U') IS NULL
+CREATE TABLE UserLog (
+    UserLogID INT IDENTITY(1, 1) NOT NULL PRIMARY KEY,
+    UserID INT NOT NULL REFERENCES UserDetails (UserID),
+    ActivityLogID INT NOT NULL REFERENCES ActivityLog (ActivityLogID)
+);
+GO
@@ -0,0 +1,13 @@
+-- Per user, per day, per activity type Co2e totals kept in step with ActivityLog
+-- Backfill with: flask --app carbon rebuild-rollup
+
+IF OBJECT_ID('DailyCo2eRollup', 'U') IS NULL
+CREATE TABLE DailyCo2eRollup (
+    UserID INT NOT NULL,
+    LogDate DATE NOT NULL,
+    ActivityTypeID INT NOT NULL,
+    TotalCo2e FLOAT NOT NULL,
+    LogCount INT NOT NULL,
+    CONSTRAINT PK_DailyCo2eRollup PRIMARY KEY (UserID, LogDate, ActivityTypeID)
+);
+GO
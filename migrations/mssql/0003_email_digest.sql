@@ -0,0 +1,11 @@
+-- Keyed HMAC of the email address so users can be found by email through an index.
+-- Existing rows are backfilled the first time their owner passes the old bcrypt email check.
+
+IF COL_LENGTH('UserDetails', 'EmailDigest') IS NULL
+    ALTER TABLE UserDetails ADD EmailDigest CHAR(64) NULL;
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'UX_UserDetails_EmailDigest')
+    CREATE UNIQUE INDEX UX_UserDetails_EmailDigest
+    ON UserDetails (EmailDigest) WHERE EmailDigest IS NOT NULL;
+GO
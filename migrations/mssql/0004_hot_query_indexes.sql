@@ -0,0 +1,35 @@
+-- Covering indexes for the hot queries in carbon.py
+
+-- userlog, /api/logs, /api/export, /api/activity-data: seek to a user's log ids
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_UserLog_UserID_ActivityLogID')
+    CREATE UNIQUE INDEX IX_UserLog_UserID_ActivityLogID ON UserLog (UserID, ActivityLogID);
+GO
+
+-- delete_log and joins coming from the ActivityLog side
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_UserLog_ActivityLogID')
+    CREATE INDEX IX_UserLog_ActivityLogID ON UserLog (ActivityLogID) INCLUDE (UserID);
+GO
+
+-- Date range filters on LogTime
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_ActivityLog_LogTime')
+    CREATE INDEX IX_ActivityLog_LogTime ON ActivityLog (LogTime)
+    INCLUDE (ActivityTypeID, ActivityItemID, Co2e);
+GO
+
+-- Login lookups
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_UserDetails_username')
+    CREATE INDEX IX_UserDetails_username ON UserDetails (username) INCLUDE (password, email, EmailDigest);
+GO
+
+-- Name lookups used by the log endpoints
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Appliance_ApplianceName')
+    CREATE INDEX IX_Appliance_ApplianceName ON Appliance (ApplianceName) INCLUDE (AverageKWH);
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Transport_TransportName')
+    CREATE INDEX IX_Transport_TransportName ON Transport (TransportName) INCLUDE (Co2e);
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Food_Product')
+    CREATE INDEX IX_Food_Product ON Food (Product) INCLUDE (Co2e);
+GO
@@ -0,0 +1,48 @@
+-- Record the owning user on ActivityLog itself so a log is written with one INSERT.
+-- UserLog becomes a view over ActivityLog for anything that still reads (or writes) it.
+
+IF COL_LENGTH('ActivityLog', 'UserID') IS NULL
+    ALTER TABLE ActivityLog ADD UserID INT NULL
+    CONSTRAINT FK_ActivityLog_UserDetails REFERENCES UserDetails (UserID);
+GO
+
+IF OBJECT_ID('UserLog', 'U') IS NOT NULL
+    UPDATE al
+    SET al.UserID = ul.UserID
+    FROM ActivityLog al
+    JOIN UserLog ul ON ul.ActivityLogID = al.ActivityLogID;
+GO
+
+-- A user's logs newest first: userlog, /api/logs, /api/export, delete_log ownership
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_ActivityLog_UserID_LogTime')
+    CREATE INDEX IX_ActivityLog_UserID_LogTime ON ActivityLog (UserID, LogTime DESC, ActivityLogID DESC)
+    INCLUDE (ActivityItemID, ActivityTypeID, Co2e);
+GO
+
+IF OBJECT_ID('UserLog', 'U') IS NOT NULL
+    DROP TABLE UserLog;
+GO
+
+CREATE VIEW UserLog AS
+SELECT ActivityLogID AS UserLogID, UserID, ActivityLogID
+FROM ActivityLog
+WHERE UserID IS NOT NULL;
+GO
+
+CREATE TRIGGER UserLog_insert ON UserLog INSTEAD OF INSERT AS
+BEGIN
+    SET NOCOUNT ON;
+    UPDATE al SET al.UserID = i.UserID
+    FROM ActivityLog al
+    JOIN inserted i ON i.ActivityLogID = al.ActivityLogID;
+END
+GO
+
+CREATE TRIGGER UserLog_delete ON UserLog INSTEAD OF DELETE AS
+BEGIN
+    SET NOCOUNT ON;
+    UPDATE al SET al.UserID = NULL
+    FROM ActivityLog al
+    JOIN deleted d ON d.ActivityLogID = al.ActivityLogID;
+END
+GO
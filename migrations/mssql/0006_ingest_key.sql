@@ -0,0 +1,11 @@
+-- Idempotency key of entries written through the write-behind queue (ingest.py),
+-- so a batch retried after a lost commit acknowledgement can skip what already landed
+
+IF COL_LENGTH('ActivityLog', 'IngestKey') IS NULL
+    ALTER TABLE ActivityLog ADD IngestKey VARCHAR(80) NULL;
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'UX_ActivityLog_IngestKey')
+    CREATE UNIQUE INDEX UX_ActivityLog_IngestKey
+    ON ActivityLog (IngestKey) WHERE IngestKey IS NOT NULL;
+GO
@@ -0,0 +1,55 @@
+-- Emission factors over time. A row applies from ValidFrom until the next row for the same
+-- activity type and item; ActivityItemID NULL applies to every item of the type (the grid
+-- intensity for appliances, in kg Co2e per kWh). Items without a row use Transport.Co2e / Food.Co2e.
+-- Change a factor with: flask --app carbon add-factor, then flask --app carbon recalc-co2e
+
+IF OBJECT_ID('EmissionFactor', 'U') IS NULL
+CREATE TABLE EmissionFactor (
+    FactorID INT IDENTITY(1, 1) NOT NULL PRIMARY KEY,
+    ActivityTypeID INT NOT NULL REFERENCES ActivityType (ActivityID),
+    ActivityItemID INT NULL,
+    ValidFrom DATETIME NOT NULL,
+    Factor FLOAT NOT NULL,
+    CONSTRAINT UX_EmissionFactor UNIQUE (ActivityTypeID, ActivityItemID, ValidFrom)
+);
+GO
+
+-- The constant the app used until now
+IF NOT EXISTS (SELECT 1 FROM EmissionFactor WHERE ActivityTypeID = 1 AND ActivityItemID IS NULL)
+    INSERT INTO EmissionFactor (ActivityTypeID, ActivityItemID, ValidFrom, Factor)
+    VALUES (1, NULL, '19000101', 0.207074);
+GO
+
+-- The amount behind each log (kWh, miles or kg) so Co2e can be recomputed when a factor changes,
+-- backfilled from the factors in force so far
+IF COL_LENGTH('ActivityLog', 'Quantity') IS NULL
+    ALTER TABLE ActivityLog ADD Quantity FLOAT NULL;
+GO
+
+UPDATE ActivityLog SET Quantity = Co2e / 0.207074 WHERE ActivityTypeID = 1 AND Quantity IS NULL;
+
+UPDATE al SET al.Quantity = al.Co2e / t.Co2e
+FROM ActivityLog al
+JOIN Transport t ON t.TransportID = al.ActivityItemID
+WHERE al.ActivityTypeID = 2 AND al.Quantity IS NULL AND t.Co2e <> 0;
+
+UPDATE al SET al.Quantity = al.Co2e / f.Co2e
+FROM ActivityLog al
+JOIN Food f ON f.FoodID = al.ActivityItemID
+WHERE al.ActivityTypeID = 4 AND al.Quantity IS NULL AND f.Co2e <> 0;
+GO
+
+-- Progress of recalc-co2e runs, so an interrupted run can carry on where it stopped
+IF OBJECT_ID('Co2eRecalcJob', 'U') IS NULL
+CREATE TABLE Co2eRecalcJob (
+    JobID INT IDENTITY(1, 1) NOT NULL PRIMARY KEY,
+    ActivityTypeID INT NULL,
+    ActivityItemID INT NULL,
+    Since DATETIME NULL,
+    LastActivityLogID INT NOT NULL DEFAULT 0,
+    RowsScanned INT NOT NULL DEFAULT 0,
+    RowsChanged INT NOT NULL DEFAULT 0,
+    StartedAt DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+    FinishedAt DATETIME2 NULL
+);
+GO
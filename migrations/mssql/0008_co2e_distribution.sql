@@ -0,0 +1,21 @@
+-- Everyone's Co2e per week and per month as log-scale histograms of per-user totals, one row per
+-- period and activity type (ActivityTypeID 0 is all types together); read by /api/compare
+-- Refresh with: flask --app carbon refresh-distributions
+
+IF OBJECT_ID('Co2eDistribution', 'U') IS NULL
+CREATE TABLE Co2eDistribution (
+    Period VARCHAR(10) NOT NULL,
+    PeriodStart DATE NOT NULL,
+    ActivityTypeID INT NOT NULL,
+    Users INT NOT NULL,
+    TotalCo2e FLOAT NOT NULL,
+    Histogram NVARCHAR(MAX) NOT NULL,
+    ComputedAt DATETIME2 NOT NULL DEFAULT SYSUTCDATETIME(),
+    CONSTRAINT PK_Co2eDistribution PRIMARY KEY (Period, PeriodStart, ActivityTypeID)
+);
+GO
+
+-- The refresh reads one period of the rollup for every user
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_DailyCo2eRollup_LogDate')
+    CREATE INDEX IX_DailyCo2eRollup_LogDate ON DailyCo2eRollup (LogDate) INCLUDE (TotalCo2e);
+GO
@@ -0,0 +1,12 @@
+-- Usernames must be unique, as they are on SQLite: register's IntegrityError handling relies on the
+-- database refusing the second of two concurrent signups for the same name.
+-- Fails if duplicate usernames already exist; rename them first, then rerun.
+
+IF EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_UserDetails_username')
+    DROP INDEX IX_UserDetails_username ON UserDetails;
+GO
+
+-- Login and password reset lookups
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'UX_UserDetails_username')
+    CREATE UNIQUE INDEX UX_UserDetails_username ON UserDetails (username) INCLUDE (password, email, EmailDigest);
+GO
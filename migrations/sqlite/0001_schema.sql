@@ -0,0 +1,107 @@
+-- SQLite version of the EcoCalc schema, for running the app locally, with sample reference data
+
+CREATE TABLE IF NOT EXISTS ActivityType (
+    ActivityID INTEGER PRIMARY KEY,
+    ActivityTypeName TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ApplianceTypes (
+    TypeID INTEGER PRIMARY KEY,
+    Category TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS FoodType (
+    TypeID INTEGER PRIMARY KEY,
+    TypeName TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS TransportType (
+    TypeID INTEGER PRIMARY KEY,
+    TypeName TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS Appliance (
+    ApplianceID INTEGER PRIMARY KEY,
+    ApplianceName TEXT NOT NULL,
+    AverageKWH REAL NOT NULL,
+    ApplianceTypeID INTEGER NOT NULL REFERENCES ApplianceTypes (TypeID)
+);
+
+CREATE TABLE IF NOT EXISTS Transport (
+    TransportID INTEGER PRIMARY KEY,
+    TransportName TEXT NOT NULL,
+    Co2e REAL NOT NULL,
+    FuelType TEXT,
+    TransportTypeID INTEGER NOT NULL REFERENCES TransportType (TypeID)
+);
+
+CREATE TABLE IF NOT EXISTS Food (
+    FoodID INTEGER PRIMARY KEY,
+    Product TEXT NOT NULL,
+    Co2e REAL NOT NULL,
+    FoodTypeID INTEGER NOT NULL REFERENCES FoodType (TypeID)
+);
+
+CREATE TABLE IF NOT EXISTS UserDetails (
+    UserID INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    email TEXT NOT NULL,
+    password TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ActivityLog (
+    ActivityLogID INTEGER PRIMARY KEY,
+    ActivityItemID INTEGER NOT NULL,
+    ActivityTypeID INTEGER NOT NULL REFERENCES ActivityType (ActivityID),
+    Co2e REAL NOT NULL,
+    LogTime TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS UserLog (
+    UserLogID INTEGER PRIMARY KEY,
+    UserID INTEGER NOT NULL REFERENCES UserDetails (UserID),
+    ActivityLogID INTEGER NOT NULL REFERENCES ActivityLog (ActivityLogID)
+);
+
+-- Reference data
+INSERT OR IGNORE INTO ActivityType (ActivityID, ActivityTypeName) VALUES
+    (1, 'Appliance'), (2, 'Transport'), (4, 'Food');
+
+INSERT OR IGNORE INTO ApplianceTypes (TypeID, Category) VALUES
+    (1, 'Kitchen'), (2, 'Laundry'), (3, 'Entertainment'), (4, 'Heating');
+
+INSERT OR IGNORE INTO TransportType (TypeID, TypeName) VALUES
+    (1, 'Personal'), (2, 'Public');
+
+INSERT OR IGNORE INTO FoodType (TypeID, TypeName) VALUES
+    (1, 'Meat'), (2, 'Dairy'), (3, 'Vegetables'), (4, 'Grains');
+
+INSERT OR IGNORE INTO Appliance (ApplianceID, ApplianceName, AverageKWH, ApplianceTypeID) VALUES
+    (1, 'Kettle', 2.2, 1),
+    (2, 'Microwave', 1.0, 1),
+    (3, 'Oven', 2.4, 1),
+    (4, 'Washing Machine', 1.2, 2),
+    (5, 'Tumble Dryer', 2.5, 2),
+    (6, 'Television', 0.1, 3),
+    (7, 'Games Console', 0.2, 3),
+    (8, 'Electric Heater', 2.0, 4);
+
+INSERT OR IGNORE INTO Transport (TransportID, TransportName, Co2e, FuelType, TransportTypeID) VALUES
+    (1, 'Small Car', 0.22, 'Petrol', 1),
+    (2, 'Large Car', 0.43, 'Diesel', 1),
+    (3, 'Electric Car', 0.07, 'Electric', 1),
+    (4, 'Motorbike', 0.18, 'Petrol', 1),
+    (5, 'Bus', 0.16, 'Diesel', 2),
+    (6, 'Train', 0.06, 'Electric', 2),
+    (7, 'Coach', 0.04, 'Diesel', 2);
+
+INSERT OR IGNORE INTO Food (FoodID, Product, Co2e, FoodTypeID) VALUES
+    (1, 'Beef', 99.5, 1),
+    (2, 'Lamb', 39.7, 1),
+    (3, 'Chicken', 9.9, 1),
+    (4, 'Cheese', 23.9, 2),
+    (5, 'Milk', 3.2, 2),
+    (6, 'Potatoes', 0.5, 3),
+    (7, 'Tomatoes', 2.1, 3),
+    (8, 'Rice', 4.5, 4),
+    (9, 'Wheat', 1.6, 4);
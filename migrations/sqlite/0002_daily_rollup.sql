@@ -0,0 +1,11 @@
+-- Per user, per day, per activity type Co2e totals kept in step with ActivityLog
+-- Backfill with: flask --app carbon rebuild-rollup
+
+CREATE TABLE IF NOT EXISTS DailyCo2eRollup (
+    UserID INTEGER NOT NULL,
+    LogDate DATE NOT NULL,
+    ActivityTypeID INTEGER NOT NULL,
+    TotalCo2e REAL NOT NULL,
+    LogCount INTEGER NOT NULL,
+    PRIMARY KEY (UserID, LogDate, ActivityTypeID)
+);
@@ -0,0 +1,6 @@
+-- Keyed HMAC of the email address so users can be found by email through an index
+
+ALTER TABLE UserDetails ADD COLUMN EmailDigest TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS UX_UserDetails_EmailDigest
+    ON UserDetails (EmailDigest) WHERE EmailDigest IS NOT NULL;
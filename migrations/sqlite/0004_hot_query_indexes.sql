@@ -0,0 +1,15 @@
+-- Indexes for the hot queries; SQLite has no INCLUDE so extra columns go on the key
+
+-- userlog, /api/logs, /api/export, /api/activity-data: a user's log ids
+CREATE UNIQUE INDEX IF NOT EXISTS IX_UserLog_UserID_ActivityLogID ON UserLog (UserID, ActivityLogID);
+
+-- delete_log and joins coming from the ActivityLog side
+CREATE INDEX IF NOT EXISTS IX_UserLog_ActivityLogID ON UserLog (ActivityLogID);
+
+-- Date range filters on LogTime
+CREATE INDEX IF NOT EXISTS IX_ActivityLog_LogTime ON ActivityLog (LogTime, ActivityTypeID, Co2e);
+
+-- Name lookups used by the log endpoints
+CREATE INDEX IF NOT EXISTS IX_Appliance_ApplianceName ON Appliance (ApplianceName, AverageKWH);
+CREATE INDEX IF NOT EXISTS IX_Transport_TransportName ON Transport (TransportName, Co2e);
+CREATE INDEX IF NOT EXISTS IX_Food_Product ON Food (Product, Co2e);
@@ -0,0 +1,27 @@
+-- Record the owning user on ActivityLog itself so a log is written with one INSERT.
+-- UserLog becomes a view over ActivityLog for anything that still reads (or writes) it.
+
+ALTER TABLE ActivityLog ADD COLUMN UserID INTEGER REFERENCES UserDetails (UserID);
+
+UPDATE ActivityLog
+SET UserID = (SELECT ul.UserID FROM UserLog ul WHERE ul.ActivityLogID = ActivityLog.ActivityLogID);
+
+-- A user's logs newest first: userlog, /api/logs, /api/export, delete_log ownership
+CREATE INDEX IF NOT EXISTS IX_ActivityLog_UserID_LogTime ON ActivityLog (UserID, LogTime, ActivityLogID);
+
+DROP TABLE UserLog;
+
+CREATE VIEW UserLog AS
+SELECT ActivityLogID AS UserLogID, UserID, ActivityLogID
+FROM ActivityLog
+WHERE UserID IS NOT NULL;
+
+CREATE TRIGGER UserLog_insert INSTEAD OF INSERT ON UserLog
+BEGIN
+    UPDATE ActivityLog SET UserID = NEW.UserID WHERE ActivityLogID = NEW.ActivityLogID;
+END;
+
+CREATE TRIGGER UserLog_delete INSTEAD OF DELETE ON UserLog
+BEGIN
+    UPDATE ActivityLog SET UserID = NULL WHERE ActivityLogID = OLD.ActivityLogID;
+END;
@@ -0,0 +1,7 @@
+-- Idempotency key of entries written through the write-behind queue (ingest.py),
+-- so a batch retried after a lost commit acknowledgement can skip what already landed
+
+ALTER TABLE ActivityLog ADD COLUMN IngestKey TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS UX_ActivityLog_IngestKey
+    ON ActivityLog (IngestKey) WHERE IngestKey IS NOT NULL;
@@ -0,0 +1,46 @@
+-- Emission factors over time. A row applies from ValidFrom until the next row for the same
+-- activity type and item; ActivityItemID NULL applies to every item of the type (the grid
+-- intensity for appliances, in kg Co2e per kWh). Items without a row use Transport.Co2e / Food.Co2e.
+-- Change a factor with: flask --app carbon add-factor, then flask --app carbon recalc-co2e
+
+CREATE TABLE IF NOT EXISTS EmissionFactor (
+    FactorID INTEGER PRIMARY KEY,
+    ActivityTypeID INTEGER NOT NULL REFERENCES ActivityType (ActivityID),
+    ActivityItemID INTEGER,
+    ValidFrom TIMESTAMP NOT NULL,
+    Factor REAL NOT NULL,
+    UNIQUE (ActivityTypeID, ActivityItemID, ValidFrom)
+);
+
+-- The constant the app used until now
+INSERT INTO EmissionFactor (ActivityTypeID, ActivityItemID, ValidFrom, Factor)
+VALUES (1, NULL, '1900-01-01 00:00:00', 0.207074);
+
+-- The amount behind each log (kWh, miles or kg) so Co2e can be recomputed when a factor changes,
+-- backfilled from the factors in force so far
+ALTER TABLE ActivityLog ADD COLUMN Quantity REAL;
+
+UPDATE ActivityLog SET Quantity = Co2e / 0.207074 WHERE ActivityTypeID = 1;
+
+UPDATE ActivityLog
+SET Quantity = Co2e / (SELECT t.Co2e FROM Transport t WHERE t.TransportID = ActivityLog.ActivityItemID)
+WHERE ActivityTypeID = 2
+  AND (SELECT t.Co2e FROM Transport t WHERE t.TransportID = ActivityLog.ActivityItemID) <> 0;
+
+UPDATE ActivityLog
+SET Quantity = Co2e / (SELECT f.Co2e FROM Food f WHERE f.FoodID = ActivityLog.ActivityItemID)
+WHERE ActivityTypeID = 4
+  AND (SELECT f.Co2e FROM Food f WHERE f.FoodID = ActivityLog.ActivityItemID) <> 0;
+
+-- Progress of recalc-co2e runs, so an interrupted run can carry on where it stopped
+CREATE TABLE IF NOT EXISTS Co2eRecalcJob (
+    JobID INTEGER PRIMARY KEY,
+    ActivityTypeID INTEGER,
+    ActivityItemID INTEGER,
+    Since TIMESTAMP,
+    LastActivityLogID INTEGER NOT NULL DEFAULT 0,
+    RowsScanned INTEGER NOT NULL DEFAULT 0,
+    RowsChanged INTEGER NOT NULL DEFAULT 0,
+    StartedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FinishedAt TIMESTAMP
+);
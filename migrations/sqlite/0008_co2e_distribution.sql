@@ -0,0 +1,17 @@
+-- Everyone's Co2e per week and per month as log-scale histograms of per-user totals, one row per
+-- period and activity type (ActivityTypeID 0 is all types together); read by /api/compare
+-- Refresh with: flask --app carbon refresh-distributions
+
+CREATE TABLE IF NOT EXISTS Co2eDistribution (
+    Period TEXT NOT NULL,
+    PeriodStart DATE NOT NULL,
+    ActivityTypeID INTEGER NOT NULL,
+    Users INTEGER NOT NULL,
+    TotalCo2e REAL NOT NULL,
+    Histogram TEXT NOT NULL,
+    ComputedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (Period, PeriodStart, ActivityTypeID)
+);
+
+-- The refresh reads one period of the rollup for every user
+CREATE INDEX IF NOT EXISTS IX_DailyCo2eRollup_LogDate ON DailyCo2eRollup (LogDate, UserID, ActivityTypeID, TotalCo2e);
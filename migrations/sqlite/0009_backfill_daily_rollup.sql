@@ -0,0 +1,11 @@
+-- 0002 created DailyCo2eRollup empty, and the log endpoints only add to it from then on, so history
+-- logged before 0002 is missing from it while /api/activity-data and getLogTotal read only the rollup.
+-- Rebuild it from ActivityLog, the same as flask --app carbon rebuild-rollup
+
+DELETE FROM DailyCo2eRollup;
+
+INSERT INTO DailyCo2eRollup (UserID, LogDate, ActivityTypeID, TotalCo2e, LogCount)
+SELECT al.UserID, date(al.LogTime), al.ActivityTypeID, SUM(al.Co2e), COUNT(*)
+FROM ActivityLog al
+WHERE al.UserID IS NOT NULL
+GROUP BY al.UserID, date(al.LogTime), al.ActivityTypeID;
@@ -0,0 +1,2 @@
+-- Usernames must be unique. On SQLite the column has been UNIQUE since 0001, so there is nothing to do;
+-- this keeps the version numbers in step with the MSSQL migrations
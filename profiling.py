@@ -0,0 +1,212 @@
+from flask import g, request
+
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+# Share of requests to profile (0 to 1), 0 profiles only requests sending PROFILE_HEADER with PROFILE_TOKEN
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_HEADER = "X-Profile"
+
+# Where the collapsed stacks go, and how often a profiled request's stack is sampled (milliseconds)
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+# Where a sample's time goes: the innermost frame from one of these modules decides, anything else is python
+CATEGORIES = (
+    ("sql", ("sqlalchemy", "pyodbc", "sqlite3")),
+    ("bcrypt", ("hashing", "bcrypt")),
+    ("template", ("jinja2", "flask.templating")),
+)
+
+# Never profiled: monitoring and static files
+EXEMPT_ENDPOINTS = {"static", "carbon.get_metrics"}
+
+
+def _inModule(module, prefixes):
+    return any(module == prefix or module.startswith(prefix + ".") for prefix in prefixes)
+
+def _category(modules):
+    for module in reversed(modules):
+        for category, prefixes in CATEGORIES:
+            if _inModule(module, prefixes):
+                return category
+    return "python"
+
+# Frames from Flask's dispatch inwards as (module, function), outermost first
+def _stack(frame):
+    frames = []
+    while frame is not None:
+        # Compiled Jinja templates have no module name, their file name says which template it is
+        module = frame.f_globals.get("__name__") or os.path.basename(frame.f_code.co_filename)
+        frames.append((module, frame.f_code.co_name))
+        if module == "flask.app" and frame.f_code.co_name == "dispatch_request":
+            break
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+def _routeFile(method, rule):
+    return re.sub(r"[^A-Za-z0-9]+", "_", f"{method} {rule}").strip("_") + ".folded"
+
+
+class _Profile:
+    # Samples taken for one request
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.stacks = {}
+        self.categories = {}
+
+    def add(self, frames):
+        category = _category([module for module, _ in frames])
+        stack = ";".join([self.route, category] + [f"{module}:{function}" for module, function in frames])
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.categories[category] = self.categories.get(category, 0) + 1
+
+
+class RequestProfiler:
+    """Sampling profiler for live requests, opt-in per request.
+
+    A request is profiled when it wins the PROFILE_SAMPLE_RATE draw or sends
+    PROFILE_HEADER with PROFILE_TOKEN. While it runs, a background thread
+    reads its Python stack every PROFILE_INTERVAL_MS. Each sample is tagged
+    sql, bcrypt, template or python by the innermost frame that says where
+    the time went. When the request ends its samples are appended to
+    PROFILE_DIR/<route>.folded in collapsed-stack format, ready for
+    flamegraph.pl or speedscope; repeated stacks add up, so appends from
+    any number of requests and worker processes can be read together. A
+    one-line summary per request goes to PROFILE_DIR/requests.jsonl.
+    """
+
+    def __init__(self, sample_rate=PROFILE_SAMPLE_RATE, token=PROFILE_TOKEN, directory=PROFILE_DIR,
+                 interval_ms=PROFILE_INTERVAL_MS):
+        self.sample_rate = sample_rate
+        self.token = token
+        self.directory = directory
+        self.interval = interval_ms / 1000.0
+        self._active = {}  # thread id -> _Profile
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.profiled = 0
+        self.samples = 0
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or bool(self.token)
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    ## sampling ------------------------------------------------------------------
+    def _start(self):
+        # Threads don't survive a fork, so a forked worker process starts its own
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            # Sample under the lock, so a request can't finish and write its profile mid-sample
+            with self._lock:
+                if self._active:
+                    frames = sys._current_frames()
+                    for thread_id, profile in self._active.items():
+                        frame = frames.get(thread_id)
+                        if frame is not None:
+                            profile.add(_stack(frame))
+                    del frames
+                active = bool(self._active)
+            if active:
+                time.sleep(self.interval)
+            else:
+                self._wake.wait()
+                self._wake.clear()
+
+    ## hooks ---------------------------------------------------------------------
+    def _wanted(self):
+        if request.url_rule is None or request.endpoint in EXEMPT_ENDPOINTS:
+            return False
+        sent = request.headers.get(PROFILE_HEADER)
+        if sent and self.token and hmac.compare_digest(sent, self.token):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _before_request(self):
+        if not self._wanted():
+            return None
+        profile = _Profile(f"{request.method} {request.url_rule.rule}")
+        g.profile = profile
+        with self._lock:
+            self._active[threading.get_ident()] = profile
+        self._start()
+        self._wake.set()
+        return None
+
+    def _after_request(self, response):
+        if g.get("profile") is not None:
+            response.headers["X-Profiled"] = _routeFile(request.method, request.url_rule.rule)
+        return response
+
+    def _teardown_request(self, exception=None):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return
+        with self._lock:
+            self._active.pop(threading.get_ident(), None)
+            self.profiled += 1
+            self.samples += sum(profile.stacks.values())
+        self._write(profile, time.perf_counter() - profile.started)
+
+    def _write(self, profile, took):
+        method, rule = profile.route.split(" ", 1)
+        summary = {
+            "time": time.time(),
+            "route": profile.route,
+            "pid": os.getpid(),
+            "seconds": round(took, 4),
+            "samples": sum(profile.stacks.values()),
+            "interval_ms": self.interval * 1000,
+            # Estimated from the samples
+            "seconds_by_category": {category: round(count * self.interval, 4)
+                                    for category, count in sorted(profile.categories.items())},
+        }
+        lines = "".join(f"{stack} {count}\n" for stack, count in profile.stacks.items())
+        with self._file_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            if lines:
+                with open(os.path.join(self.directory, _routeFile(method, rule)), "a") as f:
+                    f.write(lines)
+            with open(os.path.join(self.directory, "requests.jsonl"), "a") as f:
+                f.write(json.dumps(summary) + "\n")
+
+    ## monitoring ----------------------------------------------------------------
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "sample_rate": self.sample_rate,
+                "interval_ms": self.interval * 1000,
+                "directory": os.path.abspath(self.directory),
+                "active": len(self._active),
+                "profiled": self.profiled,
+                "samples": self.samples
+            }
@@ -0,0 +1,148 @@
+from flask import has_request_context, request, session
+from sqlalchemy import event
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+import logging
+import os
+import threading
+import time
+
+# Read replica, e.g. an Azure SQL readable secondary or, locally, a copy of the SQLite file opened read-only:
+# sqlite:///file:replica.db?mode=ro&uri=true. Unset sends every query to the primary
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+
+# How long (seconds) a user's reads stay on the primary after they write, so replica lag can't hide the write
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", "10"))
+
+# How long (seconds) a replica that failed is left alone before reads try it again
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+
+# Session key holding the time until which the user reads from the primary
+STICKY_KEY = "db_primary_until"
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+log = logging.getLogger(__name__)
+
+
+class ReplicaRouter:
+    """Sends read-only work to a read replica, everything else to the primary.
+
+    connect(read_only=True) hands out a replica connection unless the
+    current user wrote within the last REPLICA_STICKY_SECONDS (a timestamp
+    in their session cookie, set after any successful write request, so it
+    holds across worker processes) or the replica recently failed. A
+    replica that can't be reached, or raises a connection-level error
+    mid-query, is skipped for REPLICA_RETRY_SECONDS and reads go to the
+    primary meanwhile. With no replica configured it is a pass-through to
+    the primary. It also stands in for an engine for readers that only call
+    connect(), like the catalog.
+    """
+
+    def __init__(self, sticky_seconds=REPLICA_STICKY_SECONDS, retry_seconds=REPLICA_RETRY_SECONDS):
+        self.sticky_seconds = sticky_seconds
+        self.retry_seconds = retry_seconds
+        self.primary = None
+        self.replica = None
+        self._down_until = 0.0
+        self._lock = threading.Lock()
+        self.reads = {"replica": 0, "sticky": 0, "fallback": 0}
+        self.failures = 0
+        self.last_error = None
+
+    def init_app(self, app):
+        app.after_request(self._after_request)
+
+    def configure(self, primary, replica=None):
+        self.primary = primary
+        self.replica = replica
+        self._down_until = 0.0
+        if replica is not None:
+            event.listen(replica, "handle_error", self._handle_error)
+
+    def after_fork(self):
+        # Same as the primary: drop the parent's replica connections without closing them
+        if self.replica is not None:
+            self.replica.dispose(close=False)
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.replica is not None
+
+    ## health --------------------------------------------------------------------
+    def available(self):
+        return self.replica is not None and time.monotonic() >= self._down_until
+
+    def mark_down(self, error):
+        with self._lock:
+            was_up = time.monotonic() >= self._down_until
+            self._down_until = time.monotonic() + self.retry_seconds
+            self.last_error = str(error)
+            if was_up:
+                self.failures += 1
+        if was_up:
+            log.warning("Read replica unavailable, reading from the primary for %ss: %s", self.retry_seconds, error)
+
+    def _handle_error(self, context):
+        # A replica that drops connections or errors at the database level mid-query is taken out of rotation;
+        # the query that hit it still fails, the next ones go to the primary. A stale pooled connection caught
+        # by pre-ping is replaced without the caller noticing, that's not an outage
+        if context.is_pre_ping:
+            return
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, (OperationalError, InterfaceError)):
+            self.mark_down(context.original_exception)
+
+    ## routing -------------------------------------------------------------------
+    def sticky(self):
+        # The current user wrote recently, their reads must see it
+        return has_request_context() and session.get(STICKY_KEY, 0) > time.time()
+
+    def _count(self, target):
+        with self._lock:
+            self.reads[target] += 1
+
+    def connect(self, read_only=True):
+        if read_only and self.replica is not None:
+            if self.sticky():
+                self._count("sticky")
+            elif not self.available():
+                self._count("fallback")
+            else:
+                try:
+                    connection = self.replica.connect()
+                    self._count("replica")
+                    return connection
+                except (OperationalError, InterfaceError) as e:
+                    self.mark_down(e)
+                except PoolTimeoutError:
+                    # Busy rather than down: this read goes to the primary, the next tries the replica again
+                    pass
+                self._count("fallback")
+        return self.primary.connect()
+
+    def _after_request(self, response):
+        if (self.replica is not None and request.method not in SAFE_METHODS and response.status_code < 400
+                and "user_id" in session):
+            session[STICKY_KEY] = time.time() + self.sticky_seconds
+        return response
+
+    ## monitoring ----------------------------------------------------------------
+    def stats(self):
+        with self._lock:
+            stats = {
+                "enabled": self.enabled,
+                "available": self.available(),
+                "down_for_seconds": max(self._down_until - time.monotonic(), 0.0) if self.enabled else 0.0,
+                "sticky_seconds": self.sticky_seconds,
+                "reads_replica": self.reads["replica"],
+                "reads_primary_sticky": self.reads["sticky"],
+                "reads_primary_fallback": self.reads["fallback"],
+                "failures": self.failures,
+                "last_error": self.last_error
+            }
+        # Only a QueuePool counts its connections (an in-memory SQLite replica has a SingletonThreadPool)
+        if self.replica is not None and isinstance(self.replica.pool, QueuePool):
+            stats["checked_out"] = self.replica.pool.checkedout()
+        return stats
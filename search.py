@@ -0,0 +1,98 @@
+import bisect
+import os
+import unicodedata
+
+# Results per query by default and at most
+SEARCH_DEFAULT_LIMIT = int(os.getenv("SEARCH_DEFAULT_LIMIT", "10"))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "50"))
+
+# Share of trigrams a fuzzy match must have in common with the query (Jaccard), for typos and infixes
+SEARCH_MIN_SIMILARITY = float(os.getenv("SEARCH_MIN_SIMILARITY", "0.3"))
+
+# Rank tiers, best first; ties go to the shorter name, then alphabetical
+EXACT, PREFIX, WORD_PREFIX, FUZZY = range(4)
+
+
+# Case-, accent- and punctuation-insensitive form of a name
+def normalise(value):
+    value = unicodedata.normalize("NFKD", str(value).casefold())
+    value = "".join(c if c.isalnum() else " " for c in value if not unicodedata.combining(c))
+    return " ".join(value.split())
+
+def trigrams(value):
+    padded = f"  {value} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ItemSearchIndex:
+    """Prefix and trigram index over the catalog's item names, for typeahead.
+
+    Built once per catalog load from (activity, category, name, details)
+    entries. A query is matched against the whole name, then against the
+    start of each word through a sorted word list and bisect, and only
+    falls back to trigram overlap when those find too little, so a lookup
+    touches a handful of postings rather than every item.
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self._names = [normalise(entry[2]) for entry in self.entries]
+        self._words = sorted((word, i) for i, name in enumerate(self._names) for word in set(name.split()))
+        self._trigrams = {}
+        self._trigram_counts = []
+        for i, name in enumerate(self._names):
+            grams = trigrams(name)
+            self._trigram_counts.append(len(grams))
+            for gram in grams:
+                self._trigrams.setdefault(gram, []).append(i)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _word_prefix(self, prefix):
+        # Items with a word starting with prefix
+        start = bisect.bisect_left(self._words, (prefix,))
+        found = set()
+        for word, i in self._words[start:]:
+            if not word.startswith(prefix):
+                break
+            found.add(i)
+        return found
+
+    def _fuzzy(self, query):
+        grams = trigrams(query)
+        shared = {}
+        for gram in grams:
+            for i in self._trigrams.get(gram, ()):
+                shared[i] = shared.get(i, 0) + 1
+        return {i: count / (len(grams) + self._trigram_counts[i] - count) for i, count in shared.items()}
+
+    def search(self, query, limit=SEARCH_DEFAULT_LIMIT, activity=None):
+        # Ranked [(entry, tier, score)], best first
+        query = normalise(query)
+        if not query:
+            return []
+        words = query.split()
+
+        # Every query word has to start some word of the name ("gas boil" finds "Gas Boiler")
+        candidates = self._word_prefix(words[0])
+        for word in words[1:]:
+            candidates &= self._word_prefix(word)
+        if activity is not None:
+            candidates = {i for i in candidates if self.entries[i][0] == activity}
+
+        ranked = {}
+        for i in candidates:
+            name = self._names[i]
+            tier = EXACT if name == query else PREFIX if name.startswith(query) else WORD_PREFIX
+            ranked[i] = (tier, 1.0)
+
+        if len(ranked) < limit and len(query) >= 3:
+            for i, similarity in self._fuzzy(query).items():
+                if (i not in ranked and similarity >= SEARCH_MIN_SIMILARITY
+                        and (activity is None or self.entries[i][0] == activity)):
+                    ranked[i] = (FUZZY, similarity)
+
+        results = [(i, tier, score) for i, (tier, score) in ranked.items()]
+        results.sort(key=lambda r: (r[1], -r[2], len(self._names[r[0]]), self._names[r[0]]))
+        return [(self.entries[i], tier, score) for i, tier, score in results[:limit]]
@@ -0,0 +1,57 @@
+document.addEventListener("DOMContentLoaded", function () {
+  const selectAll = document.getElementById("selectAllLogs");
+  const deleteBtn = document.getElementById("deleteSelectedBtn");
+  const boxes = Array.from(document.querySelectorAll(".log-select"));
+
+  function selectedIds() {
+    return boxes.filter((box) => box.checked).map((box) => parseInt(box.value, 10));
+  }
+
+  function updateButton() {
+    const count = selectedIds().length;
+    deleteBtn.disabled = count === 0;
+    deleteBtn.textContent = count ? `Delete selected (${count})` : "Delete selected";
+  }
+
+  // The message comes from the server, so it goes in as text, never as markup
+  function displayMessage(message, type) {
+    const alert = document.createElement("div");
+    alert.className = `alert alert-${type}`;
+    alert.setAttribute("role", "alert");
+    alert.textContent = message;
+    document.getElementById("deleteMessage").replaceChildren(alert);
+  }
+
+  selectAll.addEventListener("change", function () {
+    boxes.forEach((box) => (box.checked = selectAll.checked));
+    updateButton();
+  });
+  boxes.forEach((box) => box.addEventListener("change", updateButton));
+
+  deleteBtn.addEventListener("click", function () {
+    const ids = selectedIds();
+    if (!ids.length || !confirm(`Delete ${ids.length} log${ids.length === 1 ? "" : "s"}?`)) {
+      return;
+    }
+    deleteBtn.disabled = true;
+
+    fetch("/api/logs/delete", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ ids: ids }),
+    })
+      .then((response) => response.json())
+      .then((data) => {
+        if (!data.success) {
+          displayMessage(data.message || "Could not delete the logs.", "danger");
+          updateButton();
+          return;
+        }
+        window.location.reload();
+      })
+      .catch(() => {
+        displayMessage("Could not delete the logs.", "danger");
+        updateButton();
+      });
+  });
+});
@@ -1,18 +1,25 @@
 document.addEventListener("DOMContentLoaded", function () {
   const fetchBtn = document.getElementById("fetchDataBtn");
+  const chartTitles = { day: "Daily", week: "Weekly", month: "Monthly" };
 
   fetchBtn.addEventListener("click", function () {
     const startDate = document.getElementById("startDate").value;
     const endDate = document.getElementById("endDate").value;
+    const granularity = document.getElementById("granularity").value;
 
     if (!startDate || !endDate) {
       displayChartMessage("Please select both start and end dates.", "warning");
       return;
     }
 
-    fetch(`/api/activity-data?start=${startDate}&end=${endDate}`)
+    fetch(`/api/activity-data?start=${startDate}&end=${endDate}&granularity=${granularity}`)
       .then((response) => response.json())
       .then((data) => {
+        if (!data.dates) {
+          displayChartMessage(data.message || "Could not retrieve data.", "warning");
+          return;
+        }
+
         if (data.dates.length === 0) {
           displayChartMessage("No data found for the selected range.", "info");
           if (window.carbonChart && typeof window.carbonChart.destroy === "function") {
@@ -53,7 +60,7 @@ document.addEventListener("DOMContentLoaded", function () {
             plugins: {
               title: {
                 display: true,
-                text: "Daily Carbon Footprint Breakdown",
+                text: `${chartTitles[data.granularity] || "Daily"} Carbon Footprint Breakdown`,
               },
               tooltip: {
                 mode: "index",
@@ -69,7 +76,7 @@ document.addEventListener("DOMContentLoaded", function () {
                 stacked: true,
                 title: {
                   display: true,
-                  text: "Date",
+                  text: data.granularity === "day" ? "Date" : `${data.granularity[0].toUpperCase()}${data.granularity.slice(1)} starting`,
                 },
               },
               y: {
@@ -0,0 +1,82 @@
+import os
+
+# Settings carbon reads at import; the tests build their own apps on SQLite files under tmp_path
+os.environ.setdefault("FLASK_SECRET_KEY", "test")
+os.environ.setdefault("EMAIL_PEPPER", "test")
+os.environ.setdefault("BCRYPT_LOG_ROUNDS", "4")
+os.environ["DATABASE_URL"] = "sqlite://"
+os.environ["APP_WARM_UP"] = "false"
+os.environ["INGEST_QUEUE_PATH"] = ""
+os.environ["DATABASE_REPLICA_URL"] = ""
+
+from sqlalchemy import create_engine, text
+
+import carbon
+import migrate
+import pytest
+
+USERS = {1: "alice", 2: "bob"}
+
+ROLLUP = "SELECT UserID, LogDate, ActivityTypeID, ROUND(TotalCo2e, 6), LogCount FROM DailyCo2eRollup"
+EXPECTED = """
+    SELECT UserID, date(LogTime), ActivityTypeID, ROUND(SUM(Co2e), 6), COUNT(*)
+    FROM ActivityLog
+    WHERE UserID IS NOT NULL
+    GROUP BY UserID, date(LogTime), ActivityTypeID
+"""
+
+
+# Rows in the rollup that a GROUP BY of ActivityLog doesn't give, and the other way round, must both be none;
+# returns how many rows the rollup has
+def assertRollupMatches(engine):
+    with engine.connect() as connection:
+        extra = connection.execute(text(f"{ROLLUP} EXCEPT {EXPECTED}")).fetchall()
+        missing = connection.execute(text(f"{EXPECTED} EXCEPT {ROLLUP}")).fetchall()
+        rows = connection.execute(text("SELECT COUNT(*) FROM DailyCo2eRollup")).scalar()
+    assert (extra, missing) == ([], [])
+    return rows
+
+# A migrated SQLite database at path with the USERS in it, returns its URL
+def migratedDatabase(path):
+    url = f"sqlite:///{path}"
+    engine = create_engine(url)
+    try:
+        migrate.migrate(engine)
+        with engine.begin() as connection:
+            connection.execute(
+                text("INSERT INTO UserDetails (UserID, username, email, password) VALUES (:id, :name, :email, 'x')"),
+                [{"id": user_id, "name": name, "email": f"{name}@example.com"} for user_id, name in USERS.items()]
+            )
+    finally:
+        engine.dispose()
+    return url
+
+# A new app on its own database; config goes to create_app()
+def makeApp(database_url, **config):
+    return carbon.create_app(dict(config, DATABASE_URL=database_url, SECRET_KEY="test", WARM_UP=False, TESTING=True))
+
+def loggedIn(flask_app, user_id=1):
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
+        session["username"] = USERS[user_id]
+    return client
+
+# A log-appliance body; usageTime * wattage kWh at logTime
+def applianceBody(log_time="2025-01-31 13:45:00", usage_time=1, wattage=2.2, name="Kettle"):
+    return {"applianceName": name, "usageTime": usage_time, "wattage": wattage, "logTime": log_time}
+
+
+@pytest.fixture
+def app(tmp_path):
+    flask_app = makeApp(migratedDatabase(tmp_path / "carbon.db"))
+    yield flask_app
+    flask_app.extensions["carbon"].engine.dispose()
+
+@pytest.fixture
+def engine(app):
+    return app.extensions["carbon"].engine
+
+@pytest.fixture
+def client(app):
+    return loggedIn(app)
@@ -0,0 +1,101 @@
+from flask import Flask
+
+import threading
+import time
+import pytest
+
+from admission import AdmissionControl, RouteGate, Shed
+
+
+# Start count threads that each wait for a slot on gate; returns them and the list they append to once admitted
+def waiters(gate, count):
+    admitted = []
+    def wait():
+        try:
+            gate.acquire()
+            admitted.append(time.monotonic())
+        except Shed:
+            pass
+    threads = [threading.Thread(target=wait) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 2
+    while gate.waiting < count and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert gate.waiting == count
+    return threads, admitted
+
+
+def test_a_full_queue_is_shed_with_429():
+    gate = RouteGate(1, queue_factor=0)
+    gate.acquire()
+    with pytest.raises(Shed) as shed:
+        gate.acquire()
+    assert (shed.value.status, shed.value.reason) == (429, "queue_full")
+    assert shed.value.retry_after >= 1
+    assert gate.stats()["shed_queue_full"] == 1
+
+def test_waiting_too_long_is_shed_with_503():
+    gate = RouteGate(1, queue_timeout=0.05)
+    gate.acquire()
+    with pytest.raises(Shed) as shed:
+        gate.acquire()
+    assert (shed.value.status, shed.value.reason) == (503, "timeout")
+    assert gate.stats()["waiting"] == 0
+
+def test_a_release_admits_a_waiter():
+    gate = RouteGate(1, queue_timeout=5)
+    gate.acquire()
+    threads, admitted = waiters(gate, 1)
+    gate.release(0.01)
+    threads[0].join(1)
+    assert len(admitted) == 1
+    assert gate.stats()["in_flight"] == 1
+
+def test_raising_the_limit_wakes_every_waiter_it_has_room_for():
+    gate = RouteGate(3, budget=1.0, queue_timeout=5)
+    gate.limit = 1.0
+    gate.acquire()
+    threads, admitted = waiters(gate, 2)
+
+    # Under budget: the limit goes up to 2 and both slots are free at once
+    start = time.monotonic()
+    gate.release(0.01)
+    for thread in threads:
+        thread.join(5)
+    assert len(admitted) == 2
+    assert max(admitted) - start < 1
+
+def test_latency_over_budget_lowers_the_limit_and_recovery_raises_it():
+    gate = RouteGate(4, budget=0.1)
+    for _ in range(5):
+        gate.acquire()
+        gate.release(1.0)
+    assert gate.stats()["limit"] < 4
+
+    for _ in range(50):
+        gate.acquire()
+        gate.release(0.0)
+    assert gate.stats()["limit"] == 4
+
+def test_shed_requests_get_retry_after():
+    app = Flask(__name__)
+    control = AdmissionControl(limits={"/busy": 1}, budgets={})
+    control.init_app(app)
+    app.add_url_rule("/busy", "busy", lambda: "ok")
+    app.add_url_rule("/open", "open", lambda: "ok")
+
+    client = app.test_client()
+    assert client.get("/busy").status_code == 200
+
+    gate = control.gate("/busy")
+    gate.acquire()
+    try:
+        response = client.get("/busy")
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) >= 1
+        assert client.get("/open").status_code == 200
+    finally:
+        gate.release(0.01)
+    assert client.get("/busy").status_code == 200
+    assert control.shed_total._values == {("/busy", "timeout"): 1}
@@ -0,0 +1,61 @@
+import time
+
+import carbon
+import pytest
+
+from replica import STICKY_KEY
+
+# Needs requirements-async.txt
+asyncapp = pytest.importorskip("asyncapp")
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+SESSION = {"user_id": 1, "username": "alice"}
+
+
+def test_an_async_write_keeps_the_users_flask_reads_on_the_primary(monkeypatch):
+    router = carbon.app.extensions["carbon"].replica_router
+    monkeypatch.setattr(router, "replica", object())
+
+    response = asyncapp.stickToPrimary(JSONResponse({"success": True}), SESSION)
+    name = carbon.app.config["SESSION_COOKIE_NAME"]
+    cookie = response.headers["set-cookie"]
+    assert cookie.startswith(f"{name}=")
+
+    value = cookie.split(";", 1)[0][len(name) + 1:]
+    data = carbon.app.session_interface.get_signing_serializer(carbon.app).loads(value)
+    assert data["user_id"] == 1
+    assert time.time() < data[STICKY_KEY] <= time.time() + router.sticky_seconds
+
+    # The Flask app's router reads the same flag from the same cookie
+    with carbon.app.test_request_context(headers={"Cookie": f"{name}={value}"}):
+        assert router.sticky()
+
+def test_no_replica_no_cookie():
+    response = asyncapp.stickToPrimary(JSONResponse({"success": True}), SESSION)
+    assert "set-cookie" not in response.headers
+
+def test_async_routes_share_the_flask_admission_gate_and_metrics():
+    async def export(request):
+        return JSONResponse({"success": True})
+    client = TestClient(Starlette(routes=[Route("/api/export", asyncapp.served("/api/export", export))]))
+
+    gate = carbon.admission.gate("/api/export")
+    assert client.get("/api/export").status_code == 200
+    for _ in range(gate.max_limit):
+        gate.acquire()
+    try:
+        response = client.get("/api/export")
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) >= 1
+    finally:
+        for _ in range(gate.max_limit):
+            gate.release(0.0)
+    assert gate.stats()["in_flight"] == 0
+
+    rendered = carbon.metrics.render()
+    assert 'http_requests_total{route="/api/export",method="GET",status="200"}' in rendered
+    assert 'http_requests_shed_total{route="/api/export",reason="timeout"}' in rendered
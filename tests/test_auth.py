@@ -0,0 +1,107 @@
+from sqlalchemy import text
+
+import carbon
+import pytest
+
+from conftest import makeApp
+
+PASSWORD = "correct horse"
+
+
+def register(client, username="carol", email="Carol@Example.com", password=PASSWORD):
+    return client.post("/api/register", json={
+        "username": username, "email": email, "password": password, "confirm_password": password})
+
+def userRow(engine, username):
+    with engine.connect() as connection:
+        return connection.execute(
+            text("SELECT UserID, email, EmailDigest, password FROM UserDetails WHERE username = :username"),
+            {"username": username}
+        ).fetchone()
+
+
+def test_register_stores_the_email_digest_only(app, engine):
+    client = app.test_client()
+    assert register(client).status_code == 201
+
+    _, email, digest, password = userRow(engine, "carol")
+    assert email == digest == carbon.emailDigest(" carol@example.COM ")
+    assert password.startswith("$2b$")
+
+@pytest.mark.parametrize("username, email", [("carol", "other@example.com"), ("dave", "CAROL@example.com")])
+def test_register_refuses_a_taken_username_or_email(app, username, email):
+    client = app.test_client()
+    assert register(client).status_code == 201
+    response = register(client, username, email)
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "Username or email already exists"
+
+def test_register_losing_a_race_for_the_username(app, engine, monkeypatch):
+    hash_password = carbon.hasher.hash
+    # Someone else signs up as carol after the existence check, while our password is being hashed
+    def racingHash(value):
+        with engine.begin() as connection:
+            connection.execute(text(
+                "INSERT INTO UserDetails (username, email, EmailDigest, password) VALUES ('carol', 'x', 'x', 'x')"))
+        return hash_password(value)
+    monkeypatch.setattr(carbon.hasher, "hash", racingHash)
+
+    response = register(app.test_client())
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "Username or email already exists"
+
+def test_login(app):
+    client = app.test_client()
+    register(client)
+    assert client.post("/api/login", json={"username": "carol", "password": "wrong"}).status_code == 401
+    assert client.post("/api/login", json={"username": "nobody", "password": PASSWORD}).status_code == 401
+
+    assert client.post("/api/login", json={"username": "carol", "password": PASSWORD}).status_code == 200
+    with client.session_transaction() as session:
+        assert session["username"] == "carol"
+
+def test_login_rehashes_at_the_new_work_factor(app, engine, monkeypatch):
+    client = app.test_client()
+    register(client)
+    old_hash = userRow(engine, "carol").password
+
+    monkeypatch.setattr(carbon.hasher, "rounds", carbon.hasher.rounds + 1)
+    assert client.post("/api/login", json={"username": "carol", "password": PASSWORD}).status_code == 200
+    new_hash = userRow(engine, "carol").password
+    assert new_hash != old_hash
+    assert not carbon.hasher.needs_rehash(new_hash)
+
+    assert client.post("/api/login", json={"username": "carol", "password": PASSWORD}).status_code == 200
+    assert userRow(engine, "carol").password == new_hash
+
+def test_forgot_password_matches_the_digest(app):
+    client = app.test_client()
+    register(client)
+
+    assert client.post("/api/forgot-password", json={"username": "carol", "email": "carol@example.com "}).status_code == 200
+    assert client.post("/api/forgot-password", json={"username": "carol", "email": "mallory@example.com"}).status_code == 403
+    assert client.post("/api/forgot-password", json={"username": "nobody", "email": "carol@example.com"}).status_code == 404
+
+def test_forgot_password_backfills_the_digest_of_an_older_account(app, engine):
+    # Accounts from before EmailDigest kept a bcrypt hash of the email and no digest
+    with engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO UserDetails (username, email, password) VALUES ('erin', :email, 'x')"),
+            {"email": carbon.hasher.hash("erin@example.com")}
+        )
+    client = app.test_client()
+
+    assert client.post("/api/forgot-password", json={"username": "erin", "email": "eve@example.com"}).status_code == 403
+    assert userRow(engine, "erin").EmailDigest is None
+
+    assert client.post("/api/forgot-password", json={"username": "erin", "email": "erin@example.com"}).status_code == 200
+    assert userRow(engine, "erin").EmailDigest == carbon.emailDigest("erin@example.com")
+    # From now on the digest is what's checked
+    assert client.post("/api/forgot-password", json={"username": "erin", "email": "ERIN@example.com"}).status_code == 200
+
+def test_create_app_refuses_to_start_without_the_email_pepper(tmp_path, monkeypatch):
+    monkeypatch.delenv("EMAIL_PEPPER")
+    with pytest.raises(RuntimeError, match="EMAIL_PEPPER"):
+        makeApp(f"sqlite:///{tmp_path / 'carbon.db'}")
+    with pytest.raises(RuntimeError, match="EMAIL_PEPPER"):
+        carbon.create_app()
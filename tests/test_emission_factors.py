@@ -0,0 +1,105 @@
+from datetime import datetime
+from sqlalchemy import text
+
+import carbon
+import pytest
+
+from conftest import applianceBody, assertRollupMatches, loggedIn
+
+BEEF, LAMB = 99.5, 39.7  # kg Co2e per kg, Food.Co2e in 0001
+
+
+def foodBody(name, day, quantity=0.5):
+    return {"foodName": name, "quantity": quantity, "logTime": f"2025-01-{day:02d} 19:30:00"}
+
+# (item, LogTime, Quantity, Co2e) of every log, oldest first
+def storedLogs(engine, type_id):
+    with engine.connect() as connection:
+        return connection.execute(
+            text("""
+                SELECT ActivityItemID, LogTime, Quantity, Co2e FROM ActivityLog
+                WHERE ActivityTypeID = :type_id ORDER BY LogTime, ActivityLogID
+            """),
+            {"type_id": type_id}
+        ).fetchall()
+
+def run(app, *args):
+    result = app.test_cli_runner().invoke(args=list(args))
+    assert result.exit_code == 0, result.output
+    return result.output
+
+@pytest.fixture
+def logged(app, client):
+    for day in range(1, 7):
+        assert client.post("/api/log-appliance", json=applianceBody(f"2025-01-{day:02d} 09:00:00")).status_code == 200
+        for name in ("Beef", "Lamb"):
+            assert client.post("/api/log-food", json=foodBody(name, day)).status_code == 200
+    assert loggedIn(app, 2).post("/api/log-appliance", json=applianceBody("2025-01-04 09:00:00")).status_code == 200
+    return client
+
+
+def test_a_new_factor_prices_new_logs_from_its_date_on(app, engine, client):
+    run(app, "add-factor", "--type", "appliance", "--from", "2025-01-03", "--factor", "0.5")
+    for day in (2, 3):
+        assert client.post("/api/log-appliance", json=applianceBody(f"2025-01-{day:02d} 09:00:00")).status_code == 200
+
+    (_, _, before_quantity, before), (_, _, after_quantity, after) = storedLogs(engine, 1)
+    assert before == pytest.approx(before_quantity * carbon.CO2_PER_KWH)
+    assert after == pytest.approx(after_quantity * 0.5)
+    assertRollupMatches(engine)
+
+def test_recalc_follows_the_factor_timeline(app, engine, logged):
+    food_before = storedLogs(engine, 4)
+    run(app, "add-factor", "--type", "appliance", "--from", "2025-01-03", "--factor", "0.5")
+    run(app, "add-factor", "--type", "appliance", "--from", "2025-01-05", "--factor", "0.8")
+    output = run(app, "recalc-co2e", "--type", "appliance", "--since", "2025-01-03", "--chunk", "2")
+    assert "5 changed" in output
+
+    for _, log_time, quantity, co2e in storedLogs(engine, 1):
+        if log_time < datetime(2025, 1, 3):
+            factor = carbon.CO2_PER_KWH
+        elif log_time < datetime(2025, 1, 5):
+            factor = 0.5
+        else:
+            factor = 0.8
+        assert co2e == pytest.approx(quantity * factor)
+    assert storedLogs(engine, 4) == food_before
+    assertRollupMatches(engine)
+
+    # Totals read from the rollup follow the new Co2e
+    data = logged.get("/api/activity-data", query_string={"start": "2025-01-05", "end": "2025-01-06",
+                                                           "granularity": "day"}).get_json()
+    assert sum(data["Appliance"]) == pytest.approx(2 * 2.2 * 0.8)
+
+def test_an_item_factor_only_changes_that_item(app, engine, logged):
+    run(app, "add-factor", "--type", "food", "--item", "Beef", "--from", "2025-01-04", "--factor", "50")
+    run(app, "recalc-co2e", "--type", "food", "--item", "Beef")
+
+    for item_id, log_time, quantity, co2e in storedLogs(engine, 4):
+        if item_id == 1:
+            assert co2e == pytest.approx(quantity * (50 if log_time >= datetime(2025, 1, 4) else BEEF))
+        else:
+            assert co2e == pytest.approx(quantity * LAMB)
+    assertRollupMatches(engine)
+
+def test_an_interrupted_recalc_resumes_where_it_stopped(app, engine, logged, monkeypatch):
+    run(app, "add-factor", "--type", "appliance", "--from", "2025-01-01", "--factor", "0.5")
+
+    recalc_chunk, chunks = carbon.recalcChunk, []
+    def failingChunk(*args, **kwargs):
+        if len(chunks) == 2:
+            raise RuntimeError("worker killed")
+        chunks.append(args)
+        return recalc_chunk(*args, **kwargs)
+    monkeypatch.setattr(carbon, "recalcChunk", failingChunk)
+    result = app.test_cli_runner().invoke(args=["recalc-co2e", "--type", "appliance", "--chunk", "2"])
+    assert isinstance(result.exception, RuntimeError)
+    # Every chunk commits its rollup corrections with its Co2e updates
+    assertRollupMatches(engine)
+    assert sum(abs(co2e - quantity * 0.5) < 1e-9 for _, _, quantity, co2e in storedLogs(engine, 1)) == 4
+
+    monkeypatch.setattr(carbon, "recalcChunk", recalc_chunk)
+    assert "3 changed" in run(app, "recalc-co2e", "--resume", "1")
+    for _, _, quantity, co2e in storedLogs(engine, 1):
+        assert co2e == pytest.approx(quantity * 0.5)
+    assertRollupMatches(engine)
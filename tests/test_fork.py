@@ -0,0 +1,42 @@
+import carbon
+import pytest
+
+from conftest import applianceBody, loggedIn
+from ingest import WriteBehindQueue
+
+
+@pytest.fixture
+def warmed(monkeypatch):
+    calls = []
+    monkeypatch.setattr(carbon, "warmPool", lambda n, pool_engine=None: calls.append(pool_engine))
+    monkeypatch.setattr(carbon, "startup_stats", dict(carbon.startup_stats, phases={}))
+    return calls
+
+
+def test_a_forked_child_connects_nothing(app, engine, tmp_path, warmed, monkeypatch):
+    assert loggedIn(app).post("/api/log-appliance", json=applianceBody()).status_code == 200
+    queue = WriteBehindQueue(str(tmp_path / "queue.db"), lambda batch: None)
+    monkeypatch.setattr(carbon, "ingest_queue", queue)
+    monkeypatch.setattr(WriteBehindQueue, "start", lambda self: None)
+    app.extensions["carbon"].warm = True
+    assert engine.pool.checkedin() == 1
+
+    # What os.register_at_fork runs in every child, whether it goes on to serve requests or not
+    carbon.afterForkInChild()
+    assert engine.pool.checkedin() == 0
+    assert queue._connection is None
+    assert warmed == []
+    assert carbon.startup_stats["forked"]
+
+    # The queue opens its connection on first use
+    queue.enqueue(1, {"n": 1})
+    assert queue.stats()["depth"] == 1
+
+def test_a_server_worker_warms_the_apps_warmed_up_before_the_fork(app, engine, warmed):
+    carbon.warmForkedWorker()
+    assert engine not in warmed
+
+    app.extensions["carbon"].warm = True
+    carbon.warmForkedWorker()
+    assert engine in warmed
+    assert "fork_pool" in carbon.startup_stats["phases"]
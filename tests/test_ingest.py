@@ -0,0 +1,150 @@
+from datetime import datetime
+from sqlalchemy import event, text
+
+import carbon
+import pytest
+
+from conftest import applianceBody
+from ingest import WriteBehindQueue
+
+
+class Unavailable(Exception):
+    pass
+
+# Stands in for writeQueuedLogs: keeps what it's given, rejects batches holding a poisoned entry and
+# raises Unavailable while down
+class FakeWriter:
+    def __init__(self, poison=()):
+        self.poison = set(poison)
+        self.down = False
+        self.written = []
+        self.calls = 0
+
+    def __call__(self, batch):
+        self.calls += 1
+        if self.down:
+            raise Unavailable("database is down")
+        if any(entry["n"] in self.poison for _, _, entry in batch):
+            raise ValueError("rejected")
+        self.written += [entry["n"] for _, _, entry in batch]
+
+def entry(n):
+    return {"n": n, "log_time": datetime(2025, 1, 1, 12, 0, n)}
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    # No worker thread, the tests drain by hand
+    monkeypatch.setattr(WriteBehindQueue, "start", lambda self: None)
+    def make(writer, **kwargs):
+        return WriteBehindQueue(str(tmp_path / "queue.db"), writer, transient=(Unavailable,), **kwargs)
+    return make
+
+
+def test_a_poisoned_entry_does_not_hold_up_its_batch(queue):
+    writer = FakeWriter(poison={2})
+    q = queue(writer, batch_size=10)
+    for n in range(5):
+        q.enqueue(1, entry(n))
+
+    assert q.drain_once() == (4, 5)
+    assert writer.written == [0, 1, 3, 4]
+    stats = q.stats()
+    assert (stats["depth"], stats["written"], stats["failures"]) == (1, 4, 1)
+
+def test_a_poisoned_entry_on_its_own_is_parked_after_max_attempts(queue):
+    writer = FakeWriter(poison={0})
+    q = queue(writer, max_attempts=3)
+    q.enqueue(1, entry(0))
+
+    for _ in range(3):
+        assert q.drain_once() == (0, 1)
+    assert q.drain_once() == (0, None)
+    assert q.stats()["dead_letters"] == 1
+
+    writer.poison.clear()
+    assert q.retry_dead() == 1
+    assert q.drain() == 1
+    assert writer.written == [0]
+
+def test_transient_errors_raise_without_counting_an_attempt(queue):
+    writer = FakeWriter()
+    q = queue(writer, max_attempts=1)
+    q.enqueue(1, entry(0))
+    q.enqueue(1, entry(1))
+
+    writer.down = True
+    for _ in range(3):
+        with pytest.raises(Unavailable):
+            q.drain_once()
+    assert q.stats()["dead_letters"] == 0
+
+    writer.down = False
+    assert q.drain() == 2
+    assert q.stats()["depth"] == 0
+
+def test_drain_is_one_pass_when_every_entry_is_rejected(queue):
+    writer = FakeWriter(poison={0, 1, 2})
+    q = queue(writer, batch_size=2)
+    for n in range(3):
+        q.enqueue(1, entry(n))
+
+    assert q.drain() == 0
+    # Two batches, the first one retried entry by entry
+    assert writer.calls == 4
+    assert q.stats()["depth"] == 3
+
+def test_enqueueing_a_key_twice_keeps_the_first_entry(queue):
+    writer = FakeWriter()
+    q = queue(writer)
+    assert q.enqueue(1, entry(0), key="1:abc") == "1:abc"
+    q.enqueue(1, entry(1), key="1:abc")
+
+    assert q.drain() == 1
+    assert writer.written == [0]
+
+def test_a_replayed_batch_is_not_written_twice(app, engine, queue):
+    q = queue(carbon.writeQueuedLogs)
+    with app.app_context():
+        prepared = carbon.prepareLogEntry("appliance", applianceBody())
+        carbon.writeQueuedLogs([("1:abc", 1, prepared)])
+        # The commit went through but its acknowledgement was lost, so the entry is still queued
+        q.enqueue(1, prepared, key="1:abc")
+        q.enqueue(1, prepared, key="1:def")
+        assert q.drain() == 2
+
+    with engine.connect() as connection:
+        keys = connection.execute(text("SELECT IngestKey FROM ActivityLog ORDER BY IngestKey")).scalars().all()
+    assert keys == ["1:abc", "1:def"]
+
+def test_queued_logs_belong_to_the_logged_in_user(client, queue, monkeypatch):
+    q = queue(FakeWriter())
+    monkeypatch.setattr(carbon, "ingest_queue", q)
+
+    response = client.post("/api/log-appliance", json=dict(applianceBody(), userID=2),
+                           headers={"Idempotency-Key": "abc"})
+    assert response.status_code == 403
+
+    response = client.post("/api/log-appliance", json=applianceBody(), headers={"Idempotency-Key": "abc"})
+    assert response.status_code == 202
+    assert response.get_json()["idempotencyKey"] == "1:abc"
+    assert [(key, user_id) for _, key, user_id, _, _ in q._pending(10)] == [("1:abc", 1)]
+
+def test_batch_inserts_stay_under_the_mssql_parameter_limit(app, engine):
+    counts = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        counts.append(len(parameters))
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        with app.app_context():
+            entry = carbon.prepareLogEntry("appliance", applianceBody())
+            db_session = carbon.SessionFactory()
+            try:
+                log_ids = carbon.insertActivityLogs(db_session, 1, [dict(entry, ingest_key=f"1:{i}") for i in range(700)])
+                db_session.commit()
+            finally:
+                db_session.close()
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    assert len(set(log_ids)) == 700
+    assert max(counts) == 6 * carbon.INSERT_CHUNK_ROWS + 1 <= 2100
@@ -0,0 +1,26 @@
+import pytest
+
+
+def test_a_current_etag_gets_304(client):
+    response = client.get("/api/items/appliance/Kitchen")
+    assert response.status_code == 200
+    assert any(item for item in response.get_json())
+    etag = response.headers["ETag"]
+
+    cached = client.get("/api/items/appliance/Kitchen", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.data == b""
+    # The lists share the catalog's validators
+    assert client.get("/api/items/transport/public", headers={"If-None-Match": etag}).status_code == 304
+
+@pytest.mark.parametrize("path, error", [
+    ("/api/items/transport/teleport", "Invalid transport category"),
+    ("/api/items/spaceflight/rockets", "Invalid activity type"),
+])
+def test_an_unknown_list_is_an_error_whatever_the_etag(client, path, error):
+    etag = client.get("/api/items/appliance/Kitchen").headers["ETag"]
+
+    for headers in ({}, {"If-None-Match": etag}):
+        response = client.get(path, headers=headers)
+        assert response.status_code == 400
+        assert response.get_json()["error"] == error
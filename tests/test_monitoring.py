@@ -0,0 +1,66 @@
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import NullPool, StaticPool
+
+import pytest
+
+from conftest import makeApp
+from metrics import Metrics
+
+ADMIN = {"X-Admin-Token": "secret"}
+
+
+@pytest.fixture(autouse=True)
+def admin_token(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+
+@pytest.fixture
+def memory_app():
+    flask_app = makeApp("sqlite://")
+    yield flask_app
+    flask_app.extensions["carbon"].engine.dispose()
+
+
+def test_pool_stats_on_a_file_database(app):
+    stats = app.test_client().get("/api/pool-stats", headers=ADMIN).get_json()
+    assert {"pool_size", "checked_out", "checked_in", "overflow", "checkouts"} <= stats.keys()
+    # SQLite keeps its own pool settings, POOL_MAX_OVERFLOW isn't applied to it
+    assert "max_overflow" not in stats
+
+@pytest.mark.parametrize("poolclass", [None, NullPool, StaticPool])
+def test_pool_stats_without_a_queue_pool(memory_app, poolclass):
+    state = memory_app.extensions["carbon"]
+    if poolclass is not None:
+        state.engine.dispose()
+        state.engine = create_engine("sqlite://", poolclass=poolclass)
+    response = memory_app.test_client().get("/api/pool-stats", headers=ADMIN)
+    assert response.status_code == 200
+    assert "pool_size" not in response.get_json()
+    assert "wait_seconds_max" in response.get_json()
+
+def test_metrics_needs_the_admin_token(app, monkeypatch):
+    client = app.test_client()
+    assert client.get("/metrics").status_code == 403
+    assert client.get("/metrics", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    response = client.get("/metrics", headers=ADMIN)
+    assert response.status_code == 200
+    assert b"db_pool_checkouts" in response.data
+
+    monkeypatch.delenv("ADMIN_TOKEN")
+    assert client.get("/metrics", headers=ADMIN).status_code == 403
+
+def test_metrics_on_an_in_memory_database(memory_app):
+    assert memory_app.test_client().get("/metrics", headers=ADMIN).status_code == 200
+
+def test_a_failed_statement_leaves_nothing_on_its_connection():
+    metrics = Metrics()
+    engine = create_engine("sqlite://")
+    metrics.instrument_engine(engine)
+    with engine.connect() as connection:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                connection.execute(text("SELECT * FROM NoSuchTable"))
+        assert "metrics_query_start" not in connection.info
+        connection.execute(text("SELECT 1"))
+        assert "metrics_query_start" not in connection.info
+    assert metrics.sql_latency.render()[-1] == "sql_query_duration_seconds_count 1"
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+import carbon
+import pytest
+
+from conftest import applianceBody
+
+START = datetime(2025, 1, 1, 12, 0, 0)
+
+
+# Store count logs for user_id, three per LogTime so pages of 10 split rows with equal times; returns
+# their ActivityLogIDs newest first, the order the pages show them in
+def addLogs(app, count, user_id=1):
+    with app.app_context():
+        entries = [carbon.prepareLogEntry("appliance", applianceBody(str(START + timedelta(hours=i // 3))))
+                   for i in range(count)]
+        db_session = carbon.SessionFactory()
+        try:
+            log_ids = carbon.insertActivityLogs(db_session, user_id, entries)
+            db_session.commit()
+        finally:
+            db_session.close()
+    return [log_id for _, log_id in sorted(zip((e["log_time"] for e in entries), log_ids), reverse=True)]
+
+def page(app, **kwargs):
+    with app.app_context():
+        db_session = carbon.SessionFactory()
+        try:
+            logs, next_cursor, prev_cursor = carbon.fetchLogPage(db_session, 1, **kwargs)
+        finally:
+            db_session.close()
+    return [log.ActivityLogID for log in logs], next_cursor, prev_cursor
+
+
+def test_walking_older_pages_visits_every_log_once(app):
+    expected = addLogs(app, 25)
+    addLogs(app, 5, user_id=2)
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        ids, cursor, prev_cursor = page(app, after=cursor, limit=10)
+        assert (prev_cursor is None) == (pages == 0)
+        seen += ids
+        pages += 1
+        if cursor is None:
+            break
+
+    assert seen == expected
+    assert pages == 3
+
+def test_before_cursor_goes_back_to_the_same_page(app):
+    addLogs(app, 25)
+    first, next_cursor, _ = page(app, limit=10)
+    second, _, prev_cursor = page(app, after=next_cursor, limit=10)
+
+    back, forward_cursor, newer_cursor = page(app, before=prev_cursor, limit=10)
+    assert back == first
+    assert newer_cursor is None
+    assert page(app, after=forward_cursor, limit=10)[0] == second
+
+def test_exact_multiple_of_the_page_size_has_no_empty_last_page(app):
+    addLogs(app, 20)
+    _, next_cursor, _ = page(app, limit=10)
+    ids, last_cursor, _ = page(app, after=next_cursor, limit=10)
+    assert len(ids) == 10
+    assert last_cursor is None
+
+def test_no_logs(app):
+    assert page(app) == ([], None, None)
+
+# Not base64, and base64 of text without the separator
+@pytest.mark.parametrize("cursor", ["not-a-cursor!", "bm9waXBl"])
+def test_bad_cursor(app, client, cursor):
+    addLogs(app, 3)
+    with pytest.raises(ValueError):
+        page(app, after=cursor)
+    assert client.get("/api/logs", query_string={"after": cursor}).status_code == 400
+    assert client.get("/userlog/1", query_string={"before": cursor}).status_code == 302
+
+def test_api_logs_clamps_the_limit_and_reports_the_total(app, client):
+    addLogs(app, 5)
+    body = client.get("/api/logs", query_string={"limit": 0}).get_json()
+    assert len(body["logs"]) == 1
+    assert body["total"] == 5
+    assert body["next"] is not None and body["prev"] is None
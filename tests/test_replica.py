@@ -0,0 +1,135 @@
+import shutil
+import sqlite3
+import time
+
+import carbon
+import pytest
+
+from conftest import applianceBody, loggedIn, makeApp, migratedDatabase
+
+
+# The replica is a read-only copy of the primary taken before the test logs anything, so a read that sees the
+# test's logs went to the primary. Not copied, the replica's file isn't there and can't be opened
+@pytest.fixture
+def replicated(tmp_path):
+    apps = []
+    def make(copied=True):
+        primary = migratedDatabase(tmp_path / "primary.db")
+        path = tmp_path / "replica.db"
+        if copied:
+            shutil.copy(tmp_path / "primary.db", path)
+        flask_app = makeApp(primary, DATABASE_REPLICA_URL=f"sqlite:///file:{path}?mode=ro&uri=true")
+        apps.append(flask_app)
+        return flask_app, flask_app.extensions["carbon"].replica_router
+    yield make
+    for flask_app in apps:
+        state = flask_app.extensions["carbon"]
+        state.engine.dispose()
+        if state.replica_router.replica is not None:
+            state.replica_router.replica.dispose()
+
+# Reads served by the replica, kept on the primary after a write and fallen back to the primary, so far
+def reads(router):
+    stats = router.stats()
+    return stats["reads_replica"], stats["reads_primary_sticky"], stats["reads_primary_fallback"]
+
+def since(router, before):
+    return tuple(now - then for now, then in zip(reads(router), before))
+
+def logCount(client):
+    response = client.get("/api/logs")
+    assert response.status_code == 200
+    return response.get_json()["total"]
+
+def logDirectly(flask_app):
+    with flask_app.app_context():
+        db_session = carbon.SessionFactory()
+        try:
+            carbon.insertActivityLog(db_session, 1, carbon.prepareLogEntry("appliance", applianceBody()))
+            db_session.commit()
+        finally:
+            db_session.close()
+
+
+def test_reads_go_to_the_replica(replicated):
+    flask_app, router = replicated()
+    logDirectly(flask_app)
+    before = reads(router)
+
+    assert logCount(loggedIn(flask_app)) == 0
+    assert since(router, before) == (1, 0, 0)
+
+def test_a_write_keeps_the_users_reads_on_the_primary_for_a_while(replicated):
+    flask_app, router = replicated()
+    router.sticky_seconds = 0.2
+    client = loggedIn(flask_app)
+
+    assert client.post("/api/log-appliance", json=applianceBody()).status_code == 200
+    before = reads(router)
+    assert logCount(client) == 1
+    # Someone else's reads aren't affected
+    assert logCount(loggedIn(flask_app, 2)) == 0
+
+    time.sleep(0.3)
+    assert logCount(client) == 0
+    assert since(router, before) == (2, 1, 0)
+
+def test_a_failed_write_does_not_stick(replicated):
+    flask_app, router = replicated()
+    client = loggedIn(flask_app)
+
+    assert client.post("/api/log-appliance", json=applianceBody(name="No such appliance")).status_code == 404
+    before = reads(router)
+    logCount(client)
+    assert since(router, before) == (1, 0, 0)
+
+def test_an_unreachable_replica_falls_back_to_the_primary(replicated):
+    flask_app, router = replicated(copied=False)
+    logDirectly(flask_app)
+    before = reads(router)
+    client = loggedIn(flask_app)
+
+    assert logCount(client) == 1
+    assert logCount(client) == 1
+    assert since(router, before) == (0, 0, 2)
+    assert (router.available(), router.stats()["failures"]) == (False, 1)
+
+def test_a_replica_failing_mid_query_is_taken_out_of_rotation(replicated):
+    flask_app, router = replicated()
+    logDirectly(flask_app)
+    client = loggedIn(flask_app)
+    assert logCount(client) == 0
+
+    # Break the replica under its open connections
+    broken = sqlite3.connect(router.replica.url.database.removeprefix("file:").partition("?")[0])
+    broken.execute("DROP TABLE ActivityLog")
+    broken.commit()
+    broken.close()
+
+    # The query that hit the broken replica fails, the next one goes to the primary
+    assert client.get("/api/logs").status_code == 500
+    assert not router.available()
+    assert logCount(client) == 1
+    assert router.stats()["failures"] == 1
+
+    router.mark_down("still down")
+    assert router.stats()["failures"] == 1
+
+def test_without_a_replica_everything_reads_the_primary(app):
+    router = app.extensions["carbon"].replica_router
+    logDirectly(app)
+
+    assert logCount(loggedIn(app)) == 1
+    assert not router.enabled
+    assert reads(router) == (0, 0, 0)
+
+def test_replica_stats_on_a_pool_without_counts(tmp_path, monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    flask_app = makeApp(migratedDatabase(tmp_path / "primary.db"), DATABASE_REPLICA_URL="sqlite://")
+    try:
+        response = flask_app.test_client().get("/api/replica-stats", headers={"X-Admin-Token": "secret"})
+        assert response.status_code == 200
+        assert "checked_out" not in response.get_json()
+    finally:
+        flask_app.extensions["carbon"].engine.dispose()
+        flask_app.extensions["carbon"].replica_router.replica.dispose()
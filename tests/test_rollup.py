@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
+
+import carbon
+import migrate
+import pytest
+
+from conftest import USERS, applianceBody, assertRollupMatches, loggedIn, makeApp
+
+def logIds(engine, user_id=1):
+    with engine.connect() as connection:
+        return [row[0] for row in connection.execute(
+            text("SELECT ActivityLogID FROM ActivityLog WHERE UserID = :user_id ORDER BY ActivityLogID"),
+            {"user_id": user_id})]
+
+def logSome(client, days=range(1, 6)):
+    for day in days:
+        assert client.post("/api/log-appliance", json=applianceBody(f"2025-01-{day:02d} 09:00:00")).status_code == 200
+        assert client.post("/api/log-food", json={
+            "foodName": "Beef", "quantity": 0.5, "logTime": f"2025-01-{day:02d} 19:30:00"}).status_code == 200
+
+@pytest.fixture
+def logged(app, client):
+    logSome(client)
+    logSome(loggedIn(app, 2), days=(2, 3))
+    response = client.post("/api/log-batch", json={"entries": [
+        dict(applianceBody(f"2025-01-{day:02d} 21:00:00"), type="appliance") for day in (1, 1, 7)
+    ]})
+    assert response.get_json()["logged"] == 3
+    return client
+
+
+def test_logging_keeps_the_rollup_in_step(engine, logged):
+    assert assertRollupMatches(engine) > 0
+
+def test_deletes_keep_the_rollup_in_step(app, engine, logged):
+    ids = logIds(engine)
+    assert logged.post(f"/delete_log/{ids[0]}").status_code == 302
+    assertRollupMatches(engine)
+
+    body = logged.post("/api/logs/delete", json={"ids": ids[1:4] + [logIds(engine, 2)[0]]}).get_json()
+    assert body["deleted"] == 3 and len(body["notFound"]) == 1  # bob's log isn't alice's to delete
+    assertRollupMatches(engine)
+
+    assert logged.post("/api/logs/delete", json={"start": "2025-01-01", "end": "2025-01-03"}).status_code == 200
+    assertRollupMatches(engine)
+    with engine.connect() as connection:
+        # Days with nothing left logged are gone, not left at zero
+        assert connection.execute(text("SELECT COUNT(*) FROM DailyCo2eRollup WHERE LogCount <= 0")).scalar() == 0
+
+def test_recalc_keeps_the_rollup_in_step(app, engine, logged):
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["add-factor", "--type", "appliance", "--from", "2025-01-03", "--factor", "0.5"])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(args=["recalc-co2e", "--type", "appliance", "--chunk", "4"])
+    assert result.exit_code == 0, result.output
+
+    with engine.connect() as connection:
+        rows = connection.execute(text("SELECT Co2e, Quantity, LogTime FROM ActivityLog WHERE ActivityTypeID = 1")).fetchall()
+    for co2e, quantity, log_time in rows:
+        factor = 0.5 if log_time >= datetime(2025, 1, 3) else carbon.CO2_PER_KWH
+        assert co2e == pytest.approx(quantity * factor)
+    assertRollupMatches(engine)
+
+    # Nothing left to change the second time
+    result = runner.invoke(args=["recalc-co2e", "--type", "appliance"])
+    assert "0 changed" in result.output
+    assertRollupMatches(engine)
+
+def test_purge_keeps_the_rollup_in_step(app, engine, client, logged):
+    recent = (datetime.now() - timedelta(days=1)).replace(microsecond=0)
+    assert client.post("/api/log-appliance", json=applianceBody(str(recent))).status_code == 200
+
+    result = app.test_cli_runner().invoke(args=["purge-logs", "--days", "30", "--chunk", "3"])
+    assert result.exit_code == 0, result.output
+    assert len(logIds(engine)) == 1 and logIds(engine, 2) == []
+    assert assertRollupMatches(engine) == 1
+
+def test_migrating_rebuilds_the_rollup_history_logged_before_it(tmp_path):
+    url = f"sqlite:///{tmp_path / 'carbon.db'}"
+    engine = create_engine(url)
+    try:
+        migrate.migrate(engine, target=1)
+        with engine.begin() as connection:
+            connection.execute(
+                text("INSERT INTO UserDetails (UserID, username, email, password) VALUES (:id, :name, :name, 'x')"),
+                [{"id": user_id, "name": name} for user_id, name in USERS.items()]
+            )
+            for log_id, (user_id, day) in enumerate([(1, 1), (1, 1), (1, 2), (2, 2)], start=1):
+                connection.execute(text(
+                    "INSERT INTO ActivityLog (ActivityLogID, ActivityItemID, ActivityTypeID, Co2e, LogTime)"
+                    f" VALUES ({log_id}, 1, 1, {log_id * 0.5}, '2024-12-{day:02d} 10:00:00')"))
+                connection.execute(text(f"INSERT INTO UserLog (UserID, ActivityLogID) VALUES ({user_id}, {log_id})"))
+
+        # A deployment that applied 0002 and has logged since: the rollup holds only the new log
+        migrate.migrate(engine, target=8)
+        flask_app = makeApp(url)
+        try:
+            assert loggedIn(flask_app).post("/api/log-appliance", json=applianceBody()).status_code == 200
+        finally:
+            flask_app.extensions["carbon"].engine.dispose()
+        with engine.connect() as connection:
+            assert connection.execute(text("SELECT COUNT(*) FROM DailyCo2eRollup")).scalar() == 1
+
+        migrate.migrate(engine)
+        assert assertRollupMatches(engine) == 4
+    finally:
+        engine.dispose()